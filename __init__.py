@@ -35,18 +35,25 @@ def set_dependencies_installed(are_installed):
     
 # Blender modules:
 import bpy
+from bpy_extras.io_utils import ExportHelper, ImportHelper
 
 # Python modules:
 from pathlib import Path
 import sys
 import importlib
+import random
 import subprocess
+import zipfile
 
 # Local modules:
 sys.path.append(Path(__file__).parent)
 
 from .src import helpers
-from .src.textures import load_texture_maps
+from .src.job_queue import PENDING, RUNNING, JobQueue
+from .src.result_cache import ResultCache, request_key
+from .src.textures import (
+    image_index, load_material_library, load_shared_maps, load_texture_maps, reload_texture_maps,
+)
 
 # Refresh Locals for development:
 if "bpy" in locals():
@@ -73,6 +80,15 @@ class MC_PGT_Input_Properties_Pre(bpy.types.PropertyGroup):
         subtype="DIR_PATH",
     )
 
+    wheelhouse_path: bpy.props.StringProperty(
+        name="Offline Wheelhouse",
+        description="Optional directory of downloaded wheels (pip download / pip wheel) to install the dependencies "
+        "from, without network access",
+        default="",
+        maxlen=1024,
+        subtype="DIR_PATH",
+    )
+
     agree_to_license: bpy.props.BoolProperty(
         name="I agree",
         default=False,
@@ -126,7 +142,14 @@ class MCPRE_OT_install_dependencies(bpy.types.Operator):
         try:
             pm.update_named_paths(mc_path, "material_crafter")
             pm.update_named_paths(venv_path, "venv")
-            helpers.install_modules(venv_path=venv_path, context=context)
+            pm.update_named_paths(venv_path / "Lib" / "site-packages", "site-packages")
+            wheelhouse = bpy.context.scene.input_tool_pre.wheelhouse_path
+            helpers.install_modules(
+                venv_path=venv_path,
+                context=context,
+                cache_dir=mc_path / "pip-cache",
+                wheelhouse=Path(bpy.path.abspath(wheelhouse)) if wheelhouse else None,
+            )
 
             self.report({"INFO"}, "Python modules installed successfully.")
             
@@ -136,21 +159,91 @@ class MCPRE_OT_install_dependencies(bpy.types.Operator):
             self.report({"ERROR"}, str(err))
             return {"CANCELLED"}
 
-        set_dependencies_installed(True)
+        missing = helpers.missing_dependencies()
+        if missing:
+            self.report({"WARNING"}, f"Some packages could not be installed: {', '.join(missing)}")
+        set_dependencies_installed(not missing)
         
-        for mc_cls in classes:
-            if not mc_cls.is_registered:
-                bpy.utils.register_class(mc_cls)
-
-        bpy.types.Scene.input_tool = bpy.props.PointerProperty(
-            type=MC_PGT_Input_Properties
-        )
+        register_main_classes()
         
         installing = False
 
         return {"FINISHED"}
 
 
+def register_main_classes():
+    for mc_cls in classes:
+        if not mc_cls.is_registered:
+            bpy.utils.register_class(mc_cls)
+
+    bpy.types.Scene.input_tool = bpy.props.PointerProperty(
+        type=MC_PGT_Input_Properties
+    )
+
+
+class MCPRE_OT_export_environment(bpy.types.Operator, ExportHelper):
+    bl_idname = "mc.export_environment"
+    bl_label = "Export Environment"
+    bl_description = (
+        "Exports the installed environment as an archive, which can be imported on other workstations or Blender "
+        "versions with the same Python version instead of installing the dependencies again."
+    )
+    bl_options = {"REGISTER", "INTERNAL"}
+
+    filename_ext = ".zip"
+    filter_glob: bpy.props.StringProperty(default="*.zip", options={"HIDDEN"})
+
+    @classmethod
+    def poll(cls, context):
+        if not dependencies_installed:
+            cls.poll_message_set("Please install the dependencies before exporting them")
+        return dependencies_installed
+
+    def execute(self, context):
+        archive_path = helpers.export_environment(pm.named_paths['venv'], Path(self.filepath), MC_version)
+        self.report({"INFO"}, f"Environment exported to {archive_path}")
+        return {"FINISHED"}
+
+
+class MCPRE_OT_import_environment(bpy.types.Operator, ImportHelper):
+    bl_idname = "mc.import_environment"
+    bl_label = "Import Environment"
+    bl_description = (
+        "Imports an environment archive exported by Material Crafter into the Material Crafter Path, "
+        "instead of installing the dependencies."
+    )
+    bl_options = {"REGISTER", "INTERNAL"}
+
+    filename_ext = ".zip"
+    filter_glob: bpy.props.StringProperty(default="*.zip", options={"HIDDEN"})
+
+    @classmethod
+    def poll(cls, context):
+        if not bpy.context.scene.input_tool_pre.agree_to_license:
+            cls.poll_message_set("Please accept the license before importing")
+        return bpy.context.scene.input_tool_pre.agree_to_license
+
+    def execute(self, context):
+        mc_path = (
+            Path(bpy.context.scene.input_tool_pre.mc_path) / "Material-Crafter-Add-on"
+        )
+        try:
+            helpers.import_environment(Path(self.filepath), mc_path)
+        except (ValueError, KeyError, OSError, zipfile.BadZipFile) as err:
+            self.report({"ERROR"}, str(err))
+            return {"CANCELLED"}
+
+        missing = helpers.missing_dependencies()
+        if missing:
+            self.report({"WARNING"}, f"Missing packages, please run the installation: {', '.join(missing)}")
+        else:
+            self.report({"INFO"}, "Environment imported successfully.")
+        set_dependencies_installed(not missing)
+
+        register_main_classes()
+        return {"FINISHED"}
+
+
 # ======== Pre-Dependency UI Panels ======== #
 class MCPRE_PT_warning_panel(bpy.types.Panel):
     bl_label = "Material Crafter Warning"
@@ -193,6 +286,9 @@ class MCPRE_preferences(bpy.types.AddonPreferences):
         row = layout.row()
         row.prop(input_tool_pre, "mc_path")
 
+        row = layout.row()
+        row.prop(input_tool_pre, "wheelhouse_path")
+
         # Hugging Face and Material Crafter License agreement:
 
         # This line represents the character space readable in Blender's UI system:
@@ -224,6 +320,10 @@ class MCPRE_preferences(bpy.types.AddonPreferences):
         row_install_dependencies_button.operator(
             MCPRE_OT_install_dependencies.bl_idname, icon="CONSOLE"
         )
+
+        row = layout.row()
+        row.operator(MCPRE_OT_import_environment.bl_idname, icon="IMPORT")
+        row.operator(MCPRE_OT_export_environment.bl_idname, icon="EXPORT")
         
         if installing:
             progress_bar(self, context)
@@ -241,6 +341,8 @@ pre_dependency_classes = (
     MC_PGT_Input_Properties_Pre,
     # Operator Classes:
     MCPRE_OT_install_dependencies,
+    MCPRE_OT_export_environment,
+    MCPRE_OT_import_environment,
     # Panel Classes
     MCPRE_preferences,
     MCPRE_PT_warning_panel,
@@ -304,9 +406,37 @@ class MC_PGT_Input_Properties(bpy.types.PropertyGroup):
         items=[
             ("fp32", "FP32 (Full)", "Full Precision"),
             ("fp16", "FP16 (Half)", "Half Precision"),
+            ("bf16", "BF16 (Mixed)", "Full precision weights, computations in bfloat16 on supporting CPUs "
+             "(AVX512-BF16, AMX) and GPUs. Recommended on CPU"),
+            ("int8-cpu", "INT8 (CPU)", "Linear layers of the UNet and text encoder quantized to int8. Faster and "
+             "lighter on CPU, slightly lower quality. The quantized model is cached in the Material Crafter Path"),
         ],
     )
 
+    cpu_threads: bpy.props.IntProperty(
+        name="CPU Threads",
+        default=0,
+        min=0,
+        max=256,
+        description="Threads used by each operation on CPU. With 0 all physical cores are used",
+    )
+
+    cpu_interop_threads: bpy.props.IntProperty(
+        name="CPU Inter-op Threads",
+        default=0,
+        min=0,
+        max=64,
+        description="Threads running independent operations in parallel on CPU. With 0 the default is used. "
+        "Only applied when the background worker starts",
+    )
+
+    torch_compile: bpy.props.BoolProperty(
+        name="Compile Model",
+        default=False,
+        description="Compiles the model with torch.compile. The first generation takes several minutes longer, "
+        "later ones are faster. Compiled graphs are cached in the Material Crafter Path",
+    )
+
     scheduler: bpy.props.EnumProperty(
         name="Scheduler",
         default="ddim",
@@ -337,6 +467,20 @@ class MC_PGT_Input_Properties(bpy.types.PropertyGroup):
         default=True,
         description="Enables patched diffusion. Reduces memory consumption when working with high resolutions but can affect quality",
     )
+
+    tiled_generation: bpy.props.BoolProperty(
+        name="Tiled Generation",
+        default=False,
+        description="Denoises large materials in overlapping tiles sized to the memory budget, blended seamlessly. "
+        "Keeps memory flat as the resolution grows. Replaces patched diffusion",
+    )
+
+    tile_memory_gb: bpy.props.FloatProperty(
+        name="Tile Memory (GB)",
+        default=0.0,
+        min=0.0,
+        description="Memory budget of a tile. With 0, 80% of the free memory of the device is used",
+    )
     
     free_u: bpy.props.BoolProperty(
         name="Free U",
@@ -362,6 +506,26 @@ class MC_PGT_Input_Properties(bpy.types.PropertyGroup):
         description="Width of the generated textures (higher sizes consume more memory)",
     )
 
+    upscale_from: bpy.props.IntProperty(
+        name="Diffusion Resolution",
+        default=0,
+        min=0,
+        max=4096,
+        description="Generates the material with this longest side, then upscales the maps to Height x Width. "
+        "Much faster than diffusing at high resolutions. 0 diffuses directly at Height x Width",
+    )
+
+    upscaler: bpy.props.EnumProperty(
+        name="Upscaler",
+        default="resample",
+        description="How the maps are upscaled from the diffusion resolution",
+        items=[
+            ("resample", "Resample", "Fast bicubic resampling of every map, seamless for tileable materials"),
+            ("x4", "Model (x4)", "Base color upscaled with the Stable Diffusion x4 upscaler, the other maps "
+             "resampled. Downloads an additional model. Raise the RAM/VRAM budget to keep both models loaded"),
+        ],
+    )
+
     num_steps: bpy.props.IntProperty(
         name="Steps",
         default=50,
@@ -371,15 +535,424 @@ class MC_PGT_Input_Properties(bpy.types.PropertyGroup):
         description="Number of diffusion sampling steps",
     )
 
+    seed: bpy.props.IntProperty(
+        name="Seed",
+        default=-1,
+        min=-1,
+        description="Seed of the generation. Use -1 for a random seed",
+    )
+
+    max_queue_jobs: bpy.props.IntProperty(
+        name="Parallel Jobs",
+        default=1,
+        min=1,
+        max=8,
+        description="Queued generations running at the same time. Generations in the background worker run one "
+        "after the other, more than one only helps when Keep Model Loaded is disabled",
+    )
+
+    assign_to: bpy.props.EnumProperty(
+        name="Apply To",
+        default="active",
+        description="Objects receiving the generated material",
+        items=[
+            ("active", "Active Object", "First material slot of the active object"),
+            ("selected", "Selected Objects", "Every material slot of the selected objects"),
+        ],
+    )
+
+    draft_resolution: bpy.props.IntProperty(
+        name="Draft Resolution",
+        default=256,
+        min=128,
+        max=4096,
+        description="Longest side of the preview materials. Set it to the full size for previews with the exact "
+        "layout of the refined material, lower sizes are faster but the layout can change when refining",
+    )
+
+    draft_steps: bpy.props.IntProperty(
+        name="Draft Steps",
+        default=10,
+        min=1,
+        max=1000,
+        description="Number of diffusion sampling steps of the preview materials",
+    )
+
+    batch_prompts: bpy.props.StringProperty(
+        name="Batch Prompts",
+        description="Prompts for batch generation, separated by ';'. With image prompts, image paths separated by ';'",
+    )
+
+    batch_seeds: bpy.props.StringProperty(
+        name="Batch Seeds",
+        description="Seeds for batch generation, separated by ','. Every prompt is generated with every seed. "
+        "If empty, the Seed value is used",
+    )
+
+    batch_size: bpy.props.IntProperty(
+        name="Batch Size",
+        default=0,
+        min=0,
+        max=64,
+        description="Number of materials generated in a single pipeline call. Use 0 to adapt it to the available memory",
+    )
+
+    map_format: bpy.props.EnumProperty(
+        name="Map Format",
+        default="png",
+        description="File format of the base color, roughness and metallic maps",
+        items=[
+            ("png", "PNG", "8-bit PNG"),
+            ("webp", "WebP", "Lossless WebP, smaller files"),
+        ],
+    )
+
+    data_map_format: bpy.props.EnumProperty(
+        name="Height/Normal Format",
+        default="png",
+        description="File format of the height and normal maps, higher precision avoids banding in displacement and shading",
+        items=[
+            ("png", "PNG", "8-bit PNG"),
+            ("png16", "PNG 16-bit", "16-bit PNG"),
+            ("exr", "EXR Half", "Half-float OpenEXR, fastest to write"),
+        ],
+    )
+
+    pack_maps: bpy.props.BoolProperty(
+        name="Pack Height/Roughness/Metallic",
+        default=False,
+        description="Stores the height, roughness and metallic maps in the channels of a single image. "
+        "Reduces the files, texture memory and load time of each material",
+    )
+
+    fast_compression: bpy.props.BoolProperty(
+        name="Fast Compression",
+        default=False,
+        description="Writes the maps with a faster but weaker compression, producing larger files",
+    )
+
+    use_result_cache: bpy.props.BoolProperty(
+        name="Reuse Identical Results",
+        default=True,
+        description="Reuses the maps of a previous generation with the same prompt, seed and parameters instead of "
+        "generating them again. Only applies when the Seed is set",
+    )
+
+    result_cache_gb: bpy.props.FloatProperty(
+        name="Result Cache Size (GB)",
+        default=2.0,
+        min=0.0,
+        description="Maximum disk space of reusable results. Least recently used results are removed when exceeded",
+    )
+
+    use_embedding_cache: bpy.props.BoolProperty(
+        name="Reuse Prompt Encodings",
+        default=True,
+        description="Encodes each prompt once and reuses its embeddings across generations and sessions, "
+        "stored next to the model weights. Saves the encoder time when iterating on seeds, steps or guidance",
+    )
+
+    transfer_mode: bpy.props.EnumProperty(
+        name="Transfer",
+        default="disk",
+        description="How the generated maps are handed over to Blender by the background worker",
+        items=[
+            ("disk", "Files", "The maps are saved to disk and loaded from the files"),
+            ("shm", "Memory", "The maps are handed over in shared memory, without encoding and decoding files"),
+        ],
+    )
+
+    write_to_disk: bpy.props.BoolProperty(
+        name="Save Maps to Disk",
+        default=True,
+        description="Also saves the maps to the save path, in the background. If disabled, the images are packed "
+        "in the .blend file",
+    )
+
+    keep_worker_alive: bpy.props.BoolProperty(
+        name="Keep Model Loaded",
+        default=True,
+        description="Keeps a background worker with the model loaded between generations. "
+        "Avoids reloading the model at every generation, at the cost of keeping it in memory",
+    )
+
+    worker_idle_timeout: bpy.props.IntProperty(
+        name="Idle Timeout (s)",
+        default=600,
+        min=10,
+        max=86400,
+        description="Seconds without requests after which the background worker shuts down and frees memory",
+    )
+
+    ram_budget_gb: bpy.props.FloatProperty(
+        name="RAM Budget (GB)",
+        default=0.0,
+        min=0.0,
+        description="Memory for models kept loaded on the CPU. Least recently used models are unloaded "
+        "when exceeded. With 0 only the last used model is kept",
+    )
+
+    vram_budget_gb: bpy.props.FloatProperty(
+        name="VRAM Budget (GB)",
+        default=0.0,
+        min=0.0,
+        description="Memory for models kept loaded on the GPU. Least recently used models are unloaded "
+        "when exceeded. With 0 only the last used model is kept",
+    )
+
+
+def collect_generation_inputs(input_tool):
+    r'''
+    Builds the arguments of sd_functions generate from the user input properties, as (user_input, sd_kwargs)
+    '''
+    if input_tool.prompt_type == "text":
+        prompt = input_tool.prompt
+    elif input_tool.prompt_type == "image":
+        prompt = input_tool.image_prompt
+        assert Path(prompt).exists(), f"Image prompt path not found at {prompt}"
+
+    user_input = {
+        "name": input_tool.dir_name,
+        "prompt": prompt,
+        "prompt_type": input_tool.prompt_type,
+        "save_path": Path(bpy.path.abspath(input_tool.save_path)),
+        "model_path": input_tool.model_id,
+        "precision": input_tool.precision,
+        "device": input_tool.device,
+    }
+
+    sd_kwargs = {
+        "guidance_scale": input_tool.guidance_scale,
+        "height": input_tool.height,
+        "width": input_tool.width,
+        "num_inference_steps": input_tool.num_steps,
+        "scheduler": input_tool.scheduler,
+        "tileable": input_tool.tileable,
+        "patched": input_tool.patched and not input_tool.tiled_generation,
+        "tiled_generation": input_tool.tiled_generation,
+        "tile_memory_gb": input_tool.tile_memory_gb,
+        "upscale_from": input_tool.upscale_from,
+        "upscaler": input_tool.upscaler,
+        "use_embedding_cache": input_tool.use_embedding_cache,
+        "free_u": input_tool.free_u,
+        "seed": input_tool.seed,
+        "map_formats": {
+            "basecolor": input_tool.map_format,
+            "roughness": input_tool.map_format,
+            "metallic": input_tool.map_format,
+            "height": input_tool.data_map_format,
+            "normal": input_tool.data_map_format,
+            "packed": input_tool.data_map_format,
+        },
+        "pack_maps": input_tool.pack_maps,
+        "compress_level": 1 if input_tool.fast_compression else 6,
+        "torch_compile": input_tool.torch_compile,
+    }
+    if input_tool.torch_compile:
+        sd_kwargs["compile_cache_dir"] = (pm.named_paths['material_crafter'] / "torch_compile_cache").as_posix()
+    if input_tool.use_embedding_cache:
+        sd_kwargs["embedding_cache_dir"] = (pm.named_paths['model'] / "material_crafter_embeddings").as_posix()
+    if input_tool.prompt_type == "image":
+        sd_kwargs["image_prompt_cache_dir"] = (pm.named_paths['material_crafter'] / "image_prompt_cache").as_posix()
+    if input_tool.precision == "int8-cpu":
+        sd_kwargs["quantized_cache_dir"] = (pm.named_paths['material_crafter'] / "quantized_models").as_posix()
+    if input_tool.device == "cpu":
+        sd_kwargs["cpu_threads"] = input_tool.cpu_threads
+        sd_kwargs["cpu_interop_threads"] = input_tool.cpu_interop_threads
+    return user_input, sd_kwargs
+
+
+def draft_inputs(input_tool, sd_kwargs):
+    r'''
+    Turns the generation arguments into a fast preview: draft resolution and steps, no upscaling nor tiling, and a
+    concrete seed so that the preview can be refined with the same one.
+    '''
+    scale = min(1.0, input_tool.draft_resolution / max(input_tool.height, input_tool.width))
+    sd_kwargs["height"] = max(8, round(input_tool.height * scale / 8) * 8)
+    sd_kwargs["width"] = max(8, round(input_tool.width * scale / 8) * 8)
+    sd_kwargs["num_inference_steps"] = min(input_tool.draft_steps, input_tool.num_steps)
+    sd_kwargs["upscale_from"] = 0
+    sd_kwargs["tiled_generation"] = False
+    sd_kwargs["patched"] = False
+    if sd_kwargs["seed"] < 0:
+        sd_kwargs["seed"] = random.randrange(2**31 - 1)
+    return sd_kwargs
+
+
+def target_objects(input_tool):
+    r'''
+    Objects receiving the generated material, see assign_to, as (objects, all_slots)
+    '''
+    active = bpy.context.active_object
+    if input_tool.assign_to == "active":
+        return [active], False
+    selected = [obj for obj in bpy.context.selected_objects if hasattr(obj.data, "materials")]
+    if active not in selected:
+        selected.insert(0, active)
+    return selected, True
+
+
+def result_cache(input_tool):
+    return ResultCache(pm.named_paths['material_crafter'] / "result_cache", input_tool.result_cache_gb)
+
+
+def worker_config(input_tool):
+    r'''
+    Launch configuration of the generation worker, or None to run generations in a new process
+    '''
+    if not input_tool.keep_worker_alive:
+        return None
+    return (
+        input_tool.worker_idle_timeout,
+        input_tool.ram_budget_gb,
+        input_tool.vram_budget_gb,
+    )
+
+
+def start_generation(operation_function, arguments):
+    r'''
+    Starts a sd_functions command in the background, in the generation worker if enabled or in a new process otherwise.
+    '''
+    input_tool = bpy.context.scene.input_tool
+    return helpers.GenerationJob(
+        pm.named_paths['venv'], operation_function, arguments, worker_config(input_tool)
+    ).start()
+
+
+# Generation queue, journaled in the Material Crafter Path, created at registration
+job_queue = None
+
+
+def follow_queue_paths():
+    r'''
+    Moves the queue journal and the Venv of the queued jobs along when the Material Crafter Path changes.
+    '''
+    journal_path = pm.named_paths['material_crafter'] / "job_queue.jsonl"
+    if job_queue.journal.path != journal_path or job_queue.venv_path != pm.named_paths['venv']:
+        job_queue.relocate(journal_path, pm.named_paths['venv'])
+
+
+def apply_queued_job(job):
+    r'''
+    Applies the material of a finished queued job to its target objects, once the .blend file it was queued from is
+    open. Target objects deleted since then are skipped, if none is left the material is kept unassigned.
+    '''
+    target = job["target"]
+    if not target.get("blend_file"):
+        # Any unsaved session would match, the maps stay in the save path
+        raise ValueError("queued from an unsaved .blend file")
+    if target["blend_file"] != bpy.data.filepath:
+        return False
+
+    objects = [bpy.data.objects[name] for name in target.get("objects", []) if name in bpy.data.objects]
+    arguments = job["arguments"]
+    load_texture_maps(
+        Path(arguments["save_path"]), arguments["name"], assign=bool(objects), objects=objects,
+        all_slots=target.get("all_slots", False),
+    )
+    return True
+
+
+def queue_timer():
+    r'''
+    Advances the generation queue, every second while jobs are queued or running.
+    '''
+    if not dependencies_installed:
+        return 5.0
+
+    follow_queue_paths()
+    input_tool = getattr(bpy.context.scene, "input_tool", None)
+    if input_tool is not None:
+        job_queue.max_running = input_tool.max_queue_jobs
+    job_queue.tick(apply_queued_job)
+
+    if not job_queue.busy:
+        return 5.0
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == "VIEW_3D":
+                area.tag_redraw()
+    return 1.0
+
+
+@bpy.app.handlers.persistent
+def queue_load_post(*args):
+    r'''
+    Applies the queued jobs finished for the .blend file just opened.
+    '''
+    if dependencies_installed:
+        follow_queue_paths()
+        job_queue.tick(apply_queued_job)
+
 
 # ======== Operators ======== #
-class CreateTextures(bpy.types.Operator):
+class GenerationModal:
+    r'''
+    Shared modal behavior of the generation operators: the generation runs as a background job polled on a timer,
+    so that Blender stays interactive. Pressing ESC or the Cancel button stops the generation.
+    '''
+    _job = None
+    _timer = None
+
+    def start_job(self, context, operation_function, arguments):
+        self._job = start_generation(operation_function, arguments)
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.5, window=context.window)
+        wm.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+    def modal(self, context, event):
+        if event.type == "ESC" and event.value == "PRESS":
+            self._job.cancel()
+
+        if event.type != "TIMER":
+            return {"PASS_THROUGH"}
+
+        wm = context.window_manager
+        wm.progress, wm.progress_text = self._job.progress_status()
+        for area in context.screen.areas:
+            if area.type == "VIEW_3D":
+                area.tag_redraw()
+
+        if not self._job.done:
+            return {"PASS_THROUGH"}
+
+        context.window_manager.event_timer_remove(self._timer)
+        self._timer = None
+        for area in context.screen.areas:
+            area.tag_redraw()
+
+        if self._job.cancelled:
+            self.report({"WARNING"}, "Generation cancelled")
+            return {"CANCELLED"}
+
+        if self._job.error is not None:
+            print(self._job.error)
+            self.report({"ERROR"}, f"Running generation raised an exception:\n {self._job.error}")
+            return {"CANCELLED"}
+
+        return self.finish(context, self._job.output)
+
+    def finish(self, context, output):
+        raise NotImplementedError
+
+
+class CreateTextures(GenerationModal, bpy.types.Operator):
     bl_idname = "mc.create_textures"
     bl_label = "Create Textures"
     bl_description = "Creates textures with Stable Diffusion by using the Texture Description as text input."
     bl_options = {"REGISTER", "UNDO"}
 
+    draft: bpy.props.BoolProperty(
+        name="Draft",
+        default=False,
+        description="Generates a fast, low resolution preview with the draft settings, to refine with Refine Textures",
+        options={"SKIP_SAVE"},
+    )
+
     def invoke(self, context, event):
+        if self.draft:
+            return self.execute(context)
         return context.window_manager.invoke_confirm(self, event, message="This operation may require several minutes. Make sure to open the Window console before running to keep track of the progress.")
     
     @classmethod
@@ -387,52 +960,306 @@ class CreateTextures(bpy.types.Operator):
         r'''
         Allows material creation only if an element accepting materials is selected
         '''
+        if helpers.generation_running():
+            cls.poll_message_set("A generation is already running")
+            return False
+        if bpy.context.scene.input_tool.precision == "int8-cpu" and bpy.context.scene.input_tool.device != "cpu":
+            cls.poll_message_set("The INT8 precision is only available on CPU")
+            return False
         has_materials = hasattr(bpy.context.active_object.data, "materials")
         if not has_materials:
             cls.poll_message_set("Please select an object that supports materials")
         return has_materials
 
     def execute(self, context):
-        venv_path = pm.named_paths['venv']
-        
-        if bpy.context.scene.input_tool.prompt_type == "text":
-            prompt = bpy.context.scene.input_tool.prompt
-        elif bpy.context.scene.input_tool.prompt_type == "image":
-            prompt = bpy.context.scene.input_tool.image_prompt
-            assert Path(prompt).exists(), f"Image prompt path not found at {prompt}"
-            
+        input_tool = bpy.context.scene.input_tool
+        self.user_input, sd_kwargs = collect_generation_inputs(input_tool)
+        # The material goes to the objects that were selected when the generation started
+        self.target = bpy.context.active_object
+        self.objects, self.all_slots = target_objects(input_tool)
+        self.configure(sd_kwargs)
+
+        # Drafts are loaded from files, so that refining them reloads the images in place
+        if input_tool.keep_worker_alive and input_tool.transfer_mode == "shm" and not self.from_files:
+            sd_kwargs["transfer"] = "shm"
+            sd_kwargs["write_to_disk"] = input_tool.write_to_disk
+
+        self.cache_key = None
+        # Results handed over in memory may not be on disk when the generation finishes
+        if input_tool.use_result_cache and "transfer" not in sd_kwargs:
+            self.cache_key = request_key(
+                self.user_input, sd_kwargs, helpers.model_revision(self.user_input["model_path"])
+            )
+            mat_dir = Path(self.user_input['save_path']) / self.user_input['name']
+            if result_cache(input_tool).restore(self.cache_key, mat_dir):
+                self.apply_maps()
+                self.report({"INFO"}, f"Reused cached material")
+                return {"FINISHED"}
+
+        return self.start_job(context, "generate", {**self.user_input, **sd_kwargs})
+
+    def configure(self, sd_kwargs):
+        r'''
+        Adjusts the generation arguments before the generation starts: the draft settings when previewing.
+        The seed of a draft is stored to refine it, see apply_maps.
+        '''
+        if self.draft:
+            draft_inputs(bpy.context.scene.input_tool, sd_kwargs)
+        self.seed = sd_kwargs["seed"]
+        self.from_files = self.draft
 
-        user_input = {
-            "name": bpy.context.scene.input_tool.dir_name,
-            "prompt": prompt,
-            "prompt_type": bpy.context.scene.input_tool.prompt_type,
-            "save_path": Path(bpy.path.abspath(bpy.context.scene.input_tool.save_path)),
-            "model_path": bpy.context.scene.input_tool.model_id,
-            "precision": bpy.context.scene.input_tool.precision,
-            "device": bpy.context.scene.input_tool.device,
-        }
-        
-        sd_kwargs = {
-            "guidance_scale": bpy.context.scene.input_tool.guidance_scale,
-            "height": bpy.context.scene.input_tool.height,
-            "width": bpy.context.scene.input_tool.width,
-            "num_inference_steps": bpy.context.scene.input_tool.num_steps,
-            "scheduler": bpy.context.scene.input_tool.scheduler,
-            "tileable": bpy.context.scene.input_tool.tileable,
-            "patched": bpy.context.scene.input_tool.patched,
-            "free_u": bpy.context.scene.input_tool.free_u,
-        }
- 
+    def apply_maps(self, output=None):
+        r'''
+        Creates the material from the generated maps and assigns it to the target objects. Drafts remember how
+        they were generated, for Refine Textures.
+        '''
+        if output and "shared_maps" in output:
+            shared_maps = output["shared_maps"]
+            try:
+                material = load_shared_maps(
+                    shared_maps, Path(self.user_input['save_path']), self.user_input['name'], objects=self.objects,
+                    all_slots=self.all_slots, since=self._job.started,
+                )
+            finally:
+                helpers.release_shared_maps([shared["name"] for shared in shared_maps.values()])
+        else:
+            material = load_texture_maps(
+                Path(self.user_input['save_path']), self.user_input['name'], objects=self.objects,
+                all_slots=self.all_slots,
+            )
+
+        if self.draft:
+            material["mc_draft_seed"] = self.seed
+            material["mc_draft_prompt"] = self.user_input['prompt']
+            material["mc_draft_prompt_type"] = self.user_input['prompt_type']
+            material["mc_draft_name"] = self.user_input['name']
+            material["mc_draft_save_path"] = Path(self.user_input['save_path']).as_posix()
+        return material
+
+    def finish(self, context, output):
+        if self.cache_key is not None:
+            result_cache(context.scene.input_tool).store(
+                self.cache_key, Path(self.user_input['save_path']) / self.user_input['name']
+            )
+        self.apply_maps(output)
+        pm.update_named_paths(self.user_input["save_path"], "texture_output")
+        self.report({"INFO"}, self.finished_message())
+        return {"FINISHED"}
+
+    def finished_message(self):
+        if self.draft:
+            return f"Draft Material Created! (seed {self.seed})"
+        return f"New Material Created!"
+
+
+class RefineTextures(CreateTextures):
+    bl_idname = "mc.refine_textures"
+    bl_label = "Refine Textures"
+    bl_description = "Generates the draft material of the active object again with the full settings and the prompt and seed of the draft, replacing its images in place."
+    bl_options = {"REGISTER", "UNDO"}
+
+    @classmethod
+    def poll(cls, context):
+        r'''
+        Allows refinement only if the active material is a draft
+        '''
+        if not super().poll(context):
+            return False
+        material = bpy.context.active_object.active_material
+        is_draft = material is not None and "mc_draft_seed" in material
+        if not is_draft:
+            cls.poll_message_set("The active material is not a draft, create one with Preview")
+        return is_draft
+
+    def configure(self, sd_kwargs):
+        r'''
+        Generates with the prompt and seed of the draft, in the directory of the draft.
+        '''
+        self.material = self.target.active_material
+        self.seed = sd_kwargs["seed"] = self.material["mc_draft_seed"]
+        # Drafts made before the prompt was stored are refined with the current prompt
+        self.user_input["prompt"] = self.material.get("mc_draft_prompt", self.user_input["prompt"])
+        self.user_input["prompt_type"] = self.material.get("mc_draft_prompt_type", self.user_input["prompt_type"])
+        self.user_input["name"] = self.material["mc_draft_name"]
+        self.user_input["save_path"] = Path(self.material["mc_draft_save_path"])
+        # The draft images are reloaded from the files of the refined maps
+        self.from_files = True
+
+    def apply_maps(self, output=None):
+        material = reload_texture_maps(
+            self.material, Path(self.user_input['save_path']), self.user_input['name'], objects=self.objects,
+            all_slots=self.all_slots,
+        )
+        for key in ("mc_draft_seed", "mc_draft_prompt", "mc_draft_prompt_type", "mc_draft_name", "mc_draft_save_path"):
+            if key in material:
+                del material[key]
+        return material
+
+    def finished_message(self):
+        return f"Material Refined! (seed {self.seed})"
+
+
+class CreateTexturesBatch(GenerationModal, bpy.types.Operator):
+    bl_idname = "mc.create_textures_batch"
+    bl_label = "Create Textures Batch"
+    bl_description = "Creates one material for each combination of the batch prompts and seeds, running them as batched generations."
+    bl_options = {"REGISTER", "UNDO"}
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_confirm(self, event, message="This operation may require several minutes. Make sure to open the Window console before running to keep track of the progress.")
+
+    @classmethod
+    def poll(cls, context):
+        r'''
+        Allows batch creation only if at least one prompt is given
+        '''
+        if helpers.generation_running():
+            cls.poll_message_set("A generation is already running")
+            return False
+        if bpy.context.scene.input_tool.precision == "int8-cpu" and bpy.context.scene.input_tool.device != "cpu":
+            cls.poll_message_set("The INT8 precision is only available on CPU")
+            return False
+        has_prompts = bool(bpy.context.scene.input_tool.batch_prompts.strip())
+        if not has_prompts:
+            cls.poll_message_set("Please enter the batch prompts")
+        return has_prompts
+
+    def execute(self, context):
+        input_tool = bpy.context.scene.input_tool
+        user_input, sd_kwargs = collect_generation_inputs(input_tool)
+
+        prompts = [p.strip() for p in input_tool.batch_prompts.split(";") if p.strip()]
+        if input_tool.prompt_type == "image":
+            prompts = [bpy.path.abspath(p) for p in prompts]
         try:
-            helpers.execution_handler(venv_path, "generate", {**user_input, **sd_kwargs})
-            load_texture_maps(Path(user_input['save_path']), user_input['name'])
-            pm.update_named_paths(user_input["save_path"], "texture_output")
-            self.report({"INFO"}, f"New Material Created!")
-            
-        except subprocess.CalledProcessError as e:
-            print(e)
-            self.report({"ERROR"}, "Running text2img raised an exception:\n {e}")
+            seeds = [int(s) for s in input_tool.batch_seeds.split(",") if s.strip()] or [sd_kwargs["seed"]]
+        except ValueError:
+            self.report({"ERROR"}, f"Batch seeds must be integers separated by commas, got '{input_tool.batch_seeds}'")
             return {"CANCELLED"}
+        self.names = [f"{user_input['name']}_{i:03d}" for i in range(len(prompts) * len(seeds))]
+        self.save_path = user_input["save_path"]
+
+        del user_input["prompt"], user_input["name"], sd_kwargs["seed"]
+        batch_input = {
+            **user_input,
+            "prompts": prompts,
+            "seeds": seeds,
+            "names": self.names,
+            "batch_size": input_tool.batch_size,
+        }
+        return self.start_job(context, "generate_batch", {**batch_input, **sd_kwargs})
+
+    def finish(self, context, output):
+        index = image_index()
+        for name in self.names:
+            load_texture_maps(Path(self.save_path), name, assign=False, index=index)
+        pm.update_named_paths(self.save_path, "texture_output")
+        if output:
+            self.report({"INFO"}, f"{len(self.names)} Materials Created! ({output['materials_per_minute']:.1f} materials/min)")
+        else:
+            self.report({"INFO"}, f"{len(self.names)} Materials Created!")
+        return {"FINISHED"}
+
+
+class ImportMaterials(bpy.types.Operator, ImportHelper):
+    bl_idname = "mc.import_materials"
+    bl_label = "Import Materials"
+    bl_description = "Creates a material for every folder of generated maps in the chosen directory, reusing the materials and images already imported."
+    bl_options = {"REGISTER", "UNDO"}
+
+    directory: bpy.props.StringProperty(subtype="DIR_PATH")
+    filter_folder: bpy.props.BoolProperty(default=True, options={"HIDDEN"})
+
+    def execute(self, context):
+        library_dir = Path(bpy.path.abspath(self.directory))
+        if not library_dir.is_dir():
+            self.report({"ERROR"}, f"Directory not found at {library_dir}")
+            return {"CANCELLED"}
+
+        materials = load_material_library(library_dir)
+        if not materials:
+            self.report({"WARNING"}, f"No generated materials found in {library_dir}")
+            return {"CANCELLED"}
+        self.report({"INFO"}, f"{len(materials)} Materials Imported!")
+        return {"FINISHED"}
+
+
+class QueueTextures(bpy.types.Operator):
+    bl_idname = "mc.queue_textures"
+    bl_label = "Queue Textures"
+    bl_description = "Adds a generation with the current settings to the queue. Queued generations run in the background, are resumed in the next session if Blender is closed, and are applied when their .blend file is open."
+    bl_options = {"REGISTER"}
+
+    @classmethod
+    def poll(cls, context):
+        r'''
+        Allows queuing only if an element accepting materials is selected, in a saved .blend file: queued jobs
+        are applied when the file they were queued from is open
+        '''
+        if not bpy.data.filepath:
+            cls.poll_message_set("Please save the .blend file to queue generations")
+            return False
+        if bpy.context.scene.input_tool.precision == "int8-cpu" and bpy.context.scene.input_tool.device != "cpu":
+            cls.poll_message_set("The INT8 precision is only available on CPU")
+            return False
+        has_materials = hasattr(getattr(bpy.context.active_object, "data", None), "materials")
+        if not has_materials:
+            cls.poll_message_set("Please select an object that supports materials")
+        return has_materials
+
+    def execute(self, context):
+        input_tool = bpy.context.scene.input_tool
+        user_input, sd_kwargs = collect_generation_inputs(input_tool)
+        objects, all_slots = target_objects(input_tool)
+        target = {
+            "objects": [obj.name for obj in objects],
+            "all_slots": all_slots,
+            "blend_file": bpy.data.filepath,
+        }
+        follow_queue_paths()
+        job_queue.add("generate", {**user_input, **sd_kwargs}, target, worker_config(input_tool))
+        pending = sum(job["state"] in (PENDING, RUNNING) for job in job_queue.jobs.values())
+        self.report({"INFO"}, f"{user_input['name']} queued ({pending} generations in the queue)")
+        return {"FINISHED"}
+
+
+class CancelQueuedJob(bpy.types.Operator):
+    bl_idname = "mc.cancel_queued_job"
+    bl_label = "Cancel Queued Generation"
+    bl_description = "Removes the generation from the queue, or stops it if it is running."
+    bl_options = {"REGISTER", "INTERNAL"}
+
+    job_id: bpy.props.StringProperty(options={"HIDDEN"})
+
+    def execute(self, context):
+        if self.job_id in job_queue.jobs:
+            job_queue.cancel(self.job_id)
+        return {"FINISHED"}
+
+
+class ClearFinishedJobs(bpy.types.Operator):
+    bl_idname = "mc.clear_finished_jobs"
+    bl_label = "Clear Finished"
+    bl_description = "Removes the applied, failed and cancelled generations from the queue."
+    bl_options = {"REGISTER", "INTERNAL"}
+
+    def execute(self, context):
+        job_queue.clear_finished()
+        return {"FINISHED"}
+
+
+class CancelGeneration(bpy.types.Operator):
+    bl_idname = "mc.cancel_generation"
+    bl_label = "Cancel Generation"
+    bl_description = "Stops the running generation. The background worker is stopped and restarted at the next generation."
+    bl_options = {"REGISTER", "INTERNAL"}
+
+    @classmethod
+    def poll(cls, context):
+        return helpers.generation_running()
+
+    def execute(self, context):
+        helpers.active_job.cancel()
         return {"FINISHED"}
 
 
@@ -474,6 +1301,16 @@ class MC_PT_Main(bpy.types.Panel):
         row = layout.row()
         row.prop(input_tool, "device")
 
+        if input_tool.device == "cpu":
+            row = layout.row()
+            row.prop(input_tool, "cpu_threads")
+
+            row = layout.row()
+            row.prop(input_tool, "cpu_interop_threads")
+
+        row = layout.row()
+        row.prop(input_tool, "torch_compile")
+
         layout.separator()
 
         row = layout.row()
@@ -485,12 +1322,68 @@ class MC_PT_Main(bpy.types.Panel):
         row = layout.row()
         row.prop(input_tool, "tileable")
 
+        row = layout.row()
+        row.prop(input_tool, "assign_to")
+
         layout.separator()
         
-        layout.operator(
-            "mc.create_textures", icon="DISCLOSURE_TRI_RIGHT", text="Create Textures"
-        )
+        if helpers.generation_running():
+            progress_bar(self, context)
+            layout.operator("mc.cancel_generation", icon="CANCEL", text="Cancel Generation")
+        else:
+            layout.operator(
+                "mc.create_textures", icon="DISCLOSURE_TRI_RIGHT", text="Create Textures"
+            )
+
+            row = layout.row(align=True)
+            row.operator("mc.create_textures", icon="HIDE_OFF", text="Preview").draft = True
+            row.operator("mc.refine_textures", icon="SHADERFX", text="Refine")
         
+        header, body = layout.panel("Batch Generation", default_closed=True)
+
+        row = header.row()
+        row.label(text="Batch Generation")
+
+        if body:
+            row = body.row()
+            row.prop(input_tool, "batch_prompts")
+
+            row = body.row()
+            row.prop(input_tool, "batch_seeds")
+
+            row = body.row()
+            row.prop(input_tool, "batch_size")
+
+            body.operator(
+                "mc.create_textures_batch", icon="DISCLOSURE_TRI_RIGHT", text="Create Textures Batch"
+            )
+
+            body.operator("mc.import_materials", icon="IMPORT", text="Import Materials")
+
+        header, body = layout.panel("Generation Queue", default_closed=True)
+
+        row = header.row()
+        row.label(text=f"Generation Queue ({len(job_queue.jobs)})")
+
+        if body:
+            row = body.row()
+            row.prop(input_tool, "max_queue_jobs")
+
+            body.operator("mc.queue_textures", icon="ADD", text="Add to Queue")
+
+            for job in job_queue.jobs.values():
+                row = body.row()
+                row.label(text=job["arguments"]["name"])
+                if job["id"] in job_queue.running:
+                    factor, text = job_queue.progress_status(job["id"])
+                    row.progress(factor=factor, type="BAR", text=text)
+                else:
+                    row.label(text=job["state"].capitalize())
+                if job["state"] in (PENDING, RUNNING):
+                    row.operator("mc.cancel_queued_job", icon="X", text="").job_id = job["id"]
+
+            body.operator("mc.clear_finished_jobs", icon="TRASH", text="Clear Finished")
+
         header, body = layout.panel("Diffusion Parameters", default_closed=False)
         
         row = header.row()
@@ -508,14 +1401,86 @@ class MC_PT_Main(bpy.types.Panel):
         row = body.row()
         row.prop(input_tool, "width")
 
+        row = body.row()
+        row.prop(input_tool, "upscale_from")
+
+        if input_tool.upscale_from:
+            row = body.row()
+            row.prop(input_tool, "upscaler")
+
         row = body.row()
         row.prop(input_tool, "num_steps")
+
+        row = body.row()
+        row.prop(input_tool, "seed")
+
+        row = body.row(align=True)
+        row.prop(input_tool, "draft_resolution")
+        row.prop(input_tool, "draft_steps")
         
         row = body.row()
+        row.prop(input_tool, "tiled_generation")
+
+        if input_tool.tiled_generation:
+            row = body.row()
+            row.prop(input_tool, "tile_memory_gb")
+
+        row = body.row()
+        row.enabled = not input_tool.tiled_generation
         row.prop(input_tool, "patched")
         
         row = body.row()
         row.prop(input_tool, "free_u")
+
+        row = body.row()
+        row.prop(input_tool, "map_format")
+
+        row = body.row()
+        row.prop(input_tool, "data_map_format")
+
+        row = body.row()
+        row.prop(input_tool, "pack_maps")
+
+        row = body.row()
+        row.prop(input_tool, "fast_compression")
+
+        row = body.row()
+        row.prop(input_tool, "use_result_cache")
+
+        if input_tool.use_result_cache:
+            row = body.row()
+            row.prop(input_tool, "result_cache_gb")
+
+        row = body.row()
+        row.prop(input_tool, "use_embedding_cache")
+
+        row = body.row()
+        row.prop(input_tool, "keep_worker_alive")
+
+        if input_tool.keep_worker_alive:
+            row = body.row()
+            row.prop(input_tool, "worker_idle_timeout")
+
+            row = body.row()
+            row.prop(input_tool, "transfer_mode")
+
+            if input_tool.transfer_mode == "shm":
+                row = body.row()
+                row.prop(input_tool, "write_to_disk")
+
+            row = body.row()
+            row.prop(input_tool, "ram_budget_gb")
+
+            row = body.row()
+            row.prop(input_tool, "vram_budget_gb")
+
+            stats = helpers.worker.cache_stats()
+            if stats is not None:
+                body.label(
+                    text=f"Worker: {len(stats['entries'])} pipelines loaded, {stats['hits']} hits, "
+                         f"{stats['misses']} misses, {stats['evictions']} evictions",
+                    icon="INFO",
+                )
     
 class MC_PT_Model_Warning(bpy.types.Panel):
     bl_label = "Material Crafter Warning"
@@ -568,6 +1533,13 @@ classes = (
     MC_PGT_Input_Properties,
     # Operator Classes:
     CreateTextures,
+    RefineTextures,
+    CreateTexturesBatch,
+    ImportMaterials,
+    QueueTextures,
+    CancelQueuedJob,
+    ClearFinishedJobs,
+    CancelGeneration,
     # Panel Classes:
     MC_PT_Model_Warning,
     MC_PT_Main,
@@ -594,8 +1566,16 @@ def register():
     if pm.paths_file_exists():
         pm.load_paths_file()
         
-    if pm.named_paths['venv'].exists():
-        set_dependencies_installed(True)
+    # Checked from package metadata, without importing the dependencies
+    set_dependencies_installed(helpers.dependencies_installed())
+
+    # Resume the generations queued in previous sessions
+    global job_queue
+    job_queue = JobQueue(pm.named_paths['material_crafter'] / "job_queue.jsonl", pm.named_paths['venv'])
+    job_queue.load()
+    if not bpy.app.timers.is_registered(queue_timer):
+        bpy.app.timers.register(queue_timer, first_interval=1.0, persistent=True)
+    bpy.app.handlers.load_post.append(queue_load_post)
         
     for cls in classes:
         bpy.utils.register_class(cls)
@@ -607,6 +1587,16 @@ def register():
 
 
 def unregister():
+    if helpers.generation_running():
+        helpers.active_job.cancel()
+    helpers.worker.stop()
+
+    # Queued generations stay in the journal and are resumed at the next registration
+    if bpy.app.timers.is_registered(queue_timer):
+        bpy.app.timers.unregister(queue_timer)
+    if queue_load_post in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(queue_load_post)
+
     for cls in pre_dependency_classes:
         bpy.utils.unregister_class(cls)
 
@@ -0,0 +1,191 @@
+"""
+Startup and UI latency benchmarks of the add-on, run outside of Blender against the bpy stub in bpy_stub.py.
+
+Times the import of the add-on, register/unregister, PathManager construction, the draw/poll methods that
+Blender calls on every redraw of the sidebar and the import of a library of generated materials. Results are written to a JSON file; with --baseline, every benchmark
+slower than the baseline by more than --threshold is reported and the script exits with status 1.
+
+Timings depend on the machine, so no baseline is shipped: save one with --save-baseline before a change, in
+benchmarks/baselines/ (kept out of the ignored results folder), then compare the runs after the change to it.
+
+    python benchmarks/bench_addon.py --save-baseline
+    python benchmarks/bench_addon.py --baseline
+    python benchmarks/bench_addon.py --baseline path/to/other_baseline.json
+"""
+import argparse
+import importlib.util
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+RESULTS_DIR = BENCH_DIR / "results"
+DEFAULT_BASELINE = BENCH_DIR / "baselines" / "addon_baseline.json"
+LIBRARY_SIZE = 100
+
+sys.path.insert(0, str(BENCH_DIR))
+import bpy_stub  # noqa: E402
+
+
+def import_addon(package_name: str = "material_crafter"):
+    r'''
+    Imports the repository root as the add-on package, the way Blender does from the add-ons directory.
+    '''
+    for name in [name for name in sys.modules if name == package_name or name.startswith(package_name + ".")]:
+        del sys.modules[name]
+
+    spec = importlib.util.spec_from_file_location(
+        package_name, ROOT / "__init__.py", submodule_search_locations=[str(ROOT)]
+    )
+    addon = importlib.util.module_from_spec(spec)
+    sys.modules[package_name] = addon
+    spec.loader.exec_module(addon)
+    return addon
+
+
+def measure(function, repeat: int) -> dict:
+    r'''
+    Calls function repeat times, returning the median, min and max time per call in milliseconds.
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": statistics.median(times),
+        "min_ms": min(times),
+        "max_ms": max(times),
+        "repeat": repeat,
+    }
+
+
+def draw(panel_class, context):
+    panel = panel_class()
+    panel.layout = bpy_stub.UILayout()
+    return lambda: panel.draw(context)
+
+
+def write_library(library_dir: Path, size: int):
+    r'''
+    Directories of (empty) map files laid out like generated materials, the stub only reads the files.
+    '''
+    for i in range(size):
+        mat_dir = library_dir / f"material_{i:03d}"
+        mat_dir.mkdir()
+        for map_name in ("basecolor", "normal", "height", "roughness", "metallic"):
+            (mat_dir / f"{map_name}.png").touch()
+
+
+def run(repeat: int = 200) -> dict:
+    bpy = bpy_stub.install()
+    context = bpy.context
+    results = {}
+
+    results["import"] = measure(import_addon, max(repeat // 20, 3))
+    addon = sys.modules["material_crafter"]
+    helpers = sys.modules["material_crafter.src.helpers"]
+
+    def register_cycle():
+        addon.register()
+        addon.unregister()
+
+    results["register_unregister"] = measure(register_cycle, repeat)
+    results["path_manager"] = measure(helpers.PathManager, repeat)
+
+    addon.register()
+    # Pretend the dependencies are installed, so the main panels can be exercised
+    addon.set_dependencies_installed(True)
+    for cls in addon.classes:
+        bpy.utils.register_class(cls)
+    bpy.types.Scene.input_tool = bpy.props.PointerProperty(type=addon.MC_PGT_Input_Properties)
+
+    results["MCPRE_PT_warning_panel.poll"] = measure(lambda: addon.MCPRE_PT_warning_panel.poll(context), repeat)
+    results["MCPRE_PT_warning_panel.draw"] = measure(draw(addon.MCPRE_PT_warning_panel, context), repeat)
+    results["MCPRE_preferences.draw"] = measure(draw(addon.MCPRE_preferences, context), repeat)
+    results["MC_PT_Model_Warning.poll"] = measure(lambda: addon.MC_PT_Model_Warning.poll(context), repeat)
+    results["MC_PT_Main.draw"] = measure(draw(addon.MC_PT_Main, context), repeat)
+    results["MC_PT_Help.draw"] = measure(draw(addon.MC_PT_Help, context), repeat)
+    results["CreateTextures.poll"] = measure(lambda: addon.CreateTextures.poll(context), repeat)
+    results["RefineTextures.poll"] = measure(lambda: addon.RefineTextures.poll(context), repeat)
+
+    # The first call creates the materials, the next ones reuse them as when importing the library again
+    with tempfile.TemporaryDirectory() as library_dir:
+        write_library(Path(library_dir), LIBRARY_SIZE)
+        results[f"load_material_library_{LIBRARY_SIZE}"] = measure(
+            lambda: addon.load_material_library(Path(library_dir)), max(repeat // 20, 3)
+        )
+
+    addon.unregister()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float, metric: str = "median_ms") -> list:
+    r'''
+    Benchmarks whose metric is more than threshold times the baseline one.
+    '''
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None or reference.get(metric, 0) <= 0 or metric not in result:
+            continue
+        ratio = result[metric] / reference[metric]
+        if ratio > threshold:
+            regressions.append((name, reference[metric], result[metric], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="Calls per benchmark")
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR / "addon_latest.json")
+    parser.add_argument("--baseline", type=Path, nargs="?", default=None, const=DEFAULT_BASELINE,
+                        help=f"Baseline to compare against, {DEFAULT_BASELINE} if no path is given")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Also write the results to {DEFAULT_BASELINE}")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Slowdown ratio over the baseline reported as a regression")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline is not None:
+        if not args.baseline.exists():
+            parser.error(f"No baseline at {args.baseline}, save one on this machine with --save-baseline first")
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = run(args.repeat)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+    width = max(len(name) for name in results)
+    for name, result in results.items():
+        print(f"{name:<{width}}  {result['median_ms']:9.3f} ms  (min {result['min_ms']:.3f}, max {result['max_ms']:.3f})")
+
+    args.output.parent.mkdir(exist_ok=True, parents=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    if args.save_baseline:
+        DEFAULT_BASELINE.parent.mkdir(exist_ok=True, parents=True)
+        with open(DEFAULT_BASELINE, "w") as f:
+            json.dump(report, f, indent=1)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, reference, current, ratio in regressions:
+            print(f"REGRESSION {name}: {reference:.3f} ms -> {current:.3f} ms ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.2f}x the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+CPU generation speed, memory and output deviation of the optimized engine profiles against the previous CPU path.
+
+Needs torch, diffusers and the model weights in the Hugging Face cache (the venv of the add-on has them). Every
+profile runs in its own process, since thread pools and compiled graphs are process-wide:
+    baseline   fp32, default threads and attention, contiguous memory format (the previous CPU path)
+    optimized  PipelineCache on CPU: SDPA attention, channels-last, bf16 autocast, --threads/--interop-threads
+    compiled   optimized + torch.compile, with the compile cache in --compile-cache-dir
+    int8       int8-cpu precision: dynamic int8 quantization of the linear layers of the UNet and text encoder,
+               cached in --quantized-cache-dir (the first run includes the conversion in its load time)
+The maps of every profile are compared with the fp32 baseline: mean absolute error and PSNR of each map.
+
+    venv/Scripts/python.exe benchmarks/bench_cpu.py --resolution 256 --steps 4
+"""
+import argparse
+import json
+import tempfile
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+RESULTS_DIR = BENCH_DIR / "results"
+
+sys.path.insert(0, str(BENCH_DIR))
+from bench_generation import peak_rss_mb  # noqa: E402
+
+PROFILES = ("baseline", "optimized", "compiled", "int8")
+
+
+def load(profile: str, args):
+    sys.path.insert(0, str(ROOT / "src"))
+    import torch
+    from diffusers import DiffusionPipeline
+    from pipeline_cache import PipelineCache, configure_threads, inference_context
+
+    if profile == "baseline":
+        pipe = DiffusionPipeline.from_pretrained(args.model, trust_remote_code=True, torch_dtype=torch.float32)
+        pipe.to("cpu")
+        return pipe, torch.inference_mode
+
+    configure_threads(args.threads, args.interop_threads)
+    precision = "int8-cpu" if profile == "int8" else args.precision
+    pipe = PipelineCache().get(
+        args.model, precision, "cpu", compile=profile == "compiled", compile_cache_dir=args.compile_cache_dir,
+        quantized_cache_dir=args.quantized_cache_dir,
+    )
+    return pipe, lambda: inference_context(precision, "cpu")
+
+
+def run_profile(profile: str, args) -> dict:
+    import numpy as np
+    import torch
+    from map_writer import pipeline_maps
+
+    start = time.perf_counter()
+    pipe, context = load(profile, args)
+    load_seconds = time.perf_counter() - start
+
+    def generate(steps):
+        with context():
+            return pipe(
+                args.prompt,
+                height=args.resolution,
+                width=args.resolution,
+                num_inference_steps=steps,
+                generator=torch.Generator("cpu").manual_seed(0),
+            )
+
+    # The first call includes one-time costs: oneDNN primitives, compilation
+    start = time.perf_counter()
+    generate(1)
+    warmup_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image = generate(args.steps).images[0]
+    seconds = time.perf_counter() - start
+
+    np.savez(Path(args.maps_dir) / f"{profile}.npz", **{
+        name: np.asarray(array) for name, array in pipeline_maps(image).items()
+    })
+
+    return {
+        "profile": profile,
+        "threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "load_seconds": load_seconds,
+        "warmup_seconds": warmup_seconds,
+        "seconds": seconds,
+        "seconds_per_step": seconds / args.steps,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def deviation(maps_dir: Path, profile: str, reference: str = "baseline") -> dict:
+    r'''
+    Mean absolute error (in [0, 1]) and PSNR of each map of profile against the reference profile.
+    '''
+    import numpy as np
+
+    maps = np.load(Path(maps_dir) / f"{profile}.npz")
+    reference_maps = np.load(Path(maps_dir) / f"{reference}.npz")
+    result = {}
+    for name in reference_maps.files:
+        scale = 65535 if reference_maps[name].dtype == np.uint16 else 255
+        error = maps[name].astype(np.float64) / scale - reference_maps[name].astype(np.float64) / scale
+        mse = float(np.mean(error ** 2))
+        result[name] = {
+            "mean_abs_error": float(np.mean(np.abs(error))),
+            "psnr": 10 * np.log10(1 / mse) if mse > 0 else float("inf"),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="gvecchio/MatForger")
+    parser.add_argument("--prompt", default="weathered red brick wall")
+    parser.add_argument("--resolution", type=int, default=512)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--precision", default="bf16", choices=["fp32", "bf16"],
+                        help="Precision of the optimized profiles")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--interop-threads", type=int, default=0)
+    parser.add_argument("--compile-cache-dir", default=str(RESULTS_DIR / "torch_compile_cache"))
+    parser.add_argument("--quantized-cache-dir", default=str(RESULTS_DIR / "quantized_models"))
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=PROFILES)
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR / "cpu_latest.json")
+    parser.add_argument("--profile", choices=PROFILES, help=argparse.SUPPRESS)
+    parser.add_argument("--maps-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        print(json.dumps(run_profile(args.profile, args)))
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as maps_dir:
+        for profile in args.profiles:
+            command = [
+                sys.executable, __file__, "--profile", profile, "--model", args.model, "--prompt", args.prompt,
+                "--resolution", str(args.resolution), "--steps", str(args.steps), "--precision", args.precision,
+                "--threads", str(args.threads), "--interop-threads", str(args.interop_threads),
+                "--compile-cache-dir", args.compile_cache_dir, "--quantized-cache-dir", args.quantized_cache_dir,
+                "--maps-dir", maps_dir,
+            ]
+            output = subprocess.run(command, capture_output=True, text=True)
+            if output.returncode != 0:
+                print(f"{profile} failed:\n{output.stderr}")
+                continue
+            results[profile] = json.loads(output.stdout.strip().splitlines()[-1])
+
+        if "baseline" in results:
+            for profile in results:
+                results[profile]["deviation"] = deviation(maps_dir, profile)
+
+    reference = results.get("baseline")
+    for profile, result in results.items():
+        speedup = f", {reference['seconds'] / result['seconds']:.2f}x" if reference else ""
+        rss = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "n/a"
+        print(f"{profile}: {result['seconds_per_step']:.2f} s/step (load {result['load_seconds']:.1f}s, "
+              f"first call {result['warmup_seconds']:.1f}s{speedup}), peak RSS {rss}")
+        for name, error in result.get("deviation", {}).items():
+            print(f"    {name}: mean abs error {error['mean_abs_error']:.4f}, PSNR {error['psnr']:.1f} dB")
+
+    args.output.parent.mkdir(exist_ok=True, parents=True)
+    with open(args.output, "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args), "results": results},
+                  f, indent=1, default=str)
+
+
+if __name__ == "__main__":
+    main()
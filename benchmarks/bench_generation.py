@@ -0,0 +1,276 @@
+"""
+End-to-end generation throughput benchmark, run without Blender, GPU or model weights.
+
+Follows the path of CreateTextures: the generation inputs are collected from the add-on properties, sd_functions
+generate (or generate_batch) runs with the stub pipeline of stub_pipeline.py, and the maps are loaded back with
+load_texture_maps against the bpy stub. Every resolution x batch size case runs in its own process, so that its
+peak memory is measured in isolation. For each case the benchmark reports the wall time of every stage, the peak
+memory allocated by each stage (tracemalloc, numpy included), the peak RSS of the process and the bytes written.
+
+Baselines are saved in benchmarks/baselines/, out of the ignored results folder, see bench_addon.py.
+
+    python benchmarks/bench_generation.py --save-baseline
+    python benchmarks/bench_generation.py --resolutions 512 1024 --baseline
+    python benchmarks/bench_generation.py --baseline path/to/other_baseline.json
+"""
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+RESULTS_DIR = BENCH_DIR / "results"
+DEFAULT_BASELINE = BENCH_DIR / "baselines" / "generation_baseline.json"
+
+sys.path.insert(0, str(BENCH_DIR))
+from bench_addon import compare, import_addon  # noqa: E402
+
+MB = 2**20
+
+
+def peak_rss_mb() -> float:
+    r'''
+    Peak resident memory of this process in MB, or None when it cannot be read.
+    '''
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak / MB if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / MB
+    except (ImportError, AttributeError):
+        return None
+
+
+def directory_size(path: Path) -> int:
+    return sum(file.stat().st_size for file in Path(path).rglob("*") if file.is_file())
+
+
+def process_start_seconds() -> float:
+    r'''
+    Time to start a generation process and import sd_functions, as execution_handler does for every request.
+    '''
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, str(ROOT / "src" / "sd_functions.py"), "probe"],
+        cwd=ROOT / "src", capture_output=True, check=True,
+    )
+    return time.perf_counter() - start
+
+
+def import_sd_functions():
+    import bpy_stub
+    import stub_pipeline
+
+    bpy_stub.install()
+    stub_pipeline.install()
+    sys.path.insert(0, str(ROOT / "src"))
+    spec = importlib.util.spec_from_file_location("sd_functions", ROOT / "src" / "sd_functions.py")
+    sd_functions = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sd_functions)
+    return sd_functions
+
+
+class Stages(object):
+    """
+    Records the wall time and the traced peak memory of consecutive stages.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.peak_mb = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield
+        self.seconds[name] = time.perf_counter() - start
+        self.peak_mb[name] = tracemalloc.get_traced_memory()[1] / MB
+
+
+def run_case(resolution: int, batch_size: int, num_steps: int) -> dict:
+    r'''
+    Generates and loads batch_size materials at resolution x resolution, in this process.
+    '''
+    sd_functions = import_sd_functions()
+    addon = import_addon()
+    bpy = sys.modules["bpy"]
+
+    addon.register()
+    addon.set_dependencies_installed(True)
+    for cls in addon.classes:
+        bpy.utils.register_class(cls)
+    bpy.types.Scene.input_tool = bpy.props.PointerProperty(type=addon.MC_PGT_Input_Properties)
+
+    commands = sd_functions.SDInterfaceCommands()
+    stages = Stages()
+    tracemalloc.start()
+
+    with tempfile.TemporaryDirectory() as save_path, open(os.devnull, "w") as devnull:
+        input_tool = bpy.context.scene.input_tool
+        input_tool.prompt = "weathered red brick wall"
+        input_tool.dir_name = "bench"
+        input_tool.save_path = save_path
+        input_tool.device = "cpu"
+        input_tool.precision = "fp32"
+        input_tool.height = input_tool.width = resolution
+        input_tool.num_steps = num_steps
+        input_tool.seed = 42
+
+        with stages.stage("inputs"):
+            user_input, sd_kwargs = addon.collect_generation_inputs(input_tool)
+            addon.request_key(user_input, sd_kwargs)
+
+        # Progress events and save logs are not part of the measure
+        commands._channel = devnull
+        pipe = commands.pipelines.pipe
+        with contextlib.redirect_stdout(devnull), stages.stage("generate"):
+            if batch_size == 1:
+                commands.generate(**user_input, **sd_kwargs)
+                names = [user_input["name"]]
+            else:
+                names = [f"bench_{i:03d}" for i in range(batch_size)]
+                seed = sd_kwargs.pop("seed")
+                user_input.pop("name")
+                prompt = user_input.pop("prompt")
+                commands.generate_batch(
+                    prompts=[prompt], names=names, seeds=list(range(seed, seed + batch_size)),
+                    batch_size=batch_size, **user_input, **sd_kwargs,
+                )
+
+        # The stub times itself, the rest of the generate call is writing the maps
+        stages.seconds["pipeline"] = pipe.last_call_seconds
+        stages.seconds["save"] = stages.seconds.pop("generate") - pipe.last_call_seconds
+        stages.peak_mb["pipeline"] = stages.peak_mb["save"] = stages.peak_mb.pop("generate")
+
+        with stages.stage("load"):
+            for name in names:
+                addon.load_texture_maps(Path(save_path), name, assign=False)
+
+        bytes_written = directory_size(save_path)
+
+    tracemalloc.stop()
+    total = sum(stages.seconds.values())
+    return {
+        "resolution": resolution,
+        "batch_size": batch_size,
+        "stages": stages.seconds,
+        "stage_peak_mb": stages.peak_mb,
+        "seconds": total,
+        "materials_per_minute": batch_size / total * 60,
+        "peak_rss_mb": peak_rss_mb(),
+        "bytes_written": bytes_written,
+    }
+
+
+def run(resolutions: list, batch_sizes: list, num_steps: int) -> dict:
+    r'''
+    Runs every case in a separate process. Returns case name -> result.
+    '''
+    start_seconds = process_start_seconds()
+    results = {}
+    for resolution in resolutions:
+        for batch_size in batch_sizes:
+            name = f"{resolution}x{resolution}_batch{batch_size}"
+            output = subprocess.run(
+                [sys.executable, __file__, "--case", str(resolution), str(batch_size), "--steps", str(num_steps)],
+                capture_output=True, text=True,
+            )
+            if output.returncode != 0:
+                print(f"{name} failed:\n{output.stderr}")
+                continue
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            result["stages"] = {"process_start": start_seconds, **result["stages"]}
+            result["seconds"] += start_seconds
+            result["materials_per_minute"] = batch_size / result["seconds"] * 60
+            results[name] = result
+    return results
+
+
+def flatten(results: dict) -> dict:
+    r'''
+    One entry per case and stage, in the format expected by compare.
+    '''
+    flat = {}
+    for name, result in results.items():
+        flat[name] = {"seconds": result["seconds"]}
+        for stage, seconds in result["stages"].items():
+            flat[f"{name}/{stage}"] = {"seconds": seconds}
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[512, 1024, 2048, 4096])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1])
+    parser.add_argument("--steps", type=int, default=50, help="Denoising steps reported by the stub pipeline")
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR / "generation_latest.json")
+    parser.add_argument("--baseline", type=Path, nargs="?", default=None, const=DEFAULT_BASELINE,
+                        help=f"Baseline to compare against, {DEFAULT_BASELINE} if no path is given")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Also write the results to {DEFAULT_BASELINE}")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Slowdown ratio over the baseline reported as a regression")
+    parser.add_argument("--case", type=int, nargs=2, metavar=("RESOLUTION", "BATCH_SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(*args.case, args.steps)))
+        return
+
+    baseline = None
+    if args.baseline is not None:
+        if not args.baseline.exists():
+            parser.error(f"No baseline at {args.baseline}, save one on this machine with --save-baseline first")
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = run(args.resolutions, args.batch_sizes, args.steps)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+    for name, result in results.items():
+        stages = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in result["stages"].items())
+        rss = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "n/a"
+        print(f"{name}: {result['seconds']:.2f}s ({stages}), peak RSS {rss}, "
+              f"{result['bytes_written'] / MB:.1f} MB written, {result['materials_per_minute']:.1f} materials/min")
+
+    args.output.parent.mkdir(exist_ok=True, parents=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    if args.save_baseline:
+        DEFAULT_BASELINE.parent.mkdir(exist_ok=True, parents=True)
+        with open(DEFAULT_BASELINE, "w") as f:
+            json.dump(report, f, indent=1)
+
+    if baseline is not None:
+        regressions = compare(
+            flatten(results), {"results": flatten(baseline["results"])}, args.threshold, metric="seconds"
+        )
+        for name, reference, current, ratio in regressions:
+            print(f"REGRESSION {name}: {reference:.3f}s -> {current:.3f}s ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.2f}x the baseline")
+
+
+if __name__ == "__main__":
+    main()
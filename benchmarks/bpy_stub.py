@@ -0,0 +1,385 @@
+"""
+Minimal stand-in for the bpy module, to import and exercise the add-on outside of Blender.
+
+Only the parts of the API used by the add-on are provided. Properties declared with bpy.props become plain
+attributes holding their default value, PointerProperty on bpy.types.Scene creates the property group instance
+on first access, layouts record nothing. Data-blocks (materials, node trees, images) are simple Python objects,
+so timings measure the add-on code, not Blender.
+"""
+import copy
+import sys
+from types import ModuleType, SimpleNamespace
+
+
+# ======== Properties ======== #
+class _Property(object):
+    def __init__(self, kind, **kwargs):
+        self.kind = kind
+        self.kwargs = kwargs
+
+    def default(self):
+        if "default" in self.kwargs:
+            return self.kwargs["default"]
+        if self.kind == "Enum":
+            return self.kwargs["items"][0][0]
+        if self.kind == "Pointer":
+            return self.kwargs["type"]()
+        return {"String": "", "Bool": False, "Int": 0, "Float": 0.0}[self.kind]
+
+    def __get__(self, instance, owner):
+        # Properties added to a class at registration, like Scene.input_tool
+        if instance is None:
+            return self
+        for cls in owner.__mro__:
+            for name, value in vars(cls).items():
+                if value is self:
+                    instance.__dict__[name] = self.default()
+                    return instance.__dict__[name]
+        raise AttributeError(self)
+
+
+def _property(kind):
+    def make(**kwargs):
+        return _Property(kind, **kwargs)
+    return make
+
+
+props = ModuleType("bpy.props")
+for _kind in ("String", "Bool", "Int", "Float", "Enum", "Pointer"):
+    setattr(props, f"{_kind}Property", _property(_kind))
+
+
+# ======== Types ======== #
+class bpy_struct(object):
+    is_registered = False
+
+    def __init__(self, *args, **kwargs):
+        for cls in reversed(type(self).__mro__):
+            for name, value in getattr(cls, "__annotations__", {}).items():
+                if isinstance(value, _Property):
+                    setattr(self, name, value.default())
+
+
+class PropertyGroup(bpy_struct):
+    pass
+
+
+class Operator(bpy_struct):
+    @classmethod
+    def poll_message_set(cls, message):
+        pass
+
+    def report(self, type, message):
+        pass
+
+
+class Panel(bpy_struct):
+    pass
+
+
+class AddonPreferences(bpy_struct):
+    pass
+
+
+class Scene(bpy_struct):
+    pass
+
+
+class WindowManager(bpy_struct):
+    def invoke_confirm(self, operator, event, message=""):
+        return operator.execute(context)
+
+    def event_timer_add(self, time_step, window=None):
+        return object()
+
+    def event_timer_remove(self, timer):
+        pass
+
+    def modal_handler_add(self, operator):
+        pass
+
+
+bpy_types = ModuleType("bpy.types")
+for _cls in (bpy_struct, PropertyGroup, Operator, Panel, AddonPreferences, Scene, WindowManager):
+    setattr(bpy_types, _cls.__name__, _cls)
+
+
+# ======== UI ======== #
+class UILayout(object):
+    alignment = "EXPAND"
+    scale_x = 1.0
+    enabled = True
+
+    def row(self, **kwargs):
+        return UILayout()
+
+    def column(self, **kwargs):
+        return UILayout()
+
+    def panel(self, idname, default_closed=False):
+        return UILayout(), (None if default_closed else UILayout())
+
+    def prop(self, data, property, **kwargs):
+        getattr(data, property)
+
+    def operator(self, operator, **kwargs):
+        return SimpleNamespace()
+
+    def label(self, **kwargs):
+        pass
+
+    def separator(self, **kwargs):
+        pass
+
+    def progress(self, **kwargs):
+        pass
+
+
+# ======== Data-blocks ======== #
+class _Collection(object):
+    """
+    bpy_prop_collection: iterates over its items, looked up by name.
+    """
+
+    def __init__(self):
+        self.items = []
+
+    def __iter__(self):
+        return iter(list(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def get(self, name, default=None):
+        for item in self.items:
+            if getattr(item, "name", None) == name:
+                return item
+        return default
+
+    def add(self, item):
+        self.items.append(item)
+        return item
+
+    def remove(self, item):
+        self.items.remove(item)
+
+    def clear(self):
+        self.items.clear()
+
+    def new(self, type, *args, **kwargs):
+        return self.add(_DataBlock(type))
+
+
+class _Sockets(dict):
+    def __missing__(self, name):
+        socket = SimpleNamespace(name=name)
+        self[name] = socket
+        return socket
+
+
+class _DataBlock(object):
+    def __init__(self, name=""):
+        self.name = name
+        self.bl_idname = name
+        self.image = None
+        self.inputs = _Sockets()
+        self.outputs = _Sockets()
+
+
+class _NodeTree(object):
+    def __init__(self):
+        self.nodes = _Collection()
+        self.nodes.new("Principled BSDF").name = "Principled BSDF"
+        self.nodes.new("Material Output").name = "Material Output"
+        self.links = _Collection()
+        self.interface = SimpleNamespace(new_socket=lambda *args, **kwargs: _DataBlock())
+
+
+class Material(object):
+    def __init__(self, name):
+        self.name = name
+        self.use_nodes = False
+        self.use_fake_user = False
+        self.node_tree = _NodeTree()
+        self.properties = {}
+
+    def __getitem__(self, key):
+        return self.properties[key]
+
+    def __setitem__(self, key, value):
+        self.properties[key] = value
+
+    def __delitem__(self, key):
+        del self.properties[key]
+
+    def __contains__(self, key):
+        return key in self.properties
+
+    def get(self, key, default=None):
+        return self.properties.get(key, default)
+
+    def copy(self):
+        material = Material(self.name)
+        material.use_nodes = self.use_nodes
+        material.use_fake_user = self.use_fake_user
+        material.node_tree.nodes.items = [copy.copy(node) for node in self.node_tree.nodes]
+        material.node_tree.links.items = list(self.node_tree.links)
+        data.materials.add(material)
+        return material
+
+    def user_remap(self, material):
+        pass
+
+
+class Image(object):
+    def __init__(self, name, width=0, height=0, filepath="", float_buffer=False, source="FILE"):
+        self.name = name
+        self.source = source
+        self.size = (width, height)
+        self.is_float = float_buffer
+        self.filepath = filepath
+        self.filepath_raw = filepath
+        self.colorspace_settings = SimpleNamespace(name="sRGB")
+        self.pixels = SimpleNamespace(foreach_set=lambda values: None)
+
+    def reload(self):
+        pass
+
+    def pack(self):
+        pass
+
+    def scale(self, width, height):
+        self.size = (width, height)
+
+
+class _Materials(_Collection):
+    def new(self, name):
+        return self.add(Material(name))
+
+
+class _Images(_Collection):
+    def load(self, filepath, check_existing=False):
+        with open(filepath, "rb") as f:
+            f.read()
+        return self.add(Image(filepath.rsplit("/", 1)[-1], filepath=filepath))
+
+    def new(self, name, width, height, alpha=False, float_buffer=False):
+        return self.add(Image(name, width, height, float_buffer=float_buffer, source="GENERATED"))
+
+
+class _NodeGroups(_Collection):
+    def new(self, name, type):
+        group = _NodeTree()
+        group.name = name
+        return self.add(group)
+
+
+data = SimpleNamespace(materials=_Materials(), images=_Images(), node_groups=_NodeGroups(), objects={})
+
+
+# ======== Context ======== #
+class _MaterialSlot(object):
+    def __init__(self, materials, index):
+        self.materials = materials
+        self.index = index
+
+    @property
+    def material(self):
+        return self.materials[self.index]
+
+    @material.setter
+    def material(self, material):
+        self.materials[self.index] = material
+
+
+class _Mesh(object):
+    def __init__(self):
+        self.materials = [None]
+
+
+class _Object(object):
+    def __init__(self, name):
+        self.name = name
+        self.data = _Mesh()
+
+    @property
+    def material_slots(self):
+        return [_MaterialSlot(self.data.materials, index) for index in range(len(self.data.materials))]
+
+    @property
+    def active_material(self):
+        return self.data.materials[0]
+
+    def select_get(self):
+        return True
+
+
+context = SimpleNamespace(
+    scene=Scene(),
+    window_manager=WindowManager(),
+    active_object=_Object("Cube"),
+    selected_objects=[],
+    window=None,
+    screen=SimpleNamespace(areas=[]),
+)
+context.selected_objects.append(context.active_object)
+
+
+# ======== Modules ======== #
+def register_class(cls):
+    cls.is_registered = True
+
+
+def unregister_class(cls):
+    cls.is_registered = False
+
+
+utils = ModuleType("bpy.utils")
+utils.register_class = register_class
+utils.unregister_class = unregister_class
+
+path = SimpleNamespace(abspath=lambda p: p)
+app = SimpleNamespace(
+    binary_path_python=sys.executable,
+    timers=SimpleNamespace(register=lambda *args, **kwargs: None, unregister=lambda *args: None,
+                                 is_registered=lambda *args: False),
+    handlers=SimpleNamespace(load_post=[], persistent=lambda function: function),
+)
+ops = SimpleNamespace(wm=SimpleNamespace(redraw_timer=lambda **kwargs: None))
+
+
+class ExportHelper(object):
+    filepath = ""
+
+
+class ImportHelper(object):
+    filepath = ""
+
+
+def install():
+    """
+    Registers the stub as bpy (and bpy_extras) in sys.modules.
+    """
+    bpy = sys.modules[__name__]
+    bpy.types = bpy_types
+    bpy.props = props
+    bpy.utils = utils
+
+    io_utils = ModuleType("bpy_extras.io_utils")
+    io_utils.ExportHelper = ExportHelper
+    io_utils.ImportHelper = ImportHelper
+    bpy_extras = ModuleType("bpy_extras")
+    bpy_extras.io_utils = io_utils
+
+    sys.modules.update({
+        "bpy": bpy,
+        "bpy.types": bpy_types,
+        "bpy.props": props,
+        "bpy.utils": utils,
+        "bpy_extras": bpy_extras,
+        "bpy_extras.io_utils": io_utils,
+    })
+    return bpy
@@ -0,0 +1,134 @@
+"""
+Deterministic CPU stand-in for the diffusion pipeline, to run sd_functions without a GPU, model weights or network.
+
+The stub returns the five maps of the real pipeline at the requested resolution, as smooth synthetic images
+derived from the generator seed, so that encoding and loading work on realistic data. install() replaces the
+pipeline_cache module of the worker with a cache handing out the stub, and provides a minimal torch module when
+torch is not installed, since sd_functions only needs torch.Generator around the call.
+"""
+import contextlib
+import sys
+import time
+from types import ModuleType, SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+
+class Generator(object):
+    """
+    Seed holder standing in for torch.Generator when torch is not installed.
+    """
+
+    def __init__(self, device="cpu"):
+        self.device = device
+        self._seed = 0
+
+    def manual_seed(self, seed):
+        self._seed = int(seed)
+        return self
+
+    def seed(self):
+        self._seed = int(np.random.SeedSequence().entropy % 2**63)
+        return self._seed
+
+    def initial_seed(self):
+        return self._seed
+
+
+def smooth_noise(rng, height: int, width: int, channels: int) -> np.ndarray:
+    r'''
+    Low frequency noise upsampled to height x width, compressing like a texture rather than like white noise.
+    '''
+    coarse = rng.integers(0, 256, size=(max(height // 64, 2), max(width // 64, 2), channels), dtype=np.uint8)
+    mode = "L" if channels == 1 else "RGB"
+    image = Image.fromarray(coarse[:, :, 0] if channels == 1 else coarse, mode)
+    return np.asarray(image.resize((width, height), Image.BICUBIC))
+
+
+class StubPipeline(object):
+    """
+    Returns {basecolor, normal, height, roughness, metallic} PIL images for each prompt, like the material pipeline.
+    Calls the step callback at every step, and records the time spent in the last call.
+    """
+
+    def __init__(self):
+        self.last_call_seconds = 0.0
+        self.calls = 0
+
+    def __call__(self, prompt, height=512, width=512, num_inference_steps=50, generator=None,
+                 callback_on_step_end=None, **kwargs):
+        start = time.perf_counter()
+        prompts = prompt if isinstance(prompt, list) else [prompt]
+        generators = generator if isinstance(generator, list) else [generator] * len(prompts)
+
+        for step in range(num_inference_steps):
+            if callback_on_step_end is not None:
+                callback_on_step_end(self, step, num_inference_steps - step, {})
+
+        images = []
+        for generator in generators:
+            rng = np.random.default_rng(generator.initial_seed() if generator is not None else 0)
+            basecolor = smooth_noise(rng, height, width, 3)
+            height_map = smooth_noise(rng, height, width, 1)
+            # Normals from the height gradients, like the real output
+            dy, dx = np.gradient(height_map.astype(np.float32) / 255)
+            normal = np.stack([-dx * 8, -dy * 8, np.ones_like(dx)], axis=-1)
+            normal /= np.linalg.norm(normal, axis=-1, keepdims=True)
+            images.append(SimpleNamespace(
+                basecolor=Image.fromarray(basecolor, "RGB"),
+                normal=Image.fromarray(np.round((normal * 0.5 + 0.5) * 255).astype(np.uint8), "RGB"),
+                height=Image.fromarray(height_map, "L"),
+                roughness=Image.fromarray(smooth_noise(rng, height, width, 1), "L"),
+                metallic=Image.fromarray(smooth_noise(rng, height, width, 1), "L"),
+            ))
+
+        self.calls += 1
+        self.last_call_seconds = time.perf_counter() - start
+        return SimpleNamespace(images=images)
+
+
+class StubPipelineCache(object):
+    """
+    Stands in for pipeline_cache.PipelineCache, with a single stub pipeline for every model.
+    """
+
+    def __init__(self, ram_budget_gb: float = 0, vram_budget_gb: float = 0):
+        self.pipe = StubPipeline()
+
+    def get(self, model_path: str, precision: str, device: str, scheduler: str = "ddim", free_u: bool = False,
+            compile: bool = False, compile_cache_dir: str = None, quantized_cache_dir: str = None):
+        return self.pipe
+
+    def stats(self) -> dict:
+        return {"entries": [["stub", "fp32", "cpu"]], "calls": self.pipe.calls}
+
+
+def torch_stub() -> ModuleType:
+    torch = ModuleType("torch")
+    torch.Generator = Generator
+    torch.inference_mode = contextlib.nullcontext
+    torch.cuda = SimpleNamespace(
+        OutOfMemoryError=MemoryError,
+        is_available=lambda: False,
+        empty_cache=lambda: None,
+        device_count=lambda: 0,
+    )
+    return torch
+
+
+def install():
+    r'''
+    Makes the worker modules use the stub pipeline. Returns the stub pipeline_cache module.
+    '''
+    try:
+        import torch  # noqa: F401
+    except ImportError:
+        sys.modules["torch"] = torch_stub()
+
+    pipeline_cache = ModuleType("pipeline_cache")
+    pipeline_cache.PipelineCache = StubPipelineCache
+    pipeline_cache.inference_context = lambda precision, device: contextlib.nullcontext()
+    pipeline_cache.configure_threads = lambda threads=0, interop_threads=0: None
+    sys.modules["pipeline_cache"] = pipeline_cache
+    return pipeline_cache
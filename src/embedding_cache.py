@@ -0,0 +1,119 @@
+import hashlib
+import inspect
+import json
+from collections import OrderedDict
+from pathlib import Path
+
+import torch
+
+from image_prompt import prompt_digest
+
+
+def normalize_prompt(prompt: str) -> str:
+    r'''
+    Prompts differing only in case and whitespace give the same embeddings, CLIP tokenizers lowercase the text.
+    '''
+    return " ".join(prompt.split()).lower()
+
+
+def embedding_key(model_path: str, model_revision: str, precision: str, prompt_type: str, prompt: str,
+                  guidance: bool) -> str:
+    r'''
+    Key of the embeddings of a prompt: the normalized text, or the content hash and mtime of an image prompt.
+    '''
+    content = prompt_digest(prompt) if prompt_type == "image" else normalize_prompt(prompt)
+    payload = [model_path, model_revision, precision, prompt_type, content, guidance]
+    return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+
+
+def supports_embeddings(pipe) -> bool:
+    r'''
+    Whether the pipeline can encode prompts on their own and be called with precomputed prompt_embeds.
+    '''
+    if not callable(getattr(pipe, "encode_prompt", None)):
+        return False
+    return "prompt_embeds" in inspect.signature(pipe.__call__).parameters
+
+
+def encode(pipe, prompt, device: str, guidance: bool) -> dict:
+    r'''
+    Runs the prompt encoder of the pipeline, returning the pipeline call arguments holding the embeddings,
+    on the CPU: {"prompt_embeds": ..., "negative_prompt_embeds": ...}
+    '''
+    available = {
+        "prompt": prompt,
+        "device": device,
+        "num_images_per_prompt": 1,
+        "do_classifier_free_guidance": guidance,
+    }
+    parameters = inspect.signature(pipe.encode_prompt).parameters
+    with torch.inference_mode():
+        output = pipe.encode_prompt(**{name: value for name, value in available.items() if name in parameters})
+
+    if not isinstance(output, tuple):
+        output = (output,)
+    embeddings = {"prompt_embeds": output[0].cpu()}
+    call_parameters = inspect.signature(pipe.__call__).parameters
+    if len(output) > 1 and output[1] is not None and "negative_prompt_embeds" in call_parameters:
+        embeddings["negative_prompt_embeds"] = output[1].cpu()
+    return embeddings
+
+
+class EmbeddingCache(object):
+    """
+    Prompt embeddings by key (see embedding_key), in memory up to max_entries and, if cache_dir is given,
+    on disk as cache_dir/<key>.pt, so that they are reused across workers and sessions.
+    """
+
+    def __init__(self, cache_dir: str = None, max_entries: int = 64):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.pt"
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        elif self.cache_dir is not None and self._path(key).exists():
+            self.disk_hits += 1
+            entry = torch.load(self._path(key))
+            self._remember(key, entry)
+        else:
+            self.misses += 1
+            return None
+
+        self.seconds_saved += entry["seconds"]
+        return entry["embeddings"]
+
+    def put(self, key: str, embeddings: dict, seconds: float = 0.0):
+        r'''
+        Stores embeddings, with the seconds taken to encode them, to report the time saved by later hits.
+        '''
+        entry = {"embeddings": embeddings, "seconds": seconds}
+        self._remember(key, entry)
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(exist_ok=True, parents=True)
+            torch.save(entry, self._path(key))
+
+    def _remember(self, key: str, entry: dict):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "seconds_saved": self.seconds_saved,
+        }
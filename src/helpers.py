@@ -1,12 +1,21 @@
+import hashlib
 import importlib
 import json
 import os
+import re
 import shutil
 import subprocess
 import sys
-from pathlib import Path
+import tempfile
+import threading
+import time
+import zipfile
+from importlib import metadata
+from pathlib import Path, PureWindowsPath
 import bpy
 
+from . import result_cache
+
 class PathManager(object):
     """
     Singleton class for path management
@@ -73,21 +82,75 @@ def set_dependencies_installed(are_installed):
     global dependencies_installed
     dependencies_installed = are_installed
 
-def dependencies_installed() -> bool:
+def normalize_package_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def installed_versions(site_packages: Path) -> dict:
+    """
+    Versions of the distributions installed in site_packages, read from their metadata without importing them.
+    """
+    return {
+        normalize_package_name(dist.metadata["Name"]): dist.version
+        for dist in metadata.distributions(path=[str(site_packages)])
+        if dist.metadata["Name"]
+    }
+
+
+def requirements_hash() -> str:
+    return hashlib.sha256(json.dumps(dependencies, sort_keys=True).encode()).hexdigest()
+
+
+def missing_dependencies(use_stamp: bool = True) -> list:
+    """
+    Names of the requirements.json packages that are missing from the venv or installed with another version.
+    Installed versions are read from the package metadata, nothing is imported. The result is cached in a stamp
+    file, invalidated when requirements.json or the venv site-packages directory change.
+    """
+    site_packages = pm.named_paths['site-packages']
+    if not site_packages.exists():
+        return list(dependencies)
+
+    stamp_path = pm.named_paths['material_crafter'] / "dependencies_stamp.json"
+    stamp = {
+        "requirements": requirements_hash(),
+        "site_packages_mtime": site_packages.stat().st_mtime_ns,
+    }
+
+    if use_stamp and stamp_path.exists():
+        try:
+            with open(stamp_path) as f:
+                cached = json.load(f)
+            if all(cached.get(k) == v for k, v in stamp.items()):
+                return cached["missing"]
+        except (json.JSONDecodeError, KeyError):
+            pass
+
+    versions = installed_versions(site_packages)
+    missing = []
+    for module_name, module_params in dependencies.items():
+        version = versions.get(normalize_package_name(module_name))
+        required = module_params.get("version")
+        # Local version labels, like +cu121, only matter when requirements.json pins them
+        if version is None or (required is not None and required not in (version, version.split("+")[0])):
+            missing.append(module_name)
+
+    stamp["missing"] = missing
     try:
-        for dependency in dependencies:
-            import_module(dependency)
-        return True
-    except ImportError:
-        # Don't register other panels, operators etc.
-        return False
-    
+        with open(stamp_path, "w") as f:
+            json.dump(stamp, f)
+    except OSError:
+        pass
+    return missing
+
+
+def dependencies_installed() -> bool:
+    return not missing_dependencies()
+
+
 def is_installed(dependency):
-    try:
-        import_module(dependency)
-        return True
-    except ImportError:
-        return False
+    return dependency not in missing_dependencies()
+
 
 def install_pip():
     """
@@ -110,74 +173,140 @@ def install_pip():
         os.environ.pop("PIP_REQ_TRACKER", None)
 
 
+def pip_install_command(venv_path: Path, requirements: list, cache_dir: Path = None, wheelhouse: Path = None) -> list:
+    """
+    Single pip invocation installing all the requirements, so that the environment is resolved once.
+    Package specific index urls from requirements.json become extra index urls, and --upgrade is dropped so
+    that matching installed packages, like torch, are never reinstalled. Next to PyPI, pip could then pick
+    the CPU-only torch wheel of the same version: packages built per CUDA version are pinned with their local
+    version label in requirements.json (e.g. 2.2.2+cu121), which only their own index has.
+    :param cache_dir: persistent pip cache, downloaded wheels are reused across installs.
+    :param wheelhouse: directory of wheels to install from without network access.
+    """
+    command = [venv_path / "Scripts" / "python", "-m", "pip", "install", *requirements]
+
+    index_urls = []
+    for module_name, module_params in dependencies.items():
+        extra_params = iter(module_params['extra_params'])
+        for param in extra_params:
+            if param in ("--index-url", "--extra-index-url"):
+                url = next(extra_params)
+                if url not in index_urls:
+                    index_urls.append(url)
+            elif param != "--upgrade":
+                command.append(param)
+
+    if wheelhouse:
+        command.extend(["--no-index", "--find-links", Path(wheelhouse).as_posix()])
+    else:
+        for url in index_urls:
+            command.extend(["--extra-index-url", url])
+
+    if cache_dir:
+        command.extend(["--cache-dir", Path(cache_dir).as_posix()])
+    return command
+
+
 def install_modules(
     venv_path: str,
-    context
+    context,
+    cache_dir: Path = None,
+    wheelhouse: Path = None,
 ):
     """
-    Installs the package through pip and will attempt to import modules into the Venv, or if make_global = True import
-    them globally.
-    :param import_global: Makes installed modules global if True, will not install imports to Venv. If false, modules
-        will only be installed to the Venv to be used with the Stable Diffusion libraries.
-    :raises: subprocess.CalledProcessError and ImportError
-
-    Deprecated:
-    module_name: Module to import.
-    package_name: (Optional) Name of the package that needs to be installed. If None it is assumed to be equal
-       to the module_name.
-    global_name: (Optional) Name under which the module is imported. If None the module_name will be used.
-       This allows to import under a different name with the same effect as e.g. "import numpy as np" where "np" is
-       the global_name under which the module can be accessed.
+    Installs the missing requirements.json packages into the Venv with a single pip invocation, reporting the
+    progress and the time spent on each package in the progress bar.
+    :param cache_dir: persistent pip cache, downloaded wheels are reused across installs.
+    :param wheelhouse: directory of wheels to install from without network access.
+    :raises: subprocess.CalledProcessError
     """
 
-    print(f"Installing dependencies: {', '.join([i for i in dependencies])}")
-    
-    for i, (module_name, module_params) in enumerate(dependencies.items()):
+    def report(progress, text):
+        context.window_manager.progress = progress
+        context.window_manager.progress_text = text
+        bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1, time_limit=0.0)
+
+    missing = missing_dependencies(use_stamp=False)
+    if not missing:
+        report(1, "All dependencies already installed")
+        return
+
+    requirements = []
+    for module_name in missing:
+        module_params = dependencies[module_name]
         if "version" in module_params:
             module_name += f"=={module_params['version']}"
-        extra_params = module_params['extra_params']
-
-        # Blender disables the loading of user site-packages by default. However, pip will still check them to determine
-        # if a dependency is already installed. This can cause problems if the packages is installed in the user
-        # site-packages and pip deems the requirement satisfied, but Blender cannot import the package from the user
-        # site-packages. Hence, the environment variable PYTHONNOUSERSITE is set to disallow pip from checking the user
-        # site-packages. If the package is not already installed for Blender's Python interpreter, it will then try to.
-        # The paths used by pip can be checked with the following:
-        # `subprocess.run([bpy.app.binary_path_python, "-m", "site"], check=True)`
-
-        # Create a copy of the environment variables and modify them for the subprocess call
-
-        environ_copy = dict(os.environ)
-        environ_copy["PYTHONNOUSERSITE"] = "1"
-
-        install_commands_list = [
-            venv_path / "Scripts" / "python",
-            "-m",
-            "pip",
-            "install",
-            module_name,
-        ]
-
-        if extra_params:
-            install_commands_list.extend(extra_params)
-
-        print(f"\nInstalling {module_name} to {venv_path}.\n")
-        context.window_manager.progress = (i+1) / len(dependencies)
-        context.window_manager.progress_text = f"Installing {module_name} [{i+1}/{len(dependencies)}]"
-        bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1, time_limit=0.0)
-        try:
-            subprocess.run(install_commands_list, check=True, env=environ_copy)
-        except subprocess.CalledProcessError as e:
-            print(
-                f"Exception occurred while installing {module_name}: \n\n{e}"
+        requirements.append(module_name)
+
+    print(f"Installing dependencies: {', '.join(requirements)}")
+
+    # Blender disables the loading of user site-packages by default. However, pip will still check them to determine
+    # if a dependency is already installed. This can cause problems if the packages is installed in the user
+    # site-packages and pip deems the requirement satisfied, but Blender cannot import the package from the user
+    # site-packages. Hence, the environment variable PYTHONNOUSERSITE is set to disallow pip from checking the user
+    # site-packages. If the package is not already installed for Blender's Python interpreter, it will then try to.
+    # The paths used by pip can be checked with the following:
+    # `subprocess.run([bpy.app.binary_path_python, "-m", "site"], check=True)`
+
+    # Create a copy of the environment variables and modify them for the subprocess call
+
+    environ_copy = dict(os.environ)
+    environ_copy["PYTHONNOUSERSITE"] = "1"
+    environ_copy["PYTHONUNBUFFERED"] = "1"
+
+    install_command = pip_install_command(venv_path, requirements, cache_dir, wheelhouse)
+
+    # Time spent collecting (resolving and downloading) each package, then installing all of them
+    start = time.time()
+    package_times = {}
+    current_package, current_start = None, start
+    top_level = {normalize_package_name(name) for name in missing}
+    collected = 0
+
+    process = subprocess.Popen(install_command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=environ_copy)
+    for line in process.stdout:
+        print(line, end="")
+        line = line.strip()
+        if line.startswith("Collecting ") or line.startswith("Installing collected packages"):
+            now = time.time()
+            if current_package is not None:
+                package_times[current_package] = now - current_start
+            current_start = now
+
+        if line.startswith("Collecting "):
+            current_package = re.split(r"[<>=!~\[ ;]", line[len("Collecting "):], maxsplit=1)[0]
+            if normalize_package_name(current_package) in top_level:
+                collected += 1
+            report(
+                0.8 * collected / len(top_level),
+                f"Collecting {current_package} [{collected}/{len(top_level)}] {now - start:.0f}s",
             )
-            context.window_manager.progress_text = f"Error installing {module_name}"
-        bpy.ops.wm.redraw_timer(type='DRAW_WIN_SWAP', iterations=1, time_limit=0.0)
-    context.window_manager.progress = 1
+        elif line.startswith("Installing collected packages"):
+            current_package = "install"
+            report(0.9, f"Installing packages... {time.time() - start:.0f}s")
+
+    returncode = process.wait()
+    if current_package is not None:
+        package_times[current_package] = time.time() - current_start
+    total = time.time() - start
+
+    print(f"\nInstallation took {total:.0f}s")
+    for package, seconds in sorted(package_times.items(), key=lambda item: -item[1]):
+        print(f"  {package}: {seconds:.1f}s")
+
+    if returncode != 0:
+        report(1, f"Error installing dependencies after {total:.0f}s")
+        raise subprocess.CalledProcessError(returncode, install_command)
+
+    slowest = max(package_times, key=package_times.get, default=None)
+    text = f"Installed {len(requirements)} packages in {total:.0f}s"
+    if slowest is not None:
+        text += f" (slowest: {slowest} {package_times[slowest]:.0f}s)"
+    report(1, text)
 
 
 def execution_handler(
-    venv_path: str, operation_function: str, user_input: dict, output: bool = True
+    venv_path: str, operation_function: str, user_input: dict, output: bool = True, blocking: bool = True
 ):
     """
     In order for the Venv to work inside Blender, we must run the script as the Venv is activated
@@ -187,31 +316,34 @@ def execution_handler(
     This file controls the interactions with the activate.bat file, it opens, modifies, and runs the files depending on
     what functions are needed by Material Crafter. Each main function, when called, will activate Stable Diffusion with the
     appropriate input variables.
+
+    The arguments are passed in a JSON request file (see run_request in sd_functions.py) rather than on the
+    command line, so that prompts with quotes and list or dict arguments reach the script unchanged.
+    Every call writes its own activate_and_run script next to activate.bat, so that concurrent jobs do not run
+    each other's commands. With blocking=False, the process is started and returned without waiting for it.
+    The request file and the script are then removed by remove_request_files once the process has exited.
     """
 
     activate_bat_path = venv_path / "Scripts" / "activate.bat"
-    activate_and_run_path = venv_path / "Scripts" / "activate_and_run.bat"
     python_exe_path = venv_path / "Scripts" / "python.exe"
 
     sd_interface_path = Path(__file__).parent / "sd_functions.py"
 
-    # Get args from user_input:
-    args_string = " "
-    for (
-        arg_name,
-        arg_value,
-    ) in user_input.items():  # user_input: {param_name: param_value}
-        args_string += f"""--{arg_name} "{arg_value}" """
+    request_file, request_path = tempfile.mkstemp(prefix="mc_request_", suffix=".json")
+    with os.fdopen(request_file, "w") as f:
+        json.dump({"cmd": operation_function, "kwargs": user_input}, f, default=str)
 
     commands = [
-        f"""
-            "{python_exe_path}" "{sd_interface_path}" {operation_function}{args_string} 
-            """,  # NOTE: "operation_function" is the name of the function in sd_interface.py given to the command line.
+        subprocess.list2cmdline([
+            str(python_exe_path), str(sd_interface_path), "run_request", "--request_path", request_path,
+        ]),
     ]
 
     # Send commands to activate.bat
+    run_file, run_path = tempfile.mkstemp(prefix="activate_and_run_", suffix=".bat", dir=venv_path / "Scripts")
+    activate_and_run_path = Path(run_path)
     with open(activate_bat_path, "rt") as bat_in:
-        with open(activate_and_run_path, "wt") as bat_out:
+        with os.fdopen(run_file, "wt") as bat_out:
             for line in bat_in:
                 bat_out.write(line)
 
@@ -219,13 +351,349 @@ def execution_handler(
                 bat_out.write(f"\n{line}")
 
     # Run activate.bat, activate Venv:
-    # if output:
+    if not blocking:
+        process = subprocess.Popen(
+            activate_and_run_path.as_posix(),
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            env=worker_environment(),
+        )
+        process.request_files = [request_path, run_path]
+        return process
+
     try:
-        output = subprocess.check_output(
+        subprocess.check_output(
             activate_and_run_path.as_posix(),
+            env=worker_environment(),
         )
-    except subprocess.CalledProcessError as e:
-        raise e
+    finally:
+        remove_request_files([request_path, run_path])
+
+
+def remove_request_files(paths: list):
+    """
+    Removes the request file and the script written by execution_handler for a process that has exited.
+    """
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+class GenerationWorker(object):
+    """
+    Long-lived sd_functions.py process that keeps the diffusion pipeline loaded between generations.
+    Requests and responses are exchanged as JSON lines over the process stdin/stdout pipes.
+    Switching model, precision or device is handled by the worker pipeline cache, the process itself
+    is only restarted when its launch configuration (idle timeout, memory budgets) changes.
+    """
+
+    def __init__(self):
+        self.process = None
+        self.key = None
+        self.lock = threading.Lock()
+        # Job whose request is being run, see GenerationJob.cancel
+        self.owner = None
+        # Number of times the worker was killed, to tell the requests dropped by another job's cancel
+        self.kills = 0
+        # Pipeline cache counters sent with the last result, see cache_stats
+        self.stats = None
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, venv_path: Path, idle_timeout: float = 600, ram_budget_gb: float = 0, vram_budget_gb: float = 0):
+        python_exe_path = venv_path / "Scripts" / "python.exe"
+        sd_interface_path = Path(__file__).parent / "sd_functions.py"
+
+        self.process = subprocess.Popen(
+            [
+                python_exe_path, sd_interface_path, "serve",
+                "--idle_timeout", str(idle_timeout),
+                "--ram_budget_gb", str(ram_budget_gb),
+                "--vram_budget_gb", str(vram_budget_gb),
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            env=worker_environment(),
+        )
+        self.key = (venv_path, idle_timeout, ram_budget_gb, vram_budget_gb)
+
+    def ensure(self, venv_path: Path, idle_timeout: float = 600, ram_budget_gb: float = 0, vram_budget_gb: float = 0):
+        """
+        Makes sure a worker with the given launch configuration is running and answering, restarting it otherwise.
+        Waits for the request in progress.
+        """
+        with self.lock:
+            if self.is_alive() and self.key == (venv_path, idle_timeout, ram_budget_gb, vram_budget_gb):
+                if self._ping():
+                    return
+                print("The generation worker does not answer, restarting it")
+            self.stop()
+            self.start(venv_path, idle_timeout, ram_budget_gb, vram_budget_gb)
+
+    def cache_stats(self) -> dict:
+        """
+        Hit/miss/eviction counters and memory usage of the worker pipeline cache, as sent with the last result,
+        so that the UI can show them without waiting for the generation in progress. None if the worker is not
+        running.
+        """
+        return self.stats if self.is_alive() else None
+
+    def request(self, cmd: str, on_event=None, owner=None, **kwargs) -> dict:
+        """
+        Sends a request and waits for its result. Events sent by the worker before the result,
+        like generation progress, are passed to on_event.
+        owner: job sending the request, which is not sent if the job was cancelled while waiting for the worker
+        """
+        with self.lock:
+            self.owner = owner
+            try:
+                if owner is not None and owner.cancelled:
+                    raise WorkerError("Cancelled before the request was sent")
+                return self._exchange(cmd, on_event, kwargs)
+            finally:
+                self.owner = None
+
+    def _exchange(self, cmd: str, on_event, kwargs: dict) -> dict:
+        """
+        Sends a request and reads the events until its result. The lock must be held.
+        """
+        if not self.is_alive():
+            raise WorkerError("Generation worker is not running")
+
+        process = self.process
+        process.stdin.write(json.dumps({"cmd": cmd, "kwargs": kwargs}, default=str) + "\n")
+        process.stdin.flush()
+
+        for line in process.stdout:
+            message = parse_event(line)
+            if message is None:
+                print(line, end="")
+                continue
+            if message.get("event") == "result":
+                if not message.get("ok"):
+                    raise WorkerError(message.get("error"))
+                if "cache" in message:
+                    self.stats = message["cache"]
+                return message
+            if on_event is not None:
+                on_event(message)
+
+        raise WorkerError(f"Generation worker exited with code {process.wait()}")
+
+    def ping(self) -> bool:
+        """
+        Health check, returns True if the worker answers.
+        """
+        with self.lock:
+            return self._ping()
+
+    def _ping(self) -> bool:
+        try:
+            return self._exchange("ping", None, {})["ok"]
+        except (WorkerError, OSError):
+            return False
+
+    def kill(self):
+        """
+        Kills the worker immediately, dropping the generation in progress.
+        """
+        if self.process is not None:
+            self.kills += 1
+            kill_process_tree(self.process)
+
+    def stop(self, timeout: float = 5):
+        if self.process is None:
+            return
+        if self.is_alive():
+            try:
+                self.process.stdin.write(json.dumps({"cmd": "shutdown"}) + "\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        self.process = None
+        self.key = None
+
+
+worker = GenerationWorker()
+
+
+def release_shared_maps(names: list):
+    """
+    Lets the worker free the shared memory blocks of maps read by the add-on. The request is sent from a
+    background thread, since it waits for the worker to finish the generation of a queued job.
+    """
+    def release():
+        try:
+            worker.request("release", names=names)
+        except (WorkerError, OSError) as e:
+            # A stopped worker has freed its blocks
+            print(f"Could not release the shared maps: {e}")
+
+    threading.Thread(target=release, daemon=True).start()
+
+
+def parse_event(line: str):
+    """
+    Returns the event in a JSON line printed by sd_functions.py, or None if the line is not an event.
+    """
+    if not line.startswith("{"):
+        return None
+    try:
+        message = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return message if isinstance(message, dict) and "event" in message else None
+
+
+def kill_process_tree(process: subprocess.Popen):
+    """
+    Kills a process with its children. On Windows, the python process is a child of the activate_and_run_*.bat shell.
+    """
+    if process.poll() is not None:
+        return
+    if os.name == "nt":
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+    else:
+        process.kill()
+
+
+class GenerationJob(object):
+    """
+    Runs a sd_functions command in a background thread, either in the generation worker or in a new process,
+    so that Blender stays responsive. The job is polled by the generation operators and can be cancelled.
+    """
+
+    def __init__(self, venv_path: Path, operation_function: str, arguments: dict, worker_config: tuple = None):
+        self.venv_path = venv_path
+        self.operation_function = operation_function
+        self.arguments = arguments
+        # Launch configuration of the worker, None to run in a new process
+        self.worker_config = worker_config
+        self.process = None
+        self.cancelled = False
+        self.output = None
+        self.error = None
+        # Last progress event received, and when it was received
+        self.progress = None
+        self.progress_time = None
+        self.started = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self, active: bool = True):
+        """
+        Starts the job. With active, it becomes the active_job shown and cancelled by the generation operators,
+        queued jobs are tracked by the job queue instead.
+        """
+        global active_job
+        if active:
+            active_job = self
+        self.started = time.time()
+        self.thread.start()
+        return self
+
+    def _on_event(self, message: dict):
+        if message.get("event") == "progress":
+            self.progress = message
+            self.progress_time = time.time()
+
+    def _run(self):
+        try:
+            if self.worker_config is not None:
+                self.output = self._request().get("output")
+            else:
+                self.process = execution_handler(
+                    self.venv_path, self.operation_function, self.arguments, blocking=False
+                )
+                if self.cancelled:
+                    kill_process_tree(self.process)
+                for line in self.process.stdout:
+                    message = parse_event(line)
+                    if message is None:
+                        print(line, end="")
+                    else:
+                        self._on_event(message)
+                returncode = self.process.wait()
+                remove_request_files(self.process.request_files)
+                if returncode != 0:
+                    raise subprocess.CalledProcessError(returncode, self.process.args)
+        except Exception as e:
+            self.error = e
+
+    def _request(self) -> dict:
+        """
+        Runs the job in the worker. When the worker is killed by the cancel of another job while this one waits
+        for it, the request was not run: the worker is started again and the request sent to it.
+        """
+        while True:
+            kills = worker.kills
+            worker.ensure(self.venv_path, *self.worker_config)
+            try:
+                return worker.request(self.operation_function, on_event=self._on_event, owner=self, **self.arguments)
+            except (WorkerError, OSError):
+                if self.cancelled or worker.kills == kills:
+                    raise
+                print("The generation worker was stopped by another job, restarting it")
+
+    @property
+    def done(self) -> bool:
+        return not self.thread.is_alive()
+
+    @property
+    def in_flight(self) -> bool:
+        """
+        Whether the job is being run, as opposed to waiting for the worker to finish the request of another job.
+        """
+        if self.worker_config is not None:
+            return worker.owner is self
+        return not self.done
+
+    def progress_status(self) -> tuple:
+        """
+        Progress of the job as (factor, text) for the progress bar.
+        """
+        if self.progress is None:
+            return 0.0, f"Loading model... {time.time() - self.started:.0f}s"
+
+        factor = self.progress["step"] / max(self.progress["total"], 1)
+        text = (
+            f"{self.progress['label']} Step {self.progress['step']}/{self.progress['total']}, "
+            f"{self.progress['eta']:.0f}s left ({self.progress['steps_per_second']:.2f} it/s)"
+        ).strip()
+
+        stalled = time.time() - self.progress_time
+        if stalled > 30:
+            text += f", no progress for {stalled:.0f}s"
+        return factor, text
+
+    def cancel(self):
+        """
+        Stops the job. The worker is shared by the generation operators and the job queue, so it is only killed
+        when it runs this job, a job waiting for it just does not send its request.
+        """
+        self.cancelled = True
+        if self.worker_config is not None:
+            if worker.owner is self:
+                worker.kill()
+        elif self.process is not None:
+            kill_process_tree(self.process)
+
+
+active_job = None
+
+
+def generation_running() -> bool:
+    return active_job is not None and not active_job.done
 
 
 def import_modules(venv_path: str):
@@ -243,6 +711,151 @@ def import_module(module_name):
     pm.add_venv_path_visibility()
     globals()[module_name] = importlib.import_module(module_name)
 
+def model_revision(model_id: str) -> str:
+    """
+    Revision of the weights of model_id in the model path, see result_cache.model_revision.
+    """
+    return result_cache.model_revision(model_id, pm.named_paths['model'] / "hub")
+
+
+def worker_environment() -> dict:
+    """
+    Environment of the Stable Diffusion processes: only the Venv packages, and the Hugging Face hub cache in the
+    model path, where the add-on looks for the downloaded weights.
+    """
+    environ_copy = dict(os.environ)
+    environ_copy["PYTHONNOUSERSITE"] = "1"
+    environ_copy["PYTHONUNBUFFERED"] = "1"
+    environ_copy["HF_HUB_CACHE"] = str(pm.named_paths['model'] / "hub")
+    return environ_copy
+
+
+ENVIRONMENT_MANIFEST = "material_crafter_environment.json"
+
+# Venv text files embedding the absolute venv path
+VENV_TEXT_FILES = ("activate", "activate.bat", "deactivate.bat", "Activate.ps1", "activate.fish", "activate.csh")
+
+
+def export_environment(venv_path: Path, archive_path: Path, addon_version: tuple = ()) -> Path:
+    """
+    Exports an installed Venv as a zip archive, with a manifest of the requirements.json hash and the Python
+    version, so that it can be imported on other workstations instead of installing the dependencies again.
+    If archive_path is a directory, the archive is named after the Python version and the requirements hash.
+    """
+    python_version = f"{sys.version_info.major}.{sys.version_info.minor}"
+    archive_path = Path(archive_path)
+    if archive_path.is_dir():
+        archive_path = archive_path / f"material-crafter-venv-py{python_version}-{requirements_hash()[:8]}.zip"
+
+    manifest = {
+        "addon_version": list(addon_version),
+        "requirements_hash": requirements_hash(),
+        "python_version": python_version,
+        "platform": sys.platform,
+        "venv_path": Path(venv_path).as_posix(),
+        "created": time.time(),
+    }
+
+    # Stored, not deflated: the packages are mostly compressed binaries, and extraction stays I/O bound
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        archive.writestr(ENVIRONMENT_MANIFEST, json.dumps(manifest, indent=1))
+        for path in Path(venv_path).rglob("*"):
+            if path.is_file() and "__pycache__" not in path.parts:
+                archive.write(path, Path("venv") / path.relative_to(venv_path))
+    return archive_path
+
+
+def import_environment(archive_path: Path, mc_path: Path) -> dict:
+    """
+    Extracts an archive made by export_environment into mc_path/venv and fixes the absolute paths of the Venv
+    for this machine. The archive is extracted next to the current Venv, which is only replaced once the
+    extraction succeeded, so that no stale package of the previous Venv survives. Returns the archive manifest.
+    :raises: ValueError if the archive was made for another Python version or platform.
+    """
+    python_version = f"{sys.version_info.major}.{sys.version_info.minor}"
+    mc_path = Path(mc_path)
+    mc_path.mkdir(exist_ok=True, parents=True)
+    venv_path = mc_path / "venv"
+
+    with zipfile.ZipFile(archive_path) as archive:
+        manifest = json.loads(archive.read(ENVIRONMENT_MANIFEST))
+        if manifest["python_version"] != python_version or manifest["platform"] != sys.platform:
+            raise ValueError(
+                f"Environment made for Python {manifest['python_version']} on {manifest['platform']}, "
+                f"Blender uses Python {python_version} on {sys.platform}"
+            )
+        if manifest["requirements_hash"] != requirements_hash():
+            print("WARNING: the environment was made for different requirements, some packages may be reinstalled")
+
+        staging_path = Path(tempfile.mkdtemp(prefix="venv_import_", dir=mc_path))
+        try:
+            archive.extractall(
+                staging_path, members=[name for name in archive.namelist() if name.startswith("venv/")]
+            )
+            fix_venv_paths(staging_path / "venv", venv_path, Path(manifest["venv_path"]))
+        except BaseException:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+
+    # The worker runs from the Venv being replaced
+    worker.stop()
+    previous_path = None
+    if venv_path.exists():
+        previous_path = mc_path / f"venv_previous_{int(time.time())}"
+        try:
+            venv_path.rename(previous_path)
+        except OSError:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+    (staging_path / "venv").rename(venv_path)
+    shutil.rmtree(staging_path, ignore_errors=True)
+    if previous_path is not None:
+        shutil.rmtree(previous_path, ignore_errors=True)
+
+    # The installed packages changed, check them again
+    (mc_path / "dependencies_stamp.json").unlink(missing_ok=True)
+
+    pm.update_named_paths(mc_path, "material_crafter")
+    pm.update_named_paths(venv_path, "venv")
+    pm.update_named_paths(venv_path / "Lib" / "site-packages", "site-packages")
+    return manifest
+
+
+def fix_venv_paths(venv_path: Path, final_path: Path, old_path: Path):
+    """
+    Points the Venv extracted in venv_path, made at old_path on another machine, to the Blender Python of this
+    machine and to final_path, where it is moved.
+    """
+    # The Venv base interpreter is the Blender Python of this machine
+    pyvenv_cfg = venv_path / "pyvenv.cfg"
+    lines = []
+    for line in pyvenv_cfg.read_text().splitlines():
+        key = line.split("=", 1)[0].strip()
+        if key == "home":
+            line = f"home = {Path(sys.executable).parent}"
+        elif key == "executable":
+            line = f"executable = {Path(sys.executable)}"
+        elif key == "command":
+            line = f"command = {Path(sys.executable)} -m venv {final_path}"
+        lines.append(line)
+    pyvenv_cfg.write_text("\n".join(lines) + "\n")
+
+    # Activation scripts embed the Venv path
+    replacements = [
+        (str(PureWindowsPath(old_path)), str(PureWindowsPath(final_path))),
+        (old_path.as_posix(), final_path.as_posix()),
+    ]
+    for scripts_dir in (venv_path / "Scripts", venv_path / "bin"):
+        for name in VENV_TEXT_FILES:
+            script = scripts_dir / name
+            if not script.exists():
+                continue
+            text = script.read_text(errors="surrogateescape")
+            for old, new in replacements:
+                text = text.replace(old, new)
+            script.write_text(text, errors="surrogateescape")
+
+
 def check_drive_space(path: str = os.getcwd()):
     """
     Checks current drive if it has enough available space to store the Environment and Stable Diffusion weights.
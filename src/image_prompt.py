@@ -0,0 +1,89 @@
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image
+
+from result_cache import file_digest
+
+# Size of the image prompts fed to the pipeline
+PROMPT_SIZE = (512, 512)
+
+# Content hashes by (path, inode, size, mtime, ctime), so that unchanged files are hashed once per worker
+_digests = {}
+
+
+def prompt_digest(path) -> str:
+    r'''
+    Key of an image prompt: hash of the file content and its modification time. The hash is memoized by the
+    file metadata: a file replaced by another (new inode or change time) is hashed again, but a file rewritten
+    in place with the same size within the timestamp resolution of the file system keeps its previous key.
+    '''
+    stat = os.stat(path)
+    memo = (str(path), stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+    if memo not in _digests:
+        _digests[memo] = f"{file_digest(Path(path))}-{stat.st_mtime_ns}"
+    return _digests[memo]
+
+
+def load_image_prompt(path, size: tuple = PROMPT_SIZE):
+    r'''
+    Decodes and resizes an image prompt. JPEGs are decoded in draft mode at the smallest scale (1/2 to 1/8)
+    still larger than size, a fraction of the time and memory of decoding a full camera image.
+    '''
+    image = Image.open(path)
+    if image.format == "JPEG":
+        image.draft("RGB", size)
+    return image.convert("RGB").resize(size)
+
+
+class ImagePromptCache(object):
+    """
+    Resized image prompts by prompt_digest, in memory up to max_entries and, if cache_dir is given, on disk as
+    cache_dir/<key>.png, so that a reference photo is decoded once across generations and worker restarts.
+    """
+
+    def __init__(self, cache_dir: str = None, max_entries: int = 16):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.decode_seconds = 0.0
+
+    def get(self, path):
+        key = prompt_digest(path)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        disk_path = self.cache_dir / f"{key}.png" if self.cache_dir is not None else None
+        if disk_path is not None and disk_path.exists():
+            self.disk_hits += 1
+            image = Image.open(disk_path)
+            image.load()
+        else:
+            self.misses += 1
+            start = time.time()
+            image = load_image_prompt(path)
+            self.decode_seconds += time.time() - start
+            if disk_path is not None:
+                self.cache_dir.mkdir(exist_ok=True, parents=True)
+                image.save(disk_path, compress_level=1)
+
+        self.entries[key] = image
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return image
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "decode_seconds": self.decode_seconds,
+        }
@@ -0,0 +1,202 @@
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+from . import helpers
+
+# Job states: pending -> running -> done -> applied, or failed / cancelled
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+APPLIED = "applied"
+CANCELLED = "cancelled"
+
+# Jobs dropped from the journal when it is compacted
+FORGOTTEN_STATES = (APPLIED, CANCELLED)
+
+
+class JobJournal(object):
+    """
+    Append-only JSON lines journal of the generation queue: a line with the whole job when it is queued, then a
+    line with the changed fields at every state change. Replaying the lines gives the current jobs, so the queue
+    survives Blender being closed or crashing. A line cut short by a crash is skipped.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def load(self) -> dict:
+        jobs = {}
+        if not self.path.exists():
+            return jobs
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                jobs.setdefault(record["id"], {}).update(record)
+        return jobs
+
+    def append(self, record: dict):
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self, jobs):
+        """
+        Rewrites the journal with a single line per job.
+        """
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        temp_path = self.path.with_suffix(".tmp")
+        with open(temp_path, "w") as f:
+            for job in jobs:
+                f.write(json.dumps(job, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+
+class JobQueue(object):
+    """
+    Generation requests run in the background, at most max_running at a time, and recorded in a JobJournal.
+    tick() is called periodically by the add-on: it collects the finished generations, starts the pending ones
+    and passes the done jobs to apply until it accepts them.
+    """
+
+    def __init__(self, journal_path: Path, venv_path: Path):
+        self.journal = JobJournal(journal_path)
+        self.venv_path = venv_path
+        self.max_running = 1
+        # Jobs by id, in queuing order
+        self.jobs = {}
+        # Generation jobs of the running jobs by id
+        self.running = {}
+
+    def load(self):
+        """
+        Reads the journal of the previous sessions. Applied and cancelled jobs are forgotten, jobs interrupted
+        while running are run again.
+        """
+        jobs = self.journal.load()
+        self.jobs = {job_id: job for job_id, job in jobs.items() if job["state"] not in FORGOTTEN_STATES}
+        for job in self.jobs.values():
+            if job["state"] == RUNNING:
+                job["state"] = PENDING
+        if jobs:
+            self.journal.compact(self.jobs.values())
+
+    def relocate(self, journal_path: Path, venv_path: Path):
+        """
+        Moves the queue to another journal, e.g. when the Material Crafter path changes. The current jobs are
+        written to the new journal, with the unfinished jobs already recorded there. Running jobs keep running.
+        """
+        journal = JobJournal(journal_path)
+        for job_id, job in journal.load().items():
+            if job_id not in self.jobs and job["state"] not in FORGOTTEN_STATES:
+                if job["state"] == RUNNING:
+                    job["state"] = PENDING
+                self.jobs[job_id] = job
+        self.journal = journal
+        self.venv_path = venv_path
+        self.journal.compact(self.jobs.values())
+
+    def add(self, operation_function: str, arguments: dict, target: dict = None, worker_config: tuple = None) -> dict:
+        """
+        Queues a sd_functions command.
+        target: where to apply the result, read by the apply function given to tick
+        """
+        job = {
+            "id": uuid.uuid4().hex,
+            "state": PENDING,
+            "queued": time.time(),
+            "operation_function": operation_function,
+            "arguments": arguments,
+            "target": target or {},
+            "worker_config": worker_config,
+        }
+        self.jobs[job["id"]] = job
+        self.journal.append(job)
+        return job
+
+    def update(self, job: dict, **fields):
+        job.update(fields)
+        self.journal.append({"id": job["id"], **fields})
+
+    def start(self, job: dict):
+        worker_config = tuple(job["worker_config"]) if job["worker_config"] else None
+        generation = helpers.GenerationJob(
+            self.venv_path, job["operation_function"], job["arguments"], worker_config
+        )
+        self.running[job["id"]] = generation.start(active=False)
+        self.update(job, state=RUNNING, started=time.time())
+
+    def tick(self, apply=None):
+        """
+        Advances the queue. apply(job) applies a done job, returning False to be called again later (e.g. when
+        the target is in another .blend file). Exceptions raised by apply fail the job.
+        """
+        for job_id, generation in list(self.running.items()):
+            if not generation.done:
+                continue
+            del self.running[job_id]
+            job = self.jobs[job_id]
+            if generation.cancelled:
+                self.update(job, state=CANCELLED)
+            elif generation.error is not None:
+                print(generation.error)
+                self.update(job, state=FAILED, error=str(generation.error))
+            else:
+                self.update(job, state=DONE, finished=time.time())
+
+        pending = [job for job in self.jobs.values() if job["state"] == PENDING]
+        for job in pending[:max(self.max_running - len(self.running), 0)]:
+            self.start(job)
+
+        if apply is None:
+            return
+        for job in [job for job in self.jobs.values() if job["state"] == DONE]:
+            try:
+                if apply(job):
+                    self.update(job, state=APPLIED)
+            except Exception as e:
+                self.update(job, state=FAILED, error=f"Applying the result failed: {e}")
+
+    def cancel(self, job_id: str):
+        """
+        Cancels a pending or running job. A job being run in the generation worker stops the worker, like
+        cancelling a generation, a job still waiting for the worker is dropped right away.
+        """
+        job = self.jobs[job_id]
+        if job_id in self.running:
+            generation = self.running[job_id]
+            generation.cancel()
+            if not generation.in_flight:
+                del self.running[job_id]
+                self.update(job, state=CANCELLED)
+        elif job["state"] == PENDING:
+            self.update(job, state=CANCELLED)
+
+    def clear_finished(self):
+        """
+        Forgets the failed, applied and cancelled jobs.
+        """
+        self.jobs = {
+            job_id: job for job_id, job in self.jobs.items() if job["state"] not in FORGOTTEN_STATES + (FAILED,)
+        }
+        self.journal.compact(self.jobs.values())
+
+    def progress_status(self, job_id: str) -> tuple:
+        """
+        Progress of a running job as (factor, text), see GenerationJob.progress_status.
+        """
+        return self.running[job_id].progress_status()
+
+    @property
+    def busy(self) -> bool:
+        return any(job["state"] in (PENDING, RUNNING) for job in self.jobs.values())
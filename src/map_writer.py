@@ -0,0 +1,234 @@
+import json
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+MAP_NAMES = ("basecolor", "normal", "height", "roughness", "metallic")
+
+# File extension of each supported format
+FORMATS = {
+    "png": "png",
+    "png16": "png",
+    "exr": "exr",
+    "webp": "webp",
+}
+
+MANIFEST_NAME = "maps.json"
+
+
+def to_float(image) -> np.ndarray:
+    r'''
+    Converts a PIL image or an array to a float32 HxW or HxWxC array in [0, 1].
+    '''
+    array = np.asarray(image)
+    if array.dtype == np.uint8:
+        return array.astype(np.float32) / 255
+    if array.dtype == np.uint16:
+        return array.astype(np.float32) / 65535
+    return np.clip(array.astype(np.float32), 0, 1)
+
+
+def to_uint8(image) -> np.ndarray:
+    array = np.asarray(image)
+    if array.dtype == np.uint8:
+        return array
+    return np.round(to_float(array) * 255).astype(np.uint8)
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def write_png16(path: Path, image, compress_level: int = 6):
+    r'''
+    Writes a 16-bit grayscale or RGB PNG. PIL can only write 16-bit grayscale PNGs, so the file is encoded here.
+    '''
+    array = np.round(to_float(image) * 65535).astype(">u2")
+    height, width = array.shape[:2]
+    channels = 1 if array.ndim == 2 else array.shape[2]
+    color_type = {1: 0, 3: 2, 4: 6}[channels]
+
+    # Every scanline starts with its filter type, 0 (None)
+    scanlines = np.zeros((height, 1 + width * channels * 2), dtype=np.uint8)
+    scanlines[:, 1:] = array.reshape(height, -1).view(np.uint8)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 16, color_type, 0, 0, 0)))
+        f.write(_png_chunk(b"IDAT", zlib.compress(scanlines.tobytes(), compress_level)))
+        f.write(_png_chunk(b"IEND", b""))
+
+
+def _exr_attribute(name: str, attribute_type: str, data: bytes) -> bytes:
+    return name.encode() + b"\0" + attribute_type.encode() + b"\0" + struct.pack("<i", len(data)) + data
+
+
+def write_exr_half(path: Path, image):
+    r'''
+    Writes an uncompressed half-float scanline OpenEXR file, with a Y channel for grayscale maps or R, G, B
+    channels for color maps. Uncompressed keeps the encode time negligible.
+    '''
+    array = to_float(image)
+    if array.ndim == 3 and array.shape[2] == 1:
+        array = array[:, :, 0]
+    height, width = array.shape[:2]
+
+    # Channels are stored in alphabetical order
+    if array.ndim == 2:
+        names = ["Y"]
+        planes = array[:, None, :]
+    else:
+        names = ["B", "G", "R"]
+        planes = array[:, :, [2, 1, 0]].transpose(0, 2, 1)
+    planes = np.ascontiguousarray(planes.astype("<f2"))
+
+    channels = b"".join(
+        name.encode() + b"\0" + struct.pack("<iB3xii", 1, 0, 1, 1) for name in names
+    ) + b"\0"
+    window = struct.pack("<iiii", 0, 0, width - 1, height - 1)
+    header = b"".join([
+        struct.pack("<ii", 20000630, 2),
+        _exr_attribute("channels", "chlist", channels),
+        _exr_attribute("compression", "compression", b"\0"),
+        _exr_attribute("dataWindow", "box2i", window),
+        _exr_attribute("displayWindow", "box2i", window),
+        _exr_attribute("lineOrder", "lineOrder", b"\0"),
+        _exr_attribute("pixelAspectRatio", "float", struct.pack("<f", 1)),
+        _exr_attribute("screenWindowCenter", "v2f", struct.pack("<ff", 0, 0)),
+        _exr_attribute("screenWindowWidth", "float", struct.pack("<f", 1)),
+        b"\0",
+    ])
+
+    # One scanline per block: y coordinate, data size, then the line of each channel
+    line_size = len(names) * width * 2
+    blocks = np.empty((height, 8 + line_size), dtype=np.uint8)
+    blocks[:, :8] = np.stack(
+        [np.arange(height, dtype="<i4"), np.full(height, line_size, dtype="<i4")], axis=1
+    ).view(np.uint8)
+    blocks[:, 8:] = planes.reshape(height, -1).view(np.uint8)
+
+    first_block = len(header) + 8 * height
+    offsets = (first_block + np.arange(height, dtype="<u8") * (8 + line_size)).astype("<u8")
+
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(offsets.tobytes())
+        f.write(blocks.tobytes())
+
+
+def webp_method(compress_level: int) -> int:
+    r'''
+    WebP encoder method (0 fastest to 6 slowest) for a zlib compress level (0 to 9): the default level 6 gives
+    method 4, the default of the encoder, level 1 (fast compression) gives method 0.
+    '''
+    return min(compress_level * 2 // 3, 6)
+
+
+def write_map(image, path_stem: Path, map_format: str = "png", compress_level: int = 6) -> dict:
+    r'''
+    Encodes a single map, returning the file name, encode time and file size.
+    '''
+    if map_format not in FORMATS:
+        raise ValueError(f"Unrecognized map format {map_format}")
+
+    path = path_stem.with_suffix(f".{FORMATS[map_format]}")
+    start = time.time()
+
+    if map_format == "png":
+        Image.fromarray(to_uint8(image)).save(path, compress_level=compress_level)
+    elif map_format == "png16":
+        write_png16(path, image, compress_level)
+    elif map_format == "exr":
+        write_exr_half(path, image)
+    elif map_format == "webp":
+        # Lossless, the maps are data
+        Image.fromarray(to_uint8(image)).save(path, lossless=True, method=webp_method(compress_level))
+
+    return {
+        "file": path.name,
+        "format": map_format,
+        "seconds": time.time() - start,
+        "bytes": path.stat().st_size,
+    }
+
+
+def write_maps(maps: dict, save_dir: Path, map_formats: dict = None, compress_level: int = 6) -> dict:
+    r'''
+    Encodes the maps concurrently and writes a maps.json manifest in save_dir with the file of each map,
+    its encode time and file size. load_texture_maps reads the manifest to find the files.
+    maps: map name -> PIL image or array, see pipeline_maps and pack_maps
+    map_formats: map name -> format in FORMATS, missing maps are saved as 8-bit PNG
+    '''
+    save_dir = Path(save_dir)
+    map_formats = map_formats or {}
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=len(maps)) as executor:
+        futures = {
+            name: executor.submit(write_map, image, save_dir / name, map_formats.get(name, "png"), compress_level)
+            for name, image in maps.items()
+        }
+        stats = {name: future.result() for name, future in futures.items()}
+
+    manifest = {"maps": stats, "seconds": time.time() - start}
+    if "packed" in maps:
+        manifest["packed"] = list(PACKED_MAPS)
+    with open(save_dir / MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def pipeline_maps(image) -> dict:
+    r'''
+    Maps of a pipeline output image, by map name.
+    '''
+    return {name: getattr(image, name) for name in MAP_NAMES}
+
+
+# Maps stored in the R, G, B channels of the packed map
+PACKED_MAPS = ("height", "roughness", "metallic")
+
+
+def to_channel(image) -> np.ndarray:
+    r'''
+    Single channel HxW array of a grayscale map.
+    '''
+    array = np.asarray(image)
+    return array[:, :, 0] if array.ndim == 3 else array
+
+
+def pack_maps(maps: dict) -> dict:
+    r'''
+    Replaces the height, roughness and metallic maps with a single "packed" RGB map holding them in its
+    R, G and B channels. Halves the files and textures to load for a material.
+    '''
+    channels = [to_channel(maps[name]) for name in PACKED_MAPS]
+    if any(channel.dtype != np.uint8 for channel in channels):
+        channels = [to_float(channel) for channel in channels]
+
+    packed = {name: image for name, image in maps.items() if name not in PACKED_MAPS}
+    packed["packed"] = np.stack(channels, axis=-1)
+    return packed
+
+
+def share_maps(maps: dict):
+    r'''
+    Copies the raw pixels of the maps into shared memory blocks, so that the add-on can read them without
+    encoding and decoding files. Returns the blocks, which must stay open until the add-on has read them,
+    and their description: map name -> {"name": block name, "shape": [...], "dtype": "|u1"}
+    '''
+    blocks = []
+    shared = {}
+    for name, image in maps.items():
+        array = np.ascontiguousarray(np.asarray(image))
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        shared[name] = {"name": block.name, "shape": list(array.shape), "dtype": array.dtype.str}
+    return blocks, shared
@@ -0,0 +1,323 @@
+import contextlib
+import gc
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import torch
+from diffusers import DiffusionPipeline, EulerDiscreteScheduler, DDIMScheduler
+
+SCHEDULERS = {
+    "ddim": DDIMScheduler,
+    "euler": EulerDiscreteScheduler,
+}
+
+GB = 2**30
+
+
+def torch_dtype_from_precision(precision: str):
+    if precision == "fp32":
+        return torch.float32
+    elif precision == "fp16":
+        return torch.float16
+    elif precision == "bf16":
+        # Weights stay in fp32, the computations run in bf16 under autocast, see inference_context
+        return torch.float32
+    elif precision == "int8-cpu":
+        # Loaded in fp32, then the linear layers are quantized, see quantize_pipeline
+        return torch.float32
+    else:
+        raise ValueError(f"Unrecognized precision value {precision}")
+
+
+def bf16_supported(device: str) -> bool:
+    r'''
+    Whether the device runs bf16 natively: AVX512-BF16/AMX CPUs, Ampere and later GPUs.
+    '''
+    if device == "cpu":
+        is_supported = getattr(torch.ops.mkldnn, "_is_mkldnn_bf16_supported", None)
+        return bool(is_supported and is_supported())
+    return torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+
+
+def inference_context(precision: str, device: str):
+    r'''
+    Context of a pipeline call: inference mode, plus bf16 autocast for the bf16 precision when supported.
+    '''
+    context = contextlib.ExitStack()
+    context.enter_context(torch.inference_mode())
+    if precision == "bf16":
+        if bf16_supported(device):
+            device_type = "cpu" if device == "cpu" else "cuda"
+            context.enter_context(torch.autocast(device_type=device_type, dtype=torch.bfloat16))
+        else:
+            print(f"bf16 is not supported on {device}, running in fp32")
+    return context
+
+
+# Intra-op thread count chosen by torch when the process started, restored by configure_threads(0)
+DEFAULT_THREADS = torch.get_num_threads()
+
+
+def configure_threads(threads: int = 0, interop_threads: int = 0):
+    r'''
+    Sets the intra-op and inter-op CPU thread pools of torch, 0 restores the default (all physical cores).
+    The inter-op pool can only be set once per process, so 0 keeps its current size.
+    '''
+    threads = threads if threads > 0 else DEFAULT_THREADS
+    if torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+    if interop_threads > 0 and torch.get_num_interop_threads() != interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Can only be set before the first parallel operation of the process
+            print("The inter-op thread count can only be changed in a new worker, restart the worker to apply it")
+
+
+def set_attention(pipe, device: str):
+    r'''
+    xformers attention when available on the GPU, otherwise PyTorch scaled dot product attention (SDPA),
+    falling back to sliced attention on PyTorch versions without SDPA.
+    '''
+    if device != "cpu":
+        try:
+            pipe.enable_xformers_memory_efficient_attention()
+            return
+        except (ImportError, ValueError, RuntimeError) as e:
+            print(f"xformers attention not available ({e}), using PyTorch attention")
+
+    if hasattr(torch.nn.functional, "scaled_dot_product_attention"):
+        from diffusers.models.attention_processor import AttnProcessor2_0
+        pipe.unet.set_attn_processor(AttnProcessor2_0())
+    else:
+        pipe.enable_attention_slicing()
+
+
+def compile_unet(pipe, cache_dir: str = None):
+    r'''
+    Compiles the UNet with torch.compile. The compiled graphs are stored in cache_dir, so that later workers
+    skip most of the compilation time.
+    '''
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = str(cache_dir)
+        os.environ["TORCHINDUCTOR_FX_GRAPH_CACHE"] = "1"
+    return torch.compile(pipe.unet, fullgraph=False, dynamic=False)
+
+
+# Components whose linear layers are quantized to int8 by the int8-cpu precision
+QUANTIZED_COMPONENTS = ("unet", "text_encoder")
+
+
+def model_revision(model_path: str) -> str:
+    r'''
+    Revision of a model in the Hugging Face cache of the worker, see result_cache.model_revision. The add-on
+    points HF_HUB_CACHE to its model path, so both sides read the same cache.
+    '''
+    from huggingface_hub.constants import HF_HUB_CACHE
+    from result_cache import model_revision as cached_revision
+
+    return cached_revision(model_path, HF_HUB_CACHE)
+
+
+def quantized_path(cache_dir: str, model_path: str, component: str) -> Path:
+    r'''
+    File of a quantized component. Modules are pickled, so the key includes the torch and diffusers versions.
+    '''
+    import diffusers
+
+    key = json.dumps([model_path, model_revision(model_path), torch.__version__, diffusers.__version__])
+    return Path(cache_dir) / hashlib.sha256(key.encode()).hexdigest()[:16] / f"{component}.pt"
+
+
+def load_quantized(model_path: str, cache_dir: str = None) -> dict:
+    r'''
+    Quantized components found in cache_dir, by name, to be passed to from_pretrained instead of loading them.
+    '''
+    components = {}
+    if not cache_dir:
+        return components
+    for component in QUANTIZED_COMPONENTS:
+        path = quantized_path(cache_dir, model_path, component)
+        if path.exists():
+            components[component] = torch.load(path, weights_only=False)
+    return components
+
+
+def quantize_pipeline(pipe, model_path: str, cache_dir: str = None, skip=()):
+    r'''
+    Applies dynamic int8 quantization to the linear layers of the UNet and the text encoder: weights are stored
+    in int8, activations are quantized on the fly. Quantized components are saved in cache_dir, so that the
+    conversion is done once per model.
+    '''
+    for component in QUANTIZED_COMPONENTS:
+        module = getattr(pipe, component, None)
+        if module is None or component in skip:
+            continue
+        module = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+        setattr(pipe, component, module)
+
+        if cache_dir:
+            path = quantized_path(cache_dir, model_path, component)
+            path.parent.mkdir(exist_ok=True, parents=True)
+            torch.save(module, path)
+            print(f"Saved quantized {component} to {path}")
+
+
+def pipeline_size(pipe) -> int:
+    r'''
+    Bytes taken by the weights of all the torch modules of a pipeline.
+    '''
+    size = 0
+    for component in pipe.components.values():
+        if isinstance(component, torch.nn.Module):
+            size += sum(p.numel() * p.element_size() for p in component.parameters())
+            size += sum(b.numel() * b.element_size() for b in component.buffers())
+    return size
+
+
+class PipelineCache(object):
+    """
+    In-process cache of loaded diffusion pipelines.
+
+    Weights are cached by (model_path, precision, device). Scheduler, FreeU and torch.compile are applied on top
+    of the cached weights, so switching between them never reloads the UNet/VAE. Once the pipelines placed on
+    the GPU (VRAM) or on the CPU (RAM) exceed their budget, the least recently used ones are evicted.
+    The most recently used pipeline is always kept, so a budget of 0 keeps a single pipeline in memory.
+    """
+
+    def __init__(self, ram_budget_gb: float = 0, vram_budget_gb: float = 0):
+        self.ram_budget = ram_budget_gb * GB
+        self.vram_budget = vram_budget_gb * GB
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.scheduler_swaps = 0
+
+    def get(self, model_path: str, precision: str, device: str, scheduler: str = "ddim", free_u: bool = False,
+            compile: bool = False, compile_cache_dir: str = None, quantized_cache_dir: str = None):
+        key = (model_path, precision, device)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            self.misses += 1
+            self.entries[key] = self._load(model_path, precision, device, quantized_cache_dir)
+            self._evict()
+
+        entry = self.entries[key]
+        pipe = entry["pipe"]
+
+        if entry["scheduler"] != scheduler:
+            if scheduler not in SCHEDULERS:
+                raise NotImplementedError(f"Scheduler {scheduler} not supported")
+            if scheduler not in entry["schedulers"]:
+                entry["schedulers"][scheduler] = SCHEDULERS[scheduler].from_config(entry["scheduler_config"])
+            pipe.scheduler = entry["schedulers"][scheduler]
+            entry["scheduler"] = scheduler
+            self.scheduler_swaps += 1
+
+        if entry["free_u"] != bool(free_u):
+            if free_u:
+                pipe.enable_freeu(s1=0.9, s2=0.2, b1=1.1, b2=1.2)
+            else:
+                pipe.disable_freeu()
+            entry["free_u"] = bool(free_u)
+
+        if compile and entry["compiled_unet"] is None:
+            entry["compiled_unet"] = compile_unet(pipe, compile_cache_dir)
+        pipe.unet = entry["compiled_unet"] if compile else entry["unet"]
+
+        return pipe
+
+    def _load(self, model_path: str, precision: str, device: str, quantized_cache_dir: str = None) -> dict:
+        try:
+            pipe = self._from_pretrained(model_path, precision, device, quantized_cache_dir)
+        except torch.cuda.OutOfMemoryError:
+            # Make room by dropping every other pipeline, then retry once
+            self.clear()
+            pipe = self._from_pretrained(model_path, precision, device, quantized_cache_dir)
+
+        return {
+            "pipe": pipe,
+            "device": device,
+            "size": pipeline_size(pipe),
+            "scheduler_config": pipe.scheduler.config,
+            "schedulers": {},
+            "scheduler": None,
+            "free_u": False,
+            "unet": pipe.unet,
+            "compiled_unet": None,
+        }
+
+    def _from_pretrained(self, model_path: str, precision: str, device: str, quantized_cache_dir: str = None):
+        quantized = {}
+        if precision == "int8-cpu":
+            if device != "cpu":
+                raise ValueError("The int8-cpu precision only runs on the CPU")
+            quantized = load_quantized(model_path, quantized_cache_dir)
+
+        pipe = DiffusionPipeline.from_pretrained(
+            model_path,
+            trust_remote_code=True,
+            low_cpu_mem_usage=False,
+            device_map=None,
+            torch_dtype=torch_dtype_from_precision(precision),
+            **quantized,
+        )
+        if precision == "int8-cpu":
+            quantize_pipeline(pipe, model_path, quantized_cache_dir, skip=quantized)
+
+        # Enable memory optimization
+        pipe.enable_vae_tiling()
+        pipe.to(device)
+        set_attention(pipe, device)
+
+        if device == "cpu":
+            # Faster convolutions with oneDNN
+            pipe.unet.to(memory_format=torch.channels_last)
+            pipe.vae.to(memory_format=torch.channels_last)
+        return pipe
+
+    def _used(self, on_gpu: bool) -> int:
+        return sum(
+            entry["size"] for entry in self.entries.values()
+            if (entry["device"] != "cpu") == on_gpu
+        )
+
+    def _evict(self):
+        for on_gpu, budget in ((True, self.vram_budget), (False, self.ram_budget)):
+            while self._used(on_gpu) > budget:
+                candidates = [
+                    key for key, entry in list(self.entries.items())[:-1]
+                    if (entry["device"] != "cpu") == on_gpu
+                ]
+                if not candidates:
+                    break
+                self._drop(candidates[0])
+
+    def _drop(self, key):
+        del self.entries[key]
+        self.evictions += 1
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def clear(self):
+        for key in list(self.entries):
+            self._drop(key)
+
+    def stats(self) -> dict:
+        return {
+            "entries": [list(key) for key in self.entries],
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "scheduler_swaps": self.scheduler_swaps,
+            "ram_used_gb": self._used(False) / GB,
+            "vram_used_gb": self._used(True) / GB,
+        }
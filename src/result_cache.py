@@ -0,0 +1,153 @@
+import hashlib
+import json
+import shutil
+import time
+from pathlib import Path
+
+GB = 2**30
+
+# Generation arguments that change how fast the maps are generated, not the maps
+EXECUTION_KWARGS = (
+    "torch_compile", "compile_cache_dir", "cpu_threads", "cpu_interop_threads", "quantized_cache_dir",
+    "use_embedding_cache", "embedding_cache_dir", "image_prompt_cache_dir", "transfer", "write_to_disk",
+)
+
+# Manifest listing the map files of a generated material, see map_writer.write_maps
+MANIFEST_NAME = "maps.json"
+
+
+def file_digest(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def model_revision(model_path: str, hub_cache: Path) -> str:
+    r'''
+    Commit of a model in the Hugging Face hub cache directory hub_cache, or the modification time of a local
+    model directory. Empty if the model is not downloaded yet.
+    '''
+    if Path(model_path).is_dir():
+        return str(Path(model_path).stat().st_mtime_ns)
+    ref = Path(hub_cache) / f"models--{model_path.replace('/', '--')}" / "refs" / "main"
+    return ref.read_text().strip() if ref.exists() else ""
+
+
+def request_key(user_input: dict, sd_kwargs: dict, model_revision: str = "") -> str:
+    r'''
+    Hash of everything that determines the generated maps. Image prompts are hashed by content, so that the
+    same image at another path is a hit and an edited image at the same path is a miss.
+    Returns None for requests with a random seed, since they cannot be reproduced.
+    '''
+    if sd_kwargs.get("seed", -1) < 0:
+        return None
+
+    if user_input["prompt_type"] == "image":
+        prompt = file_digest(Path(user_input["prompt"]))
+    else:
+        prompt = user_input["prompt"]
+
+    payload = {
+        "prompt_type": user_input["prompt_type"],
+        "prompt": prompt,
+        "model_path": user_input["model_path"],
+        "model_revision": model_revision,
+        "precision": user_input["precision"],
+        "device": user_input["device"],
+        "sd_kwargs": {name: value for name, value in sd_kwargs.items() if name not in EXECUTION_KWARGS},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResultCache(object):
+    """
+    Content-addressed cache of generated maps, stored as cache_dir/<request key>/.
+    Entries are evicted in least recently used order once the cache exceeds max_size_gb.
+    """
+
+    def __init__(self, cache_dir: Path, max_size_gb: float = 2):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size_gb * GB
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def lookup(self, key: str):
+        r'''
+        Returns the directory with the cached maps for key, or None on a miss.
+        '''
+        if key is None:
+            return None
+        entry_dir = self._entry_dir(key)
+        meta_path = entry_dir / "cache_entry.json"
+        if not meta_path.exists():
+            return None
+
+        # Record the access for LRU eviction
+        meta = json.load(open(meta_path))
+        meta["last_used"] = time.time()
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        return entry_dir
+
+    def restore(self, key: str, dst_dir: Path) -> bool:
+        r'''
+        Copies the cached maps for key into dst_dir. Returns False on a miss.
+        '''
+        entry_dir = self.lookup(key)
+        if entry_dir is None:
+            return False
+        dst_dir = Path(dst_dir)
+        dst_dir.mkdir(exist_ok=True, parents=True)
+        for path in entry_dir.iterdir():
+            if path.name != "cache_entry.json":
+                shutil.copy2(path, dst_dir / path.name)
+        return True
+
+    def store(self, key: str, src_dir: Path):
+        r'''
+        Adds the maps listed in the manifest of src_dir to the cache under key. Other files, like maps left by
+        earlier generations in another format, are not part of the result. Nothing is stored without a manifest.
+        '''
+        manifest_path = Path(src_dir) / MANIFEST_NAME
+        if key is None or not manifest_path.exists():
+            return
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        paths = [Path(src_dir) / stats["file"] for stats in manifest["maps"].values()] + [manifest_path]
+
+        entry_dir = self._entry_dir(key)
+        entry_dir.mkdir(exist_ok=True, parents=True)
+
+        size = 0
+        for path in paths:
+            shutil.copy2(path, entry_dir / path.name)
+            size += path.stat().st_size
+
+        with open(entry_dir / "cache_entry.json", "w") as f:
+            json.dump({"size": size, "last_used": time.time()}, f)
+
+        self.evict()
+
+    def entries(self) -> list:
+        entries = []
+        if not self.cache_dir.exists():
+            return entries
+        for entry_dir in self.cache_dir.iterdir():
+            meta_path = entry_dir / "cache_entry.json"
+            if meta_path.exists():
+                entries.append((entry_dir, json.load(open(meta_path))))
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda entry: entry[1]["last_used"])
+        total = sum(meta["size"] for _, meta in entries)
+        while entries and total > self.max_size:
+            entry_dir, meta = entries.pop(0)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= meta["size"]
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
@@ -1,12 +1,330 @@
-# from PIL import Image
-from diffusers import DiffusionPipeline, EulerDiscreteScheduler, DDIMScheduler
+# Heavy modules (torch, diffusers, PIL, numpy) are imported inside the commands that need them,
+# so that lightweight commands like probe answer without paying their import time.
+import time
+_IMPORT_START = time.perf_counter()
+
 import fire
+import inspect
+import json
+import os
+import platform
+import queue
+import subprocess
+import sys
+import threading
 from pathlib import Path
-import torch
-from PIL import Image
+
+# Time allowed to import this module, checked by probe
+IMPORT_BUDGET_SECONDS = 0.5
+HEAVY_MODULES = ("torch", "diffusers", "transformers", "PIL", "numpy")
+
+# Commands served by the worker, besides ping, release and shutdown
+WORKER_COMMANDS = ("generate", "generate_batch", "probe", "list_devices", "cache_status")
+
+
+# Model of the x4 upscaler option
+X4_UPSCALER = "stabilityai/stable-diffusion-x4-upscaler"
+
+
+def output_maps(image, pack: bool = False, upscale: tuple = None, tileable: bool = False,
+                basecolor=None) -> dict:
+    r'''
+    Maps of a pipeline output, upscaled to upscale=(height, width, upscaler) if given, see plan_upscale.
+    basecolor replaces the base color map of the output, e.g. with the one of the model upscaler.
+    '''
+    from map_writer import pack_maps, pipeline_maps
+
+    maps = pipeline_maps(image)
+    if basecolor is not None:
+        maps["basecolor"] = basecolor
+    if upscale is not None:
+        from upscale import upscale_maps
+        maps = upscale_maps(maps, upscale[0], upscale[1], wrap=tileable)
+    if pack:
+        maps = pack_maps(maps)
+    return maps
+
+
+def plan_upscale(kwargs: dict):
+    r'''
+    Pops the upscaling options from kwargs. When upscale_from is below the requested size, the pipeline is set
+    to diffuse with a longest side of upscale_from, and (height, width, upscaler) of the requested size is
+    returned for output_maps. Returns None otherwise.
+    '''
+    upscale_from = kwargs.pop("upscale_from", 0)
+    upscaler = kwargs.pop("upscaler", "resample")
+    height, width = kwargs.get("height", 512), kwargs.get("width", 512)
+    if not upscale_from or upscale_from >= max(height, width):
+        return None
+
+    from upscale import native_size
+    kwargs["height"], kwargs["width"] = native_size(height, width, upscale_from)
+    print(f"Generating at {kwargs['width']}x{kwargs['height']}, upscaling to {width}x{height} ({upscaler})")
+    return height, width, upscaler
+
+
+def save_maps(maps: dict, save_dir: Path, map_formats: dict = None, compress_level: int = 6) -> dict:
+    from map_writer import write_maps
+
+    manifest = write_maps(maps, save_dir, map_formats, compress_level)
+    for name, stats in manifest["maps"].items():
+        print(f"Saved {stats['file']} in {stats['seconds']:.2f}s ({stats['bytes'] / 2**20:.1f} MB)")
+    return manifest
+
+
+def make_generator(device: str, seed: int):
+    r'''
+    Random generator for the pipeline, seeded with seed or with a random seed when seed is negative.
+    '''
+    import torch
+
+    generator = torch.Generator(device)
+    if seed is not None and seed >= 0:
+        generator.manual_seed(seed)
+    else:
+        generator.seed()
+    return generator
+
+
+def free_memory(device: str):
+    r'''
+    Free memory of the device in bytes, or None when it cannot be read.
+    '''
+    import torch
+
+    if device == "cuda" and torch.cuda.is_available():
+        free, _ = torch.cuda.mem_get_info()
+        return free
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        return None
+
+
+def auto_batch_size(device: str, precision: str, height: int, width: int) -> int:
+    r'''
+    Estimates how many materials fit in a single pipeline call, from the free memory of the device.
+    '''
+    # Rough activation memory of one 512x512 fp16 sample, scaled with the number of pixels
+    per_sample = 1.5 * 2**30 * (height * width) / (512 * 512)
+    if precision == "fp32":
+        per_sample *= 2
+
+    free = free_memory(device)
+    if free is None:
+        return 1
+    return max(1, int(free * 0.8 // per_sample))
+
+
+def generation_context(pipe, precision: str, device: str, kwargs: dict, tiled: bool = False,
+                       tile_memory_gb: float = 0):
+    r'''
+    Context of a pipeline call, see inference_context. When tiled, the UNet runs on latent tiles fitting in
+    tile_memory_gb (or 80% of the free memory when 0), and the pipeline's own patched mode is disabled in kwargs.
+    '''
+    import contextlib
+    from pipeline_cache import inference_context
+
+    context = contextlib.ExitStack()
+    context.enter_context(inference_context(precision, device))
+    if tiled:
+        from tiling import GB, tiled_unet
+
+        budget = tile_memory_gb * GB if tile_memory_gb > 0 else (free_memory(device) or 4 * GB) * 0.8
+        kwargs["patched"] = False
+        context.enter_context(tiled_unet(pipe, budget, tileable=kwargs.get("tileable", False)))
+    return context
+
+
+class ProgressReporter(object):
+    r'''
+    Emits a progress event at every denoising step:
+        {"event": "progress", "step": 3, "total": 50, "elapsed": 1.2, "eta": 18.8, "steps_per_second": 2.5, "label": ""}
+    '''
+
+    def __init__(self, emit, total_steps: int, label: str = ""):
+        self.emit = emit
+        self.total_steps = total_steps
+        self.label = label
+        self.start = time.time()
+
+    def step(self, step: int):
+        elapsed = time.time() - self.start
+        done = step + 1
+        self.emit({
+            "event": "progress",
+            "step": done,
+            "total": self.total_steps,
+            "elapsed": elapsed,
+            "eta": elapsed / done * max(self.total_steps - done, 0),
+            "steps_per_second": done / elapsed if elapsed > 0 else 0.0,
+            "label": self.label,
+        })
+
+    def pipeline_kwargs(self, pipe) -> dict:
+        r'''
+        Step callback arguments for the pipeline call, depending on the callback API it supports.
+        '''
+        parameters = inspect.signature(pipe.__call__).parameters
+
+        if "callback_on_step_end" in parameters:
+            def on_step_end(pipe, step, timestep, callback_kwargs):
+                self.step(step)
+                return callback_kwargs
+            return {"callback_on_step_end": on_step_end}
+
+        if "callback" in parameters:
+            def on_step(step, timestep, latents):
+                self.step(step)
+            return {"callback": on_step, "callback_steps": 1}
+
+        print("The pipeline does not support step callbacks, progress will not be reported")
+        return {}
 
 
 class SDInterfaceCommands(object):
+    def __init__(self):
+        # Created on first use, see pipelines
+        self._pipelines = None
+        self._cache_budgets = (0, 0)
+        # Shared memory blocks handed to the add-on, by name, until it releases them
+        self._shared = {}
+        # Protocol channel used by the worker to talk to the add-on
+        self._channel = None
+        # Prompt embeddings and decoded image prompts, see encoded_prompts
+        self._embeddings = None
+        self._image_prompts = None
+        # (model, prompt type) whose prompts the pipeline cannot encode on their own
+        self._unencodable = set()
+
+    @property
+    def pipelines(self):
+        if self._pipelines is None:
+            from pipeline_cache import PipelineCache
+            self._pipelines = PipelineCache(*self._cache_budgets)
+        return self._pipelines
+
+    def _pipeline_stats(self):
+        return self._pipelines.stats() if self._pipelines is not None else None
+
+    def _emit(self, message: dict):
+        r'''
+        Writes a JSON message on the worker channel, or on stdout when run as a single command.
+        '''
+        channel = self._channel or sys.stdout
+        channel.write(json.dumps(message, default=str) + "\n")
+        channel.flush()
+
+    def load_pipeline(self, model_path: str, precision: str, device: str, scheduler: str, free_u: bool,
+                      kwargs: dict):
+        r'''
+        Gets the pipeline from the cache, applying the CPU options found in kwargs:
+            cpu_threads, cpu_interop_threads: torch thread pools, 0 keeps the default
+            torch_compile: compiles the UNet, with the compiled graphs stored in compile_cache_dir
+            quantized_cache_dir: where the int8-cpu precision stores the quantized components
+        '''
+        from pipeline_cache import configure_threads
+
+        threads = kwargs.pop("cpu_threads", 0)
+        interop_threads = kwargs.pop("cpu_interop_threads", 0)
+        compile = kwargs.pop("torch_compile", False)
+        compile_cache_dir = kwargs.pop("compile_cache_dir", None)
+        quantized_cache_dir = kwargs.pop("quantized_cache_dir", None)
+        if device == "cpu":
+            configure_threads(threads, interop_threads)
+
+        return self.pipelines.get(
+            model_path, precision, device, scheduler=scheduler, free_u=free_u,
+            compile=compile, compile_cache_dir=compile_cache_dir, quantized_cache_dir=quantized_cache_dir,
+        )
+
+    def load_prompts(self, prompt_type: str, sources, cache_dir: str = None):
+        r'''
+        Prompts of the pipeline call: the texts, or the image prompts decoded and resized through the image
+        prompt cache (kept in memory, and on disk in cache_dir if given). A list for a list of sources.
+        '''
+        if prompt_type != "image":
+            return sources
+
+        from image_prompt import ImagePromptCache
+
+        if self._image_prompts is None or self._image_prompts.cache_dir != (Path(cache_dir) if cache_dir else None):
+            self._image_prompts = ImagePromptCache(cache_dir)
+        if isinstance(sources, list):
+            return [self._image_prompts.get(source) for source in sources]
+        return self._image_prompts.get(sources)
+
+    def prompt_cache_stats(self) -> dict:
+        return {
+            "image_prompts": self._image_prompts.stats() if self._image_prompts is not None else None,
+            "embeddings": self._embeddings.stats() if self._embeddings is not None else None,
+        }
+
+    def encoded_prompts(self, pipe, prompt_type: str, sources, model_path: str, precision: str, device: str,
+                        kwargs: dict):
+        r'''
+        Prompt argument of the pipeline call, see load_prompts. With use_embedding_cache in kwargs and a pipeline
+        accepting prompt_embeds, the prompts are encoded once and reused from the embedding cache (kept in memory,
+        and on disk in embedding_cache_dir if given): the embeddings are added to kwargs and None is returned.
+        Image prompts are only decoded when their embeddings are not cached. When encode_prompt rejects the
+        prompts (e.g. a text encoder given image prompts), they are passed to the pipeline call uncached.
+        sources: text prompts or image prompt paths, a list for batches
+        '''
+        use_cache = kwargs.pop("use_embedding_cache", False)
+        cache_dir = kwargs.pop("embedding_cache_dir", None)
+        image_cache_dir = kwargs.pop("image_prompt_cache_dir", None)
+        if not use_cache or (model_path, prompt_type) in self._unencodable:
+            return self.load_prompts(prompt_type, sources, image_cache_dir)
+
+        from embedding_cache import EmbeddingCache, embedding_key, encode, supports_embeddings
+        if not supports_embeddings(pipe):
+            print("The pipeline does not accept prompt embeddings, prompts will not be cached")
+            return self.load_prompts(prompt_type, sources, image_cache_dir)
+
+        import torch
+        from pipeline_cache import model_revision
+
+        if self._embeddings is None or self._embeddings.cache_dir != (Path(cache_dir) if cache_dir else None):
+            self._embeddings = EmbeddingCache(cache_dir)
+
+        guidance = kwargs.get("guidance_scale", 7.5) > 1
+        revision = model_revision(model_path)
+
+        encoded = []
+        for source in sources if isinstance(sources, list) else [sources]:
+            key = embedding_key(model_path, revision, precision, prompt_type, source, guidance)
+            embeddings = self._embeddings.get(key)
+            if embeddings is None:
+                prompt = self.load_prompts(prompt_type, source, image_cache_dir)
+                start = time.time()
+                try:
+                    embeddings = encode(pipe, prompt, device, guidance)
+                except (TypeError, ValueError) as e:
+                    print(f"The pipeline cannot encode {prompt_type} prompts ({e}), prompts will not be cached")
+                    self._unencodable.add((model_path, prompt_type))
+                    return self.load_prompts(prompt_type, sources, image_cache_dir)
+                self._embeddings.put(key, embeddings, time.time() - start)
+            encoded.append(embeddings)
+
+        for name in encoded[0]:
+            kwargs[name] = torch.cat([embeddings[name] for embeddings in encoded]).to(device)
+        return None
+
+    def model_upscale(self, image, prompt, precision: str, device: str):
+        r'''
+        Upscales an image 4x with the Stable Diffusion x4 upscaler, kept loaded in the pipeline cache.
+        '''
+        from pipeline_cache import inference_context
+
+        upscaler = self.pipelines.get(X4_UPSCALER, "fp32" if precision == "int8-cpu" else precision, device)
+        with inference_context(precision, device):
+            return upscaler(
+                prompt=prompt if isinstance(prompt, str) else "",
+                image=image.convert("RGB"),
+                num_inference_steps=20,
+            ).images[0]
+
     def generate(self,
                 name: str,
                 prompt_type: str,
@@ -19,56 +337,327 @@ class SDInterfaceCommands(object):
                 ):
         save_dir = Path(save_path) / name
         save_dir.mkdir(exist_ok=True, parents=True)
-        
-        if prompt_type == "text":
-            prompt = prompt
-        elif prompt_type == "image":
+
+        if prompt_type == "image":
             assert Path(prompt).exists(), f"Image prompt path not found at {prompt}"
-            prompt = Image.open(prompt).resize((512,512))
-
-        if precision == "fp32":
-            torch_dtype = torch.float32
-        elif precision == "fp16":
-            torch_dtype = torch.float16
-        else:
-            raise ValueError(f"Unrecognized precision value {precision}")
-
-        pipe = DiffusionPipeline.from_pretrained(
-            model_path,
-            trust_remote_code=True,
-            low_cpu_mem_usage=False, 
-            device_map=None,
-            torch_dtype=torch_dtype,
-        )
-        
-        # Enable memory optimization
-        pipe.enable_vae_tiling()
-        pipe.to(device)
-        pipe.enable_xformers_memory_efficient_attention()
-        
+
         free_u = kwargs.pop("free_u", None)
-        if free_u:
-            pipe.enable_freeu(s1=0.9, s2=0.2, b1=1.1, b2=1.2)
-        
         scheduler = kwargs.pop("scheduler", "ddim")
-        if scheduler == "ddim":
-            pipe.scheduler = DDIMScheduler.from_config(pipe.scheduler.config)
-        elif scheduler == "euler":
-            pipe.scheduler = EulerDiscreteScheduler.from_config(pipe.scheduler.config)
-        else:
-            raise NotImplementedError(f"Scheduler {scheduler} not supported")
-        
-        with torch.inference_mode():
+        seed = kwargs.pop("seed", -1)
+        map_formats = kwargs.pop("map_formats", None)
+        compress_level = kwargs.pop("compress_level", 6)
+        transfer = kwargs.pop("transfer", "disk")
+        write_to_disk = kwargs.pop("write_to_disk", True)
+        pack = kwargs.pop("pack_maps", False)
+        tiled = kwargs.pop("tiled_generation", False)
+        tile_memory_gb = kwargs.pop("tile_memory_gb", 0)
+        upscale = plan_upscale(kwargs)
+        pipe = self.load_pipeline(model_path, precision, device, scheduler, free_u, kwargs)
+
+        kwargs["generator"] = make_generator(device, seed)
+        pipe_prompt = self.encoded_prompts(pipe, prompt_type, prompt, model_path, precision, device, kwargs)
+        print(f"Prompt caches: {self.prompt_cache_stats()}")
+
+        progress = ProgressReporter(self._emit, kwargs.get("num_inference_steps", 50))
+        with generation_context(pipe, precision, device, kwargs, tiled, tile_memory_gb):
             image = pipe(
-                prompt,
+                pipe_prompt,
+                **progress.pipeline_kwargs(pipe),
                 **kwargs
             ).images[0]
-            
-        image.basecolor.save(save_dir / "basecolor.png")
-        image.normal.save(save_dir / "normal.png")
-        image.height.save(save_dir / "height.png")
-        image.roughness.save(save_dir / "roughness.png")
-        image.metallic.save(save_dir / "metallic.png")
-    
+
+        basecolor = None
+        if upscale is not None and upscale[2] == "x4":
+            basecolor = self.model_upscale(image.basecolor, prompt if prompt_type == "text" else "", precision, device)
+        maps = output_maps(image, pack, upscale, kwargs.get("tileable", False), basecolor)
+
+        # Shared memory only outlives the request in worker mode
+        if transfer == "shm" and self._channel is not None:
+            from map_writer import FORMATS, share_maps
+
+            blocks, shared = share_maps(maps)
+            self._shared.update({block.name: block for block in blocks})
+            if write_to_disk:
+                map_formats = map_formats or {}
+                for map_name in shared:
+                    shared[map_name]["file"] = f"{map_name}.{FORMATS[map_formats.get(map_name, 'png')]}"
+                # Written after the result is sent, the worker waits for it before exiting
+                threading.Thread(
+                    target=save_maps, args=(maps, save_dir, map_formats, compress_level)
+                ).start()
+            return {"shared_maps": shared, "prompt_cache": self.prompt_cache_stats()}
+
+        manifest = save_maps(maps, save_dir, map_formats, compress_level)
+        return {**manifest, "prompt_cache": self.prompt_cache_stats()}
+
+    def release(self, names: list):
+        r'''
+        Frees the shared memory blocks of a generation once the add-on has read them.
+        '''
+        for name in names:
+            block = self._shared.pop(name, None)
+            if block is not None:
+                block.close()
+                block.unlink()
+
+    def generate_batch(self,
+                prompt_type: str,
+                prompts: list,
+                save_path: Path,
+                model_path: str,
+                precision: str,
+                device: str,
+                names: list = None,
+                seeds: list = None,
+                batch_size: int = 0,
+                **kwargs
+                ):
+        r'''
+        Generates one material for each (prompt, seed) pair of the prompts x seeds grid, running
+        batch_size pairs per pipeline call. With batch_size 0 the batch size is chosen from the
+        available memory, and halved whenever a batch does not fit.
+        Maps of the i-th material are saved in save_path/names[i].
+        '''
+        import torch
+
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        if isinstance(seeds, int):
+            seeds = [seeds]
+        seeds = seeds or [-1]
+        jobs = [(prompt, seed) for prompt in prompts for seed in seeds]
+        names = names or [f"batch_{i:03d}" for i in range(len(jobs))]
+        assert len(names) == len(jobs), f"Expected {len(jobs)} names, got {len(names)}"
+
+        free_u = kwargs.pop("free_u", None)
+        scheduler = kwargs.pop("scheduler", "ddim")
+        kwargs.pop("seed", None)
+        map_formats = kwargs.pop("map_formats", None)
+        compress_level = kwargs.pop("compress_level", 6)
+        pack = kwargs.pop("pack_maps", False)
+        tiled = kwargs.pop("tiled_generation", False)
+        tile_memory_gb = kwargs.pop("tile_memory_gb", 0)
+        upscale = plan_upscale(kwargs)
+        pipe = self.load_pipeline(model_path, precision, device, scheduler, free_u, kwargs)
+
+        if not batch_size:
+            batch_size = auto_batch_size(device, precision, kwargs.get("height", 512), kwargs.get("width", 512))
+        batch_size = max(1, min(batch_size, len(jobs)))
+
+        start = time.time()
+        done = 0
+        while done < len(jobs):
+            batch = jobs[done:done + batch_size]
+            generators = [make_generator(device, seed) for _, seed in batch]
+            batch_kwargs = dict(kwargs)
+            batch_prompts = self.encoded_prompts(
+                pipe, prompt_type, [prompt for prompt, _ in batch], model_path, precision, device, batch_kwargs,
+            )
+            progress = ProgressReporter(
+                self._emit,
+                kwargs.get("num_inference_steps", 50),
+                label=f"Materials {done + 1}-{done + len(batch)}/{len(jobs)}",
+            )
+            try:
+                with generation_context(pipe, precision, device, batch_kwargs, tiled, tile_memory_gb):
+                    images = pipe(
+                        batch_prompts,
+                        generator=generators,
+                        **progress.pipeline_kwargs(pipe),
+                        **batch_kwargs
+                    ).images
+            except torch.cuda.OutOfMemoryError:
+                if batch_size == 1:
+                    raise
+                batch_size //= 2
+                torch.cuda.empty_cache()
+                print(f"Out of memory, reducing batch size to {batch_size}")
+                continue
+
+            for image, (prompt, _), name in zip(images, batch, names[done:done + batch_size]):
+                save_dir = Path(save_path) / name
+                save_dir.mkdir(exist_ok=True, parents=True)
+                basecolor = None
+                if upscale is not None and upscale[2] == "x4":
+                    text = prompt if prompt_type == "text" else ""
+                    basecolor = self.model_upscale(image.basecolor, text, precision, device)
+                maps = output_maps(image, pack, upscale, kwargs.get("tileable", False), basecolor)
+                save_maps(maps, save_dir, map_formats, compress_level)
+            done += len(batch)
+            print(f"Generated {done}/{len(jobs)} materials")
+
+        elapsed = time.time() - start
+        materials_per_minute = len(jobs) / elapsed * 60
+        print(f"Generated {len(jobs)} materials in {elapsed:.1f}s ({materials_per_minute:.1f} materials/min)")
+        return {
+            "names": names,
+            "batch_size": batch_size,
+            "elapsed": elapsed,
+            "materials_per_minute": materials_per_minute,
+            "prompt_cache": self.prompt_cache_stats(),
+        }
+
+    def probe(self) -> dict:
+        r'''
+        Cheap check that the environment runs, answered without importing the heavy dependencies.
+        '''
+        return {
+            "ok": True,
+            "python": platform.python_version(),
+            "executable": sys.executable,
+            "import_seconds": IMPORT_SECONDS,
+            "import_budget_seconds": IMPORT_BUDGET_SECONDS,
+            "within_budget": IMPORT_SECONDS <= IMPORT_BUDGET_SECONDS,
+            "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+        }
+
+    def list_devices(self) -> dict:
+        r'''
+        Available render devices. GPUs are listed through nvidia-smi unless torch is already loaded.
+        '''
+        devices = [{"type": "cpu", "name": platform.processor() or platform.machine(), "threads": os.cpu_count()}]
+
+        if "torch" in sys.modules:
+            torch = sys.modules["torch"]
+            for index in range(torch.cuda.device_count()):
+                free, total = torch.cuda.mem_get_info(index)
+                devices.append({
+                    "type": "cuda",
+                    "index": index,
+                    "name": torch.cuda.get_device_name(index),
+                    "memory_total_mb": total // 2**20,
+                    "memory_free_mb": free // 2**20,
+                })
+            return {"devices": devices}
+
+        try:
+            output = subprocess.run(
+                ["nvidia-smi", "--query-gpu=index,name,memory.total,memory.free", "--format=csv,noheader,nounits"],
+                capture_output=True, text=True, timeout=2, check=True,
+            ).stdout
+        except (OSError, subprocess.SubprocessError):
+            output = ""
+
+        for line in output.strip().splitlines():
+            index, name, total, free = [field.strip() for field in line.split(",")]
+            devices.append({
+                "type": "cuda",
+                "index": int(index),
+                "name": name,
+                "memory_total_mb": int(total),
+                "memory_free_mb": int(free),
+            })
+        return {"devices": devices}
+
+    def cache_status(self, result_cache_dir: str = None) -> dict:
+        r'''
+        Usage of the caches: loaded pipelines (in worker mode) and, if its directory is given, the result cache.
+        '''
+        status = {"pipelines": self._pipeline_stats(), **self.prompt_cache_stats()}
+
+        if result_cache_dir:
+            from result_cache import ResultCache
+            entries = ResultCache(result_cache_dir).entries()
+            status["result_cache"] = {
+                "entries": len(entries),
+                "bytes": sum(meta["size"] for _, meta in entries),
+            }
+        return status
+
+    def run_request(self, request_path: str):
+        r'''
+        Runs the command of a JSON request file written by the add-on, {"cmd": "generate", "kwargs": {...}}, so that
+        the arguments do not go through the quoting rules of the shell. Same commands as the worker.
+        '''
+        with open(request_path) as f:
+            request = json.load(f)
+        if request.get("cmd") not in WORKER_COMMANDS:
+            raise ValueError(f"Unknown command {request.get('cmd')}")
+        return getattr(self, request["cmd"])(**request.get("kwargs", {}))
+
+    def serve(self, idle_timeout: float = 600, ram_budget_gb: float = 0, vram_budget_gb: float = 0):
+        r'''
+        Runs as a long-lived worker that keeps the pipeline loaded between generations.
+        Requests are read from stdin and responses written to stdout, one JSON object per line.
+        Progress events (see ProgressReporter) may be written before the result of a request:
+            {"cmd": "generate", "kwargs": {...}} -> {"event": "result", "ok": true, "output": ...}
+            (same for the other WORKER_COMMANDS)
+            {"cmd": "ping"}                      -> {"event": "result", "ok": true, "cache": {...}}
+            {"cmd": "release", "kwargs": {...}}  -> {"event": "result", "ok": true}
+            {"cmd": "shutdown"}                  -> {"event": "result", "ok": true}
+        The worker exits after idle_timeout seconds without requests, or when stdin is closed.
+        Loaded pipelines are kept within ram_budget_gb / vram_budget_gb, see PipelineCache.
+        '''
+        self._cache_budgets = (ram_budget_gb, vram_budget_gb)
+
+        # Keep library prints off the protocol channel
+        self._channel = sys.stdout
+        sys.stdout = sys.stderr
+
+        requests = queue.Queue()
+
+        def read_requests():
+            for line in sys.stdin:
+                requests.put(line)
+            requests.put(None)
+
+        threading.Thread(target=read_requests, daemon=True).start()
+        started = time.time()
+
+        while True:
+            try:
+                line = requests.get(timeout=idle_timeout)
+            except queue.Empty:
+                print(f"Worker idle for {idle_timeout}s, shutting down")
+                break
+            if line is None:
+                break
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                self._emit({"event": "result", "ok": False, "error": f"Malformed request: {e}"})
+                continue
+
+            cmd = request.get("cmd")
+            if cmd == "ping":
+                self._emit({
+                    "event": "result",
+                    "ok": True,
+                    "cache": self._pipeline_stats(),
+                    "uptime": time.time() - started,
+                })
+            elif cmd == "shutdown":
+                self._emit({"event": "result", "ok": True})
+                break
+            elif cmd == "release":
+                self.release(**request.get("kwargs", {}))
+                self._emit({"event": "result", "ok": True})
+            elif cmd in WORKER_COMMANDS:
+                try:
+                    output = getattr(self, cmd)(**request.get("kwargs", {}))
+                    self._emit({"event": "result", "ok": True, "output": output, "cache": self._pipeline_stats()})
+                except Exception as e:
+                    self._emit({"event": "result", "ok": False, "error": repr(e)})
+            else:
+                self._emit({"event": "result", "ok": False, "error": f"Unknown command {cmd}"})
+
+        self.release(list(self._shared))
+
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+
+
+def serialize(result):
+    r'''
+    Prints command results as JSON, so that the add-on can parse them.
+    '''
+    if isinstance(result, (dict, list)):
+        return json.dumps(result, default=str)
+    return result
+
+
 if __name__ == '__main__':
-    fire.Fire(SDInterfaceCommands)
\ No newline at end of file
+    fire.Fire(SDInterfaceCommands, serialize=serialize)
@@ -1,5 +1,11 @@
+import json
+import os
+import time
+
 import bpy
 
+MAP_NAMES = ("basecolor", "normal", "height", "roughness", "metallic")
+
 def create_node(nodes, type, name, location=(0, 0), hide=True, width=150):
     new_node = nodes.new(type)
     new_node.name = name
@@ -9,106 +15,399 @@ def create_node(nodes, type, name, location=(0, 0), hide=True, width=150):
     return new_node
 
 
-def load_map_image(node, img_path, name, colorspace="sRGB"):
-    node.image = bpy.data.images.load(img_path)
-    node.image.colorspace_settings.name = colorspace
-    node.image.name = name
+# Image texture node of each map in the generated materials
+MAP_NODES = {
+    "basecolor": "DiffuseNode",
+    "normal": "NormalNode",
+    "height": "HeightNode",
+    "roughness": "RoughnessNode",
+    "metallic": "MetallicNode",
+    "packed": "PackedNode",
+}
 
+# Image name and color space of each map
+MAP_IMAGES = {
+    "basecolor": ("Base Color", "sRGB"),
+    "normal": ("Normal", "Non-Color"),
+    "height": ("Height", "Non-Color"),
+    "roughness": ("Roughness", "Non-Color"),
+    "metallic": ("Metallic", "Non-Color"),
+    # Height, roughness and metallic in the R, G, B channels
+    "packed": ("Height Roughness Metallic", "Non-Color"),
+}
 
-def load_texture_maps(mat_dir, mat_name):
-    mat_dir = mat_dir / mat_name
-    mat_name = f"M_MC_{mat_name}"
-    material = bpy.data.materials.new(mat_name)
 
-    # Set node tree editing
+# Shared node group wiring the maps to the Principled BSDF, and the materials copied for each generated material
+PBR_GROUP = "MC_PBR"
+# Names starting with a dot are hidden from the material lists
+TEMPLATE_MATERIALS = {False: ".MC_PBR_Template", True: ".MC_PBR_Template_Packed"}
+
+
+def image_index():
+    """
+    Images of the .blend file by normalized file path, see find_image.
+    """
+    return {
+        os.path.normpath(bpy.path.abspath(image.filepath)): image
+        for image in bpy.data.images if image.filepath and image.source == "FILE"
+    }
+
+
+def find_image(img_path, index=None):
+    """
+    Image of the .blend file loaded from the given file path, if any. Generated images (maps handed over in shared
+    memory whose file is not written yet) are skipped, reloading them would blank them. Loading many materials,
+    pass an image_index to avoid going through all the images for every map.
+    """
+    img_path = os.path.normpath(img_path)
+    if index is not None:
+        return index.get(img_path)
+    for image in bpy.data.images:
+        if image.filepath and image.source == "FILE" and os.path.normpath(bpy.path.abspath(image.filepath)) == img_path:
+            return image
+    return None
+
+
+def load_map_image(img_path, name, colorspace="sRGB", index=None):
+    """
+    Loads a map, or reloads the pixels of the image already using its file, so that regenerated materials
+    do not pile up duplicate images.
+    """
+    image = find_image(img_path, index)
+    if image is not None:
+        image.reload()
+    else:
+        image = bpy.data.images.load(img_path)
+        image.name = name
+        if index is not None:
+            index[os.path.normpath(img_path)] = image
+    image.colorspace_settings.name = colorspace
+    return image
+
+
+def pixels_to_rgba(array):
+    """
+    Converts a HxW or HxWxC uint8/float array to the flat bottom-to-top RGBA float32 layout of Image.pixels.
+    """
+    import numpy as np
+
+    if array.dtype == np.uint8:
+        array = array.astype(np.float32) / 255
+    elif array.dtype == np.uint16:
+        array = array.astype(np.float32) / 65535
+    else:
+        array = array.astype(np.float32)
+    if array.ndim == 2:
+        array = array[:, :, None]
+
+    height, width, channels = array.shape
+    rgba = np.ones((height, width, 4), dtype=np.float32)
+    if channels == 1:
+        rgba[:, :, :3] = array
+    else:
+        rgba[:, :, :channels] = array[:, :, :4]
+    return rgba[::-1].ravel()
+
+
+def load_shared_map_image(shared, name, colorspace="sRGB", filepath=None):
+    """
+    Creates an image from the pixels of a map shared by the generation worker, without going through a file.
+    shared: {"name": shared memory block name, "shape": [...], "dtype": "|u1"}
+    filepath: where the worker is writing the map, if it is saved to disk
+    """
+    import numpy as np
+    from multiprocessing import shared_memory
+
+    block = shared_memory.SharedMemory(name=shared["name"])
+    if os.name != "nt":
+        # The worker owns the block, do not let the resource tracker unlink it when Blender exits
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(block._name, "shared_memory")
+
+    try:
+        array = np.ndarray(shared["shape"], dtype=np.dtype(shared["dtype"]), buffer=block.buf)
+        height, width = array.shape[:2]
+        float_buffer = array.dtype != np.uint8
+        # The image of a previous generation at the same file path gets the new pixels
+        image = find_image(filepath) if filepath is not None else None
+        if image is None or image.is_float != float_buffer:
+            image = bpy.data.images.new(name, width, height, alpha=False, float_buffer=float_buffer)
+        elif tuple(image.size) != (width, height):
+            image.scale(width, height)
+        image.colorspace_settings.name = colorspace
+        image.pixels.foreach_set(pixels_to_rgba(array))
+        del array
+    finally:
+        block.close()
+
+    if filepath is not None:
+        image.filepath_raw = filepath
+    return image
+
+
+def map_paths(mat_dir):
+    """
+    Paths of the maps of a generated material, read from the maps.json manifest written by the map writer.
+    Directories without a manifest hold 8-bit PNGs.
+    """
+    manifest_path = mat_dir / "maps.json"
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        return {name: mat_dir / stats["file"] for name, stats in manifest["maps"].items()}
+    return {name: mat_dir / f"{name}.png" for name in MAP_NAMES}
+
+
+def load_texture_maps(mat_dir, mat_name, assign=True, objects=None, all_slots=False, index=None):
+    paths = map_paths(mat_dir / mat_name)
+    images = {
+        map_name: load_map_image(path.as_posix(), *MAP_IMAGES[map_name], index=index)
+        for map_name, path in paths.items()
+    }
+    return create_material(mat_name, images, assign=assign, objects=objects, all_slots=all_slots)
+
+
+def is_material_dir(path):
+    return (path / "maps.json").exists() or (path / "basecolor.png").exists()
+
+
+def load_material_library(library_dir):
+    """
+    Creates an unassigned material for every directory of generated maps in library_dir, in a single pass:
+    the template materials and the image index are built once for all of them.
+    """
+    index = image_index()
+    mat_dirs = sorted(path for path in library_dir.iterdir() if path.is_dir() and is_material_dir(path))
+    return [load_texture_maps(library_dir, path.name, assign=False, index=index) for path in mat_dirs]
+
+
+def reload_texture_maps(material, mat_dir, mat_name, objects=None, all_slots=False):
+    """
+    Reloads the images of material from the maps generated again in mat_dir/mat_name, updating the material
+    in place. Falls back to load_texture_maps when the maps were saved to other files (e.g. another format).
+    """
+    paths = {os.path.normpath(path) for path in map_paths(mat_dir / mat_name).values()}
+    images = [
+        node.image for node in material.node_tree.nodes
+        if node.bl_idname == "ShaderNodeTexImage" and node.image is not None
+    ]
+    if not images or any(os.path.normpath(bpy.path.abspath(image.filepath)) not in paths for image in images):
+        return load_texture_maps(mat_dir, mat_name, objects=objects, all_slots=all_slots)
+
+    for image in images:
+        image.reload()
+    return material
+
+
+def load_shared_maps(shared_maps, mat_dir, mat_name, assign=True, objects=None, all_slots=False, since=None):
+    """
+    Same as load_texture_maps, for maps handed over in shared memory by the generation worker.
+    Maps the worker saves are switched to their files once written, see watch_map_files, the others are packed
+    in the .blend file. Generated images would otherwise be lost when the file is closed.
+    since: time the generation started, the maps are written after it
+    """
+    images = {}
+    written = []
+    for map_name, shared in shared_maps.items():
+        name, colorspace = MAP_IMAGES[map_name]
+        filepath = (mat_dir / mat_name / shared["file"]).as_posix() if "file" in shared else None
+        images[map_name] = load_shared_map_image(shared, name, colorspace, filepath)
+        if filepath is not None:
+            written.append(images[map_name])
+        else:
+            images[map_name].pack()
+
+    if written:
+        watch_map_files(written, mat_dir / mat_name / "maps.json", since if since is not None else time.time())
+    return create_material(mat_name, images, assign=assign, objects=objects, all_slots=all_slots)
+
+
+def watch_map_files(images, manifest_path, since, timeout=300):
+    """
+    Switches images loaded from shared memory to the map files the worker writes in the background, once the
+    manifest (written after the maps) is newer than since. Images whose files are not written within timeout
+    seconds of this call, when the maps are handed over, are packed instead. Polled by a timer.
+    """
+    handed_over = time.time()
+
+    def check():
+        if manifest_path.exists() and manifest_path.stat().st_mtime >= since:
+            for image in images:
+                try:
+                    image.source = "FILE"
+                    image.reload()
+                except ReferenceError:
+                    # Removed in the meantime
+                    pass
+            return None
+
+        if time.time() - handed_over > timeout:
+            print(f"Maps not written to {manifest_path.parent} after {timeout}s, packing them in the .blend file")
+            for image in images:
+                try:
+                    image.pack()
+                except ReferenceError:
+                    pass
+            return None
+        return 0.5
+
+    bpy.app.timers.register(check, first_interval=0.5)
+
+
+def assign_material(material, objects, all_slots=False):
+    """
+    Assigns material to the first slot, or to every slot with all_slots, of each object accepting materials.
+    Objects sharing their mesh are only assigned once.
+    """
+    assigned = set()
+    for obj in objects:
+        if not hasattr(obj.data, "materials") or obj.data in assigned:
+            continue
+        assigned.add(obj.data)
+        if not obj.material_slots:
+            obj.data.materials.append(material)
+        elif all_slots:
+            for slot in obj.material_slots:
+                slot.material = material
+        else:
+            obj.material_slots[0].material = material
+
+
+def pbr_node_group():
+    """
+    The MC_PBR shader node group, created on first use: maps in, BSDF and displacement out.
+    """
+    group = bpy.data.node_groups.get(PBR_GROUP)
+    if group is not None:
+        return group
+
+    group = bpy.data.node_groups.new(PBR_GROUP, "ShaderNodeTree")
+    group.interface.new_socket("Base Color", in_out="INPUT", socket_type="NodeSocketColor")
+    group.interface.new_socket("Normal", in_out="INPUT", socket_type="NodeSocketColor")
+    group.interface.new_socket("Height", in_out="INPUT", socket_type="NodeSocketFloat")
+    group.interface.new_socket("Roughness", in_out="INPUT", socket_type="NodeSocketFloat")
+    group.interface.new_socket("Metallic", in_out="INPUT", socket_type="NodeSocketFloat")
+    group.interface.new_socket("BSDF", in_out="OUTPUT", socket_type="NodeSocketShader")
+    group.interface.new_socket("Displacement", in_out="OUTPUT", socket_type="NodeSocketVector")
+
+    nodes = group.nodes
+    input_node = create_node(nodes, "NodeGroupInput", "GroupInput", location=(-400, 0), hide=False)
+    output_node = create_node(nodes, "NodeGroupOutput", "GroupOutput", location=(400, 0), hide=False)
+    bsdf_node = create_node(nodes, "ShaderNodeBsdfPrincipled", "Principled BSDF", hide=False, width=240)
+    normal_shader_node = create_node(
+        nodes, "ShaderNodeNormalMap", "NormalShaderNode", location=(-200, -150), hide=True
+    )
+    displacement_shader_node = create_node(
+        nodes, "ShaderNodeDisplacement", "DisplacementNode", location=(200, -250), hide=True
+    )
+
+    group.links.new(input_node.outputs["Base Color"], bsdf_node.inputs["Base Color"])
+    group.links.new(input_node.outputs["Normal"], normal_shader_node.inputs["Color"])
+    group.links.new(normal_shader_node.outputs["Normal"], bsdf_node.inputs["Normal"])
+    group.links.new(input_node.outputs["Roughness"], bsdf_node.inputs["Roughness"])
+    group.links.new(input_node.outputs["Metallic"], bsdf_node.inputs["Metallic"])
+    group.links.new(input_node.outputs["Height"], displacement_shader_node.inputs["Height"])
+    group.links.new(bsdf_node.outputs["BSDF"], output_node.inputs["BSDF"])
+    group.links.new(displacement_shader_node.outputs["Displacement"], output_node.inputs["Displacement"])
+    return group
+
+
+def template_material(packed=False):
+    """
+    Material with the image nodes of the maps wired to an MC_PBR node, created on first use. Generated materials
+    are copies of it with their images assigned, instead of building the same node tree node by node.
+    With packed, height, roughness and metallic are read from the channels of a single image.
+    """
+    material = bpy.data.materials.get(TEMPLATE_MATERIALS[packed])
+    if material is not None:
+        return material
+
+    material = bpy.data.materials.new(TEMPLATE_MATERIALS[packed])
     material.use_nodes = True
-    bpy.data.materials.new(mat_name)
+    material.use_fake_user = True
     nodes = material.node_tree.nodes
-    bsdf_node = nodes.get("Principled BSDF")
+    links = material.node_tree.links
+    nodes.remove(nodes.get("Principled BSDF"))
     output_node = nodes.get("Material Output")
 
-    basecolor_image_path = (mat_dir / "basecolor.png").as_posix()
-    normal_image_path = (mat_dir / "normal.png").as_posix()
-    roughness_image_path = (mat_dir / "roughness.png").as_posix()
-    height_image_path = (mat_dir / "height.png").as_posix()
-    metallic_image_path = (mat_dir / "metallic.png").as_posix()
+    pbr_node = create_node(nodes, "ShaderNodeGroup", "PBRNode", location=(0, 200), hide=False, width=200)
+    pbr_node.node_tree = pbr_node_group()
 
-    # Create a new image texture node for the texture maps
     basecolor_map_node = create_node(
-        nodes, "ShaderNodeTexImage", "DiffuseNode", location=(-200, 300), hide=True
-    )
-    metallic_map_node = create_node(
-        nodes, "ShaderNodeTexImage", "MetallicNode", location=(-200, 250), hide=True
-    )
-    roughness_map_node = create_node(
-        nodes, "ShaderNodeTexImage", "RoughnessNode", location=(-200, 200), hide=True
+        nodes, "ShaderNodeTexImage", MAP_NODES["basecolor"], location=(-300, 300), hide=True
     )
     normal_map_node = create_node(
-        nodes, "ShaderNodeTexImage", "NormalNode", location=(-250, 100), hide=True
-    )
-    normal_shader_node = create_node(
-        nodes,
-        "ShaderNodeNormalMap",
-        "NormalShaderNode",
-        location=(-200, 150),
-        hide=True,
-    )
-    height_map_node = create_node(
-        nodes, "ShaderNodeTexImage", "HeightNode", location=(300, 100), hide=True
-    )
-    displacement_shader_node = create_node(
-        nodes,
-        "ShaderNodeDisplacement",
-        "DisplacementNode",
-        location=(350, 150),
-        hide=True,
+        nodes, "ShaderNodeTexImage", MAP_NODES["normal"], location=(-300, 250), hide=True
     )
+    links.new(basecolor_map_node.outputs["Color"], pbr_node.inputs["Base Color"])
+    links.new(normal_map_node.outputs["Color"], pbr_node.inputs["Normal"])
 
-    # Load the texture images
-    load_map_image(
-        basecolor_map_node, basecolor_image_path, name="Base Color", colorspace="sRGB"
-    )
-    load_map_image(
-        height_map_node, height_image_path, name="Height", colorspace="Non-Color"
-    )
-    load_map_image(
-        metallic_map_node, metallic_image_path, name="Metallic", colorspace="Non-Color"
-    )
-    load_map_image(
-        roughness_map_node,
-        roughness_image_path,
-        name="Roughness",
-        colorspace="Non-Color",
-    )
-    load_map_image(
-        normal_map_node, normal_image_path, name="Normal", colorspace="Non-Color"
-    )
+    if packed:
+        packed_map_node = create_node(
+            nodes, "ShaderNodeTexImage", MAP_NODES["packed"], location=(-350, 200), hide=True
+        )
+        separate_node = create_node(
+            nodes, "ShaderNodeSeparateColor", "SeparateNode", location=(-200, 200), hide=True
+        )
+        links.new(packed_map_node.outputs["Color"], separate_node.inputs["Color"])
+        links.new(separate_node.outputs["Red"], pbr_node.inputs["Height"])
+        links.new(separate_node.outputs["Green"], pbr_node.inputs["Roughness"])
+        links.new(separate_node.outputs["Blue"], pbr_node.inputs["Metallic"])
+    else:
+        for location, map_name, socket in (
+            ((-300, 200), "height", "Height"),
+            ((-300, 150), "roughness", "Roughness"),
+            ((-300, 100), "metallic", "Metallic"),
+        ):
+            map_node = create_node(nodes, "ShaderNodeTexImage", MAP_NODES[map_name], location=location, hide=True)
+            links.new(map_node.outputs["Color"], pbr_node.inputs[socket])
 
-    # Connect the texture nodes to the Principled BSDF inputs
-    material.node_tree.links.new(
-        basecolor_map_node.outputs["Color"], bsdf_node.inputs["Base Color"]
-    )
-    material.node_tree.links.new(
-        normal_map_node.outputs["Color"], normal_shader_node.inputs["Color"]
-    )
-    material.node_tree.links.new(
-        normal_shader_node.outputs["Normal"], bsdf_node.inputs["Normal"]
-    )
-    material.node_tree.links.new(
-        roughness_map_node.outputs["Color"], bsdf_node.inputs["Roughness"]
-    )
-    material.node_tree.links.new(
-        height_map_node.outputs["Color"], displacement_shader_node.inputs["Height"]
-    )
-    material.node_tree.links.new(
-        metallic_map_node.outputs["Color"], bsdf_node.inputs["Metallic"]
-    )
+    links.new(pbr_node.outputs["BSDF"], output_node.inputs["Surface"])
+    links.new(pbr_node.outputs["Displacement"], output_node.inputs["Displacement"])
+    return material
 
-    # Connect the output of the height node to the Material Output displacement node's input
-    material.node_tree.links.new(
-        displacement_shader_node.outputs["Displacement"],
-        output_node.inputs["Displacement"],
-    )
 
-    # Add created material to the active object
-    bpy.context.active_object.data.materials[0] = material
+def has_map_nodes(material, images):
+    """
+    Whether the node tree of a generated material has the image nodes of images, packed or not.
+    """
+    nodes = material.node_tree.nodes
+    if ("packed" in images) != (nodes.get(MAP_NODES["packed"]) is not None):
+        return False
+    return all(nodes.get(MAP_NODES[map_name]) is not None for map_name in images)
+
+
+def create_material(mat_name, images, assign=True, objects=None, all_slots=False):
+    """
+    Creates the M_MC_{mat_name} material as a copy of the template material, with the map images assigned,
+    and assigns it to objects (the active object by default), see assign_material.
+    images: map name -> image. With a "packed" image, height, roughness and metallic are read from its channels.
+    An existing M_MC_{mat_name} material is reused: its image nodes get the new images. If its nodes do not
+    match the maps, it is replaced by a new copy everywhere it is used.
+    """
+    mat_name = f"M_MC_{mat_name}"
+    material = bpy.data.materials.get(mat_name)
+    if material is None or not material.use_nodes or not has_map_nodes(material, images):
+        previous = material
+        material = template_material("packed" in images).copy()
+        material.use_fake_user = False
+        if previous is not None:
+            previous.user_remap(material)
+            bpy.data.materials.remove(previous)
+        material.name = mat_name
+
+    nodes = material.node_tree.nodes
+    for map_name, image in images.items():
+        nodes.get(MAP_NODES[map_name]).image = image
+    return finish_material(material, assign, objects, all_slots)
+
+
+def finish_material(material, assign=True, objects=None, all_slots=False):
+    if not assign:
+        # Keep unassigned materials when saving the .blend file
+        material.use_fake_user = True
+        return material
+
+    # Add created material to the given objects, or to the active one
+    assign_material(material, objects or [bpy.context.active_object], all_slots)
+    return material
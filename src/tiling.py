@@ -0,0 +1,135 @@
+import contextlib
+import math
+
+import torch
+
+GB = 2**30
+
+# Rough UNet activation memory per latent pixel of one sample in fp16 (1.5 GB for a 64x64 latent, 512x512 image)
+BYTES_PER_LATENT_PIXEL = 1.5 * GB / (64 * 64)
+
+# Smallest tile side in latent pixels (256 image pixels), below which the model loses the context of the material
+MIN_TILE = 32
+
+
+def tile_size(budget_bytes: float, batch: int, element_size: int = 2) -> int:
+    r'''
+    Side of the square latent tiles whose UNet pass fits in budget_bytes, a multiple of 8.
+    batch: samples per UNet call, including the classifier-free guidance duplicates
+    '''
+    per_pixel = BYTES_PER_LATENT_PIXEL * batch * element_size / 2
+    side = int(math.sqrt(budget_bytes / per_pixel)) // 8 * 8
+    return max(side, MIN_TILE)
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> list:
+    r'''
+    Start of the tiles covering [0, length), overlapping by at least overlap. The last tile ends at length.
+    '''
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, tile - overlap))
+    return starts + [length - tile]
+
+
+def feather(tile: int, overlap: int, device, dtype) -> torch.Tensor:
+    r'''
+    1D blending weights of a tile, ramping up over the overlap on both sides. Never 0, so that borders covered
+    by a single tile keep their value once normalized.
+    '''
+    weights = torch.ones(tile, device=device, dtype=dtype)
+    if overlap > 0:
+        ramp = torch.arange(1, overlap + 1, device=device, dtype=dtype) / (overlap + 1)
+        weights[:overlap] = ramp
+        weights[-overlap:] = ramp.flip(0)
+    return weights
+
+
+def wrap_pad(sample: torch.Tensor, overlap: int) -> torch.Tensor:
+    r'''
+    Appends the first overlap rows and columns after the last ones, so that tiles also cover the border
+    between the right and left (bottom and top) edges of a tileable material.
+    '''
+    sample = torch.cat([sample, sample[:, :, :overlap]], dim=2)
+    return torch.cat([sample, sample[:, :, :, :overlap]], dim=3)
+
+
+def wrap_fold(canvas: torch.Tensor, height: int, width: int) -> torch.Tensor:
+    r'''
+    Inverse of wrap_pad for accumulated values: adds the appended rows and columns back onto the first ones.
+    '''
+    canvas = canvas.clone()
+    overlap_h, overlap_w = canvas.shape[-2] - height, canvas.shape[-1] - width
+    canvas[..., :overlap_h, :] += canvas[..., height:, :]
+    canvas = canvas[..., :height, :]
+    canvas[..., :, :overlap_w] += canvas[..., :, width:]
+    return canvas[..., :, :width]
+
+
+class TiledForward(object):
+    """
+    Replacement of unet.forward running the UNet on overlapping latent tiles and blending the noise predictions
+    with feathered weights, so that the activation memory depends on the tile size and not on the resolution.
+    With tileable, tiles wrap around the borders so that the material stays seamless.
+    """
+
+    def __init__(self, forward, budget_bytes: float, tileable: bool = False, element_size: int = 2):
+        self.forward = forward
+        self.budget_bytes = budget_bytes
+        self.tileable = tileable
+        self.element_size = element_size
+        self.tiles = 0
+
+    def __call__(self, sample, timestep, *args, **kwargs):
+        batch, _, height, width = sample.shape
+        tile = tile_size(self.budget_bytes, batch, self.element_size)
+        if height <= tile and width <= tile:
+            return self.forward(sample, timestep, *args, **kwargs)
+
+        tile_h, tile_w = min(tile, height), min(tile, width)
+        overlap = max(tile // 4 // 8 * 8, 8)
+        canvas = wrap_pad(sample, overlap) if self.tileable else sample
+
+        prediction = torch.zeros(canvas.shape, device=sample.device, dtype=torch.float32)
+        weight = torch.zeros(canvas.shape[-2:], device=sample.device, dtype=torch.float32)
+        weights_h = feather(tile_h, min(overlap, tile_h // 2), sample.device, torch.float32)
+        weights_w = feather(tile_w, min(overlap, tile_w // 2), sample.device, torch.float32)
+        tile_weight = weights_h[:, None] * weights_w[None, :]
+
+        output = None
+        for top in tile_starts(canvas.shape[-2], tile_h, overlap):
+            for left in tile_starts(canvas.shape[-1], tile_w, overlap):
+                output = self.forward(
+                    canvas[:, :, top:top + tile_h, left:left + tile_w], timestep, *args, **kwargs
+                )
+                noise = output[0] if isinstance(output, tuple) else output.sample
+                prediction[:, :, top:top + tile_h, left:left + tile_w] += noise.float() * tile_weight
+                weight[top:top + tile_h, left:left + tile_w] += tile_weight
+                self.tiles += 1
+
+        if self.tileable:
+            prediction = wrap_fold(prediction, height, width)
+            weight = wrap_fold(weight, height, width)
+        prediction = (prediction / weight).to(sample.dtype)
+
+        # Same output type as the wrapped forward: a tuple with return_dict=False, an output dataclass otherwise
+        if isinstance(output, tuple):
+            return (prediction,)
+        return type(output)(sample=prediction)
+
+
+@contextlib.contextmanager
+def tiled_unet(pipe, budget_bytes: float, tileable: bool = False):
+    r'''
+    Runs the UNet of the pipeline on tiles fitting in budget_bytes for the duration of the context.
+    '''
+    unet = pipe.unet
+    element_size = next(unet.parameters()).element_size()
+    tiled = TiledForward(unet.forward, budget_bytes, tileable, element_size)
+    unet.forward = tiled
+    try:
+        yield tiled
+    finally:
+        del unet.forward
+        if tiled.tiles:
+            print(f"Denoised {tiled.tiles} latent tiles")
@@ -0,0 +1,108 @@
+import numpy as np
+from PIL import Image
+
+from map_writer import to_channel, to_float
+
+# Resampling kernel of each map. Roughness and metallic use linear interpolation, cubic overshoots on their edges
+MAP_KERNELS = {
+    "basecolor": "cubic",
+    "normal": "cubic",
+    "height": "cubic",
+    "roughness": "linear",
+    "metallic": "linear",
+}
+
+# Maps stored in a single channel
+GRAY_MAPS = ("height", "roughness", "metallic")
+
+
+def native_size(height: int, width: int, resolution: int) -> tuple:
+    r'''
+    Size to diffuse at before upscaling to height x width: longest side resolution, same aspect, multiples of 8.
+    '''
+    scale = resolution / max(height, width)
+    return max(8, round(height * scale / 8) * 8), max(8, round(width * scale / 8) * 8)
+
+
+def cubic_weights(distance: np.ndarray, a: float = -0.5) -> np.ndarray:
+    r'''
+    Keys cubic convolution kernel, the bicubic filter of most image editors.
+    '''
+    distance = np.abs(distance)
+    near = ((a + 2) * distance - (a + 3)) * distance**2 + 1
+    far = ((a * distance - 5 * a) * distance + 8 * a) * distance - 4 * a
+    return np.where(distance <= 1, near, np.where(distance < 2, far, 0))
+
+
+def taps(src: int, dst: int, kernel: str = "cubic", wrap: bool = False):
+    r'''
+    Source indices and weights of every output pixel along one axis, as two (dst, taps) arrays.
+    With wrap, indices past the borders wrap around, so that tileable maps stay seamless.
+    '''
+    position = (np.arange(dst) + 0.5) * src / dst - 0.5
+    base = np.floor(position).astype(np.int64)
+    fraction = position - base
+
+    if kernel == "cubic":
+        offsets = np.arange(-1, 3)
+        weights = cubic_weights(fraction[:, None] - offsets[None, :])
+    elif kernel == "linear":
+        offsets = np.arange(0, 2)
+        weights = np.stack([1 - fraction, fraction], axis=1)
+    else:
+        raise ValueError(f"Unrecognized kernel {kernel}")
+
+    indices = base[:, None] + offsets[None, :]
+    indices = indices % src if wrap else np.clip(indices, 0, src - 1)
+    return indices, weights.astype(np.float32)
+
+
+def resample(array: np.ndarray, height: int, width: int, kernel: str = "cubic", wrap: bool = False) -> np.ndarray:
+    r'''
+    Separable upscaling of a float HxW or HxWxC array, one tap at a time to bound the temporary memory.
+    Downscaling goes through PIL's antialiased Lanczos filter instead.
+    '''
+    if height < array.shape[0] or width < array.shape[1]:
+        channels = array[:, :, None] if array.ndim == 2 else array
+        resized = np.stack([
+            np.asarray(Image.fromarray(np.ascontiguousarray(channels[:, :, c])).resize((width, height), Image.LANCZOS))
+            for c in range(channels.shape[2])
+        ], axis=-1)
+        return resized[:, :, 0] if array.ndim == 2 else resized
+
+    indices, weights = taps(array.shape[0], height, kernel, wrap)
+    rows = np.zeros((height,) + array.shape[1:], dtype=np.float32)
+    for tap in range(indices.shape[1]):
+        tap_weights = weights[:, tap].reshape((-1,) + (1,) * (array.ndim - 1))
+        rows += tap_weights * array[indices[:, tap]]
+
+    indices, weights = taps(array.shape[1], width, kernel, wrap)
+    result = np.zeros((height, width) + array.shape[2:], dtype=np.float32)
+    for tap in range(indices.shape[1]):
+        tap_weights = weights[:, tap].reshape((1, -1) + (1,) * (array.ndim - 2))
+        result += tap_weights * rows[:, indices[:, tap]]
+    return result
+
+
+def upscale_map(name: str, image, height: int, width: int, wrap: bool = False) -> np.ndarray:
+    r'''
+    Resamples a map to height x width as a float array in [0, 1]. Normals are resampled as vectors and
+    renormalized, single channel maps are resampled once instead of once per RGB channel.
+    '''
+    array = to_float(to_channel(image) if name in GRAY_MAPS else image)
+    kernel = MAP_KERNELS.get(name, "cubic")
+
+    if name == "normal":
+        vectors = resample(array[:, :, :3] * 2 - 1, height, width, kernel, wrap)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-6)
+        return vectors * 0.5 + 0.5
+
+    return np.clip(resample(array, height, width, kernel, wrap), 0, 1)
+
+
+def upscale_maps(maps: dict, height: int, width: int, wrap: bool = False) -> dict:
+    r'''
+    Upscales the maps of a material to height x width, see upscale_map. The float results keep their
+    precision when saved as 16-bit PNG or EXR.
+    '''
+    return {name: upscale_map(name, image, height, width, wrap) for name, image in maps.items()}
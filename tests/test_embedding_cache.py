@@ -0,0 +1,68 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from sd_functions import SDInterfaceCommands
+
+
+class TextOnlyPipeline(object):
+    """
+    Pipeline whose prompt encoder, like the CLIP text encoder, only accepts text prompts.
+    """
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode_prompt(self, prompt, device, num_images_per_prompt, do_classifier_free_guidance):
+        if not isinstance(prompt, str):
+            raise ValueError(f"`prompt` has to be of type `str` or `list` but is {type(prompt)}")
+        self.encoded.append(prompt)
+        return torch.ones(1, 4, 8), torch.zeros(1, 4, 8)
+
+    def __call__(self, prompt=None, prompt_embeds=None, negative_prompt_embeds=None, guidance_scale=7.5):
+        pass
+
+
+def cache_kwargs():
+    return {"use_embedding_cache": True, "embedding_cache_dir": None, "guidance_scale": 7.5}
+
+
+def test_text_prompts_are_encoded_once():
+    commands = SDInterfaceCommands()
+    pipe = TextOnlyPipeline()
+
+    for _ in range(2):
+        kwargs = cache_kwargs()
+        assert commands.encoded_prompts(pipe, "text", "Red Bricks", "model", "fp32", "cpu", kwargs) is None
+        assert kwargs["prompt_embeds"].shape == (1, 4, 8)
+        assert kwargs["negative_prompt_embeds"].shape == (1, 4, 8)
+        assert "use_embedding_cache" not in kwargs
+
+    assert pipe.encoded == ["Red Bricks"]
+
+
+def test_image_prompts_fall_back_to_uncached_call(tmp_path):
+    image_path = tmp_path / "photo.png"
+    Image.new("RGB", (64, 64), (200, 40, 40)).save(image_path)
+    commands = SDInterfaceCommands()
+    pipe = TextOnlyPipeline()
+
+    for _ in range(2):
+        kwargs = cache_kwargs()
+        prompt = commands.encoded_prompts(pipe, "image", str(image_path), "model", "fp32", "cpu", kwargs)
+        assert isinstance(prompt, Image.Image)
+        assert "prompt_embeds" not in kwargs
+        assert "use_embedding_cache" not in kwargs
+
+    batch = commands.encoded_prompts(pipe, "image", [str(image_path)] * 2, "model", "fp32", "cpu", cache_kwargs())
+    assert len(batch) == 2
+    assert commands.prompt_cache_stats()["image_prompts"]["misses"] == 1
+    assert pipe.encoded == []
@@ -0,0 +1,32 @@
+import os
+import sys
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from image_prompt import ImagePromptCache, prompt_digest
+
+
+def test_replaced_file_with_same_mtime_is_hashed_again(tmp_path):
+    path = tmp_path / "photo.png"
+    Image.new("RGB", (64, 64), (200, 40, 40)).save(path)
+    stat = os.stat(path)
+    cache = ImagePromptCache()
+    assert cache.get(path).getpixel((0, 0)) == (200, 40, 40)
+
+    replacement = tmp_path / "replacement.png"
+    Image.new("RGB", (64, 64), (40, 200, 40)).save(replacement)
+    os.utime(replacement, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(replacement, path)
+
+    assert os.stat(path).st_mtime_ns == stat.st_mtime_ns
+    assert cache.get(path).getpixel((0, 0)) == (40, 200, 40)
+    assert cache.misses == 2
+
+
+def test_unchanged_file_keeps_its_digest(tmp_path):
+    path = tmp_path / "photo.png"
+    Image.new("RGB", (16, 16)).save(path)
+    assert prompt_digest(path) == prompt_digest(str(path))
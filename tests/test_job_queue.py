@@ -0,0 +1,104 @@
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parents[1]
+sys.path.insert(0, str(ROOT / "benchmarks"))
+sys.path.insert(0, str(ROOT))
+
+import bpy_stub
+
+# job_queue runs generations through helpers, which imports bpy
+bpy_stub.install()
+
+from src.job_queue import APPLIED, CANCELLED, DONE, FAILED, PENDING, RUNNING, JobJournal, JobQueue
+
+
+def test_journal_replays_state_changes(tmp_path):
+    journal = JobJournal(tmp_path / "queue.jsonl")
+    journal.append({"id": "a", "state": PENDING, "arguments": {"prompt": "bricks"}})
+    journal.append({"id": "b", "state": PENDING, "arguments": {"prompt": "wood"}})
+    journal.append({"id": "a", "state": RUNNING, "started": 1.0})
+    journal.append({"id": "a", "state": DONE})
+
+    jobs = journal.load()
+    assert list(jobs) == ["a", "b"]
+    assert jobs["a"] == {"id": "a", "state": DONE, "arguments": {"prompt": "bricks"}, "started": 1.0}
+    assert jobs["b"]["state"] == PENDING
+
+
+def test_journal_skips_truncated_lines(tmp_path):
+    path = tmp_path / "queue.jsonl"
+    journal = JobJournal(path)
+    journal.append({"id": "a", "state": PENDING})
+    with open(path, "a") as f:
+        f.write('{"id": "a", "sta')
+    assert journal.load()["a"]["state"] == PENDING
+
+
+def test_load_forgets_finished_jobs_and_reruns_interrupted_ones(tmp_path):
+    path = tmp_path / "queue.jsonl"
+    journal = JobJournal(path)
+    for job_id, state in [("applied", APPLIED), ("cancelled", CANCELLED), ("running", RUNNING),
+                          ("failed", FAILED), ("done", DONE)]:
+        journal.append({"id": job_id, "state": PENDING})
+        journal.append({"id": job_id, "state": state})
+
+    queue = JobQueue(path, tmp_path / "venv")
+    queue.load()
+    assert {job_id: job["state"] for job_id, job in queue.jobs.items()} == {
+        "running": PENDING, "failed": FAILED, "done": DONE,
+    }
+    # Compacted to one line per remembered job
+    assert len(path.read_text().splitlines()) == 3
+    assert JobJournal(path).load() == queue.jobs
+
+
+def test_queue_survives_a_restart(tmp_path):
+    path = tmp_path / "queue.jsonl"
+    queue = JobQueue(path, tmp_path / "venv")
+    first = queue.add("generate", {"prompt": "bricks"}, {"blend_file": "scene.blend"})
+    second = queue.add("generate", {"prompt": "wood"})
+    queue.cancel(second["id"])
+
+    restarted = JobQueue(path, tmp_path / "venv")
+    restarted.load()
+    assert list(restarted.jobs) == [first["id"]]
+    assert restarted.jobs[first["id"]]["target"] == {"blend_file": "scene.blend"}
+    assert restarted.busy
+
+
+def test_done_jobs_are_applied_once(tmp_path):
+    queue = JobQueue(tmp_path / "queue.jsonl", tmp_path / "venv")
+    job = queue.add("generate", {})
+    queue.update(job, state=DONE)
+    applied = []
+
+    queue.tick(lambda job: False)
+    assert job["state"] == DONE
+    queue.tick(lambda job: applied.append(job["id"]) or True)
+    queue.tick(lambda job: applied.append(job["id"]) or True)
+    assert applied == [job["id"]]
+    assert job["state"] == APPLIED
+
+    failing = queue.add("generate", {})
+    queue.update(failing, state=DONE)
+    queue.tick(lambda job: 1 / 0)
+    assert failing["state"] == FAILED and "division by zero" in failing["error"]
+
+
+def test_relocate_moves_the_jobs(tmp_path):
+    queue = JobQueue(tmp_path / "old" / "queue.jsonl", tmp_path / "old" / "venv")
+    job = queue.add("generate", {"prompt": "bricks"})
+    JobJournal(tmp_path / "new" / "queue.jsonl").append({"id": "other", "state": RUNNING})
+
+    queue.relocate(tmp_path / "new" / "queue.jsonl", tmp_path / "new" / "venv")
+    queue.add("generate", {"prompt": "wood"})
+    assert queue.venv_path == tmp_path / "new" / "venv"
+
+    jobs = JobJournal(tmp_path / "new" / "queue.jsonl").load()
+    assert job["id"] in jobs and jobs["other"]["state"] == PENDING
+    assert len(jobs) == 3
+    assert [json.loads(line)["id"] for line in (tmp_path / "old" / "queue.jsonl").read_text().splitlines()] == [
+        job["id"],
+    ]
@@ -0,0 +1,147 @@
+import json
+import struct
+import sys
+import zlib
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from map_writer import pack_maps, webp_method, write_exr_half, write_maps, write_png16
+
+
+def read_png16(path):
+    """
+    Decodes the unfiltered 16-bit PNGs written by write_png16.
+    """
+    data = Path(path).read_bytes()
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    offset, chunks = 8, {}
+    while offset < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[offset:offset + 8])
+        body = data[offset + 8:offset + 8 + length]
+        assert struct.unpack(">I", data[offset + 8 + length:offset + 12 + length])[0] == zlib.crc32(chunk_type + body)
+        chunks[chunk_type] = chunks.get(chunk_type, b"") + body
+        offset += 12 + length
+
+    width, height, depth, color_type = struct.unpack(">IIBB", chunks[b"IHDR"][:10])
+    assert depth == 16
+    channels = {0: 1, 2: 3, 6: 4}[color_type]
+    scanlines = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=np.uint8).reshape(height, -1)
+    assert (scanlines[:, 0] == 0).all()
+    array = scanlines[:, 1:].copy().view(">u2").astype(np.uint16)
+    return array.reshape(height, width) if channels == 1 else array.reshape(height, width, channels)
+
+
+def read_exr_half(path):
+    """
+    Decodes the uncompressed half-float scanline EXRs written by write_exr_half, as {channel: HxW array}.
+    """
+    data = Path(path).read_bytes()
+    assert struct.unpack("<ii", data[:8]) == (20000630, 2)
+    offset, attributes = 8, {}
+    while data[offset] != 0:
+        name_end = data.index(b"\0", offset)
+        type_end = data.index(b"\0", name_end + 1)
+        size = struct.unpack("<i", data[type_end + 1:type_end + 5])[0]
+        attributes[data[offset:name_end].decode()] = data[type_end + 5:type_end + 5 + size]
+        offset = type_end + 5 + size
+    offset += 1
+
+    names, chlist = [], attributes["channels"]
+    while chlist[0] != 0:
+        name_end = chlist.index(b"\0")
+        names.append(chlist[:name_end].decode())
+        # Half pixel type, no subsampling
+        assert struct.unpack("<iB3xii", chlist[name_end + 1:name_end + 17]) == (1, 0, 1, 1)
+        chlist = chlist[name_end + 17:]
+    assert attributes["compression"] == b"\0"
+    _, _, max_x, max_y = struct.unpack("<iiii", attributes["dataWindow"])
+    width, height = max_x + 1, max_y + 1
+
+    offsets = np.frombuffer(data[offset:offset + 8 * height], dtype="<u8")
+    planes = {name: np.empty((height, width), dtype=np.float16) for name in names}
+    for y, block in enumerate(offsets):
+        line_y, size = struct.unpack("<ii", data[block:block + 8])
+        assert line_y == y and size == len(names) * width * 2
+        line = np.frombuffer(data[block + 8:block + 8 + size], dtype="<f2").reshape(len(names), width)
+        for name, values in zip(names, line):
+            planes[name][y] = values
+    return planes
+
+
+def gradient(height, width, channels):
+    values = np.linspace(0, 1, height * width * channels, dtype=np.float32)
+    return values.reshape(height, width, channels) if channels > 1 else values.reshape(height, width)
+
+
+def test_png16_round_trip(tmp_path):
+    for channels in (1, 3, 4):
+        image = gradient(5, 7, channels)
+        write_png16(tmp_path / "map.png", image, compress_level=1)
+        assert np.array_equal(read_png16(tmp_path / "map.png"), np.round(image * 65535).astype(np.uint16))
+
+
+def test_png16_gray_matches_pil(tmp_path):
+    image = gradient(4, 6, 1)
+    write_png16(tmp_path / "map.png", image)
+    with Image.open(tmp_path / "map.png") as decoded:
+        assert decoded.size == (6, 4)
+        assert np.array_equal(np.asarray(decoded), np.round(image * 65535).astype(np.uint16))
+
+
+def test_exr_half_round_trip(tmp_path):
+    color = gradient(3, 5, 3)
+    write_exr_half(tmp_path / "color.exr", color)
+    planes = read_exr_half(tmp_path / "color.exr")
+    assert sorted(planes) == ["B", "G", "R"]
+    for index, name in enumerate("RGB"):
+        assert np.array_equal(planes[name], color[:, :, index].astype(np.float16))
+
+    gray = gradient(3, 5, 1)
+    write_exr_half(tmp_path / "gray.exr", gray)
+    planes = read_exr_half(tmp_path / "gray.exr")
+    assert list(planes) == ["Y"]
+    assert np.array_equal(planes["Y"], gray.astype(np.float16))
+
+
+def test_uint8_input_is_scaled(tmp_path):
+    image = np.array([[0, 255]], dtype=np.uint8)
+    write_png16(tmp_path / "map.png", image)
+    assert read_png16(tmp_path / "map.png").tolist() == [[0, 65535]]
+
+
+def test_write_maps_manifest(tmp_path):
+    maps = {
+        "basecolor": np.zeros((8, 8, 3), dtype=np.uint8),
+        "height": np.zeros((8, 8), dtype=np.uint8),
+        "normal": np.zeros((8, 8, 3), dtype=np.uint8),
+    }
+    manifest = write_maps(maps, tmp_path, {"height": "exr", "normal": "webp"}, compress_level=1)
+    with open(tmp_path / "maps.json") as f:
+        assert json.load(f) == manifest
+    assert {name: stats["file"] for name, stats in manifest["maps"].items()} == {
+        "basecolor": "basecolor.png", "height": "height.exr", "normal": "normal.webp",
+    }
+    for stats in manifest["maps"].values():
+        assert (tmp_path / stats["file"]).stat().st_size == stats["bytes"]
+
+
+def test_pack_maps_channels():
+    maps = {
+        "basecolor": np.zeros((2, 2, 3), dtype=np.uint8),
+        "height": np.full((2, 2), 10, dtype=np.uint8),
+        "roughness": np.full((2, 2, 3), 20, dtype=np.uint8),
+        "metallic": np.full((2, 2), 30, dtype=np.uint8),
+    }
+    packed = pack_maps(maps)
+    assert sorted(packed) == ["basecolor", "packed"]
+    assert packed["packed"][0, 0].tolist() == [10, 20, 30]
+
+
+def test_webp_method_range():
+    assert webp_method(6) == 4
+    assert webp_method(1) == 0
+    assert all(0 <= webp_method(level) <= 6 for level in range(10))
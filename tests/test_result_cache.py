@@ -0,0 +1,96 @@
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from result_cache import ResultCache, model_revision, request_key
+
+USER_INPUT = {
+    "prompt_type": "text",
+    "prompt": "red bricks",
+    "model_path": "org/model",
+    "precision": "fp16",
+    "device": "cuda",
+}
+
+
+def test_request_key_ignores_execution_arguments():
+    key = request_key(USER_INPUT, {"seed": 1, "num_inference_steps": 30})
+    assert key == request_key(USER_INPUT, {
+        "seed": 1, "num_inference_steps": 30, "transfer": "shm", "write_to_disk": True, "cpu_threads": 4,
+    })
+    assert key != request_key(USER_INPUT, {"seed": 2, "num_inference_steps": 30})
+    assert key != request_key(USER_INPUT, {"seed": 1, "num_inference_steps": 30}, model_revision="abc")
+    assert request_key(USER_INPUT, {"seed": -1}) is None
+
+
+def test_image_prompts_are_keyed_by_content(tmp_path):
+    first, second = tmp_path / "a.png", tmp_path / "b.png"
+    first.write_bytes(b"image")
+    second.write_bytes(b"image")
+    image_input = {**USER_INPUT, "prompt_type": "image"}
+    key = request_key({**image_input, "prompt": str(first)}, {"seed": 1})
+    assert key == request_key({**image_input, "prompt": str(second)}, {"seed": 1})
+    second.write_bytes(b"edited")
+    assert key != request_key({**image_input, "prompt": str(second)}, {"seed": 1})
+
+
+def write_material(mat_dir, files):
+    mat_dir.mkdir(parents=True, exist_ok=True)
+    for name in files:
+        (mat_dir / name).write_bytes(name.encode() * 100)
+    maps = {Path(name).stem: {"file": name} for name in files}
+    with open(mat_dir / "maps.json", "w") as f:
+        json.dump({"maps": maps}, f)
+
+
+def test_store_copies_only_manifest_maps(tmp_path):
+    mat_dir = tmp_path / "output" / "bricks"
+    write_material(mat_dir, ["basecolor.png", "normal.png"])
+    (mat_dir / "height.exr").write_bytes(b"left by an earlier generation")
+
+    cache = ResultCache(tmp_path / "cache")
+    cache.store("key", mat_dir)
+    assert sorted(path.name for path in cache.lookup("key").iterdir()) == [
+        "basecolor.png", "cache_entry.json", "maps.json", "normal.png",
+    ]
+
+    restored = tmp_path / "restored"
+    assert cache.restore("key", restored)
+    assert sorted(path.name for path in restored.iterdir()) == ["basecolor.png", "maps.json", "normal.png"]
+    assert not cache.restore("other", tmp_path / "missing")
+
+
+def test_store_without_manifest_is_skipped(tmp_path):
+    (tmp_path / "output").mkdir()
+    (tmp_path / "output" / "basecolor.png").write_bytes(b"png")
+    cache = ResultCache(tmp_path / "cache")
+    cache.store("key", tmp_path / "output")
+    assert cache.lookup("key") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    for key in ("old", "used", "new"):
+        write_material(tmp_path / key, ["basecolor.png"])
+        cache.store(key, tmp_path / key)
+        time.sleep(0.01)
+    entry_size = json.load(open(cache.lookup("new") / "cache_entry.json"))["size"]
+    time.sleep(0.01)
+    cache.lookup("used")
+
+    cache.max_size = 2 * entry_size
+    cache.evict()
+    assert cache.lookup("old") is None
+    assert cache.lookup("used") is not None and cache.lookup("new") is not None
+
+
+def test_model_revision(tmp_path):
+    refs = tmp_path / "models--org--model" / "refs"
+    refs.mkdir(parents=True)
+    (refs / "main").write_text("abc123\n")
+    assert model_revision("org/model", tmp_path) == "abc123"
+    assert model_revision("org/other", tmp_path) == ""
+    assert model_revision(str(tmp_path), tmp_path).isdigit()
@@ -0,0 +1,65 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from tiling import MIN_TILE, TiledForward, feather, tile_size, tile_starts, wrap_fold, wrap_pad
+
+
+def test_tile_starts_cover_the_length():
+    for length, tile, overlap in [(32, 32, 8), (80, 32, 8), (100, 48, 16)]:
+        starts = tile_starts(length, tile, overlap)
+        assert starts[0] == 0 and starts[-1] + tile == length
+        assert all(b - a <= tile - overlap for a, b in zip(starts, starts[1:]))
+
+
+def test_tile_size_bounds():
+    assert tile_size(0, 2) == MIN_TILE
+    assert tile_size(64 * 2**30, 2) % 8 == 0
+
+
+def test_feather_is_symmetric_and_positive():
+    weights = feather(32, 8, "cpu", torch.float32)
+    assert weights.min() > 0
+    assert torch.equal(weights, weights.flip(0))
+    assert torch.all(weights[8:-8] == 1)
+    assert torch.all(weights[:8][1:] > weights[:8][:-1])
+
+
+def test_wrap_fold_inverts_wrap_pad():
+    sample = torch.rand(1, 2, 12, 16)
+    padded = wrap_pad(sample, 4)
+    assert padded.shape == (1, 2, 16, 20)
+    assert torch.equal(padded[:, :, 12:, :16], sample[:, :, :4])
+    assert torch.equal(padded[:, :, :12, 16:], sample[:, :, :, :4])
+
+    # Wrapped rows and columns are counted twice when folded back, the wrapped corner four times
+    counts = wrap_fold(torch.ones(16, 20), 12, 16)
+    expected = torch.ones(12, 16)
+    expected[:4] *= 2
+    expected[:, :4] *= 2
+    assert torch.equal(counts, expected)
+
+
+def pointwise_forward(sample, timestep, return_dict=False):
+    return (sample * 2 + timestep,)
+
+
+@pytest.mark.parametrize("tileable", [False, True])
+def test_tiled_forward_matches_untiled_for_pointwise_models(tileable):
+    sample = torch.rand(1, 4, 80, 72)
+    tiled = TiledForward(pointwise_forward, budget_bytes=0, tileable=tileable, element_size=4)
+    output = tiled(sample, 1.0)
+    assert tiled.tiles > 1
+    assert torch.allclose(output[0], pointwise_forward(sample, 1.0)[0], atol=1e-5)
+
+
+def test_small_samples_are_not_tiled():
+    sample = torch.rand(1, 4, 16, 16)
+    tiled = TiledForward(pointwise_forward, budget_bytes=0)
+    assert torch.equal(tiled(sample, 0.0)[0], sample * 2)
+    assert tiled.tiles == 0
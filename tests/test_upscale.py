@@ -0,0 +1,73 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from upscale import native_size, resample, taps, upscale_map, upscale_maps
+
+
+def random_map(height, width, channels=None, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (height, width) if channels is None else (height, width, channels)
+    return rng.random(shape, dtype=np.float32)
+
+
+def test_taps_weights_sum_to_one():
+    for kernel in ("cubic", "linear"):
+        indices, weights = taps(16, 64, kernel)
+        assert np.allclose(weights.sum(axis=1), 1, atol=1e-6)
+        assert indices.min() >= 0 and indices.max() <= 15
+
+
+def test_wrap_upscale_commutes_with_roll():
+    # A tileable map shifted by a few pixels is upscaled to the same map shifted by twice as many
+    array = random_map(16, 16, 3)
+    upscaled = resample(array, 32, 32, "cubic", wrap=True)
+    shifted = resample(np.roll(array, (3, 5), axis=(0, 1)), 32, 32, "cubic", wrap=True)
+    assert np.allclose(shifted, np.roll(upscaled, (6, 10), axis=(0, 1)), atol=1e-5)
+
+
+def test_clamped_upscale_does_not_wrap():
+    array = np.zeros((8, 8), dtype=np.float32)
+    array[:, -1] = 1
+    assert np.allclose(resample(array, 16, 16, "linear", wrap=False)[:, 0], 0)
+    assert resample(array, 16, 16, "linear", wrap=True)[:, 0].min() > 0
+
+
+def test_constant_map_is_preserved():
+    array = np.full((8, 12), 0.25, dtype=np.float32)
+    assert np.allclose(resample(array, 32, 48, "cubic"), 0.25, atol=1e-6)
+
+
+def test_normals_are_renormalized():
+    normal = random_map(8, 8, 3)
+    upscaled = upscale_map("normal", normal, 32, 32, wrap=True)
+    lengths = np.linalg.norm(upscaled * 2 - 1, axis=-1)
+    assert upscaled.shape == (32, 32, 3)
+    assert np.allclose(lengths, 1, atol=1e-5)
+
+    flat = np.tile(np.array([0.5, 0.5, 1.0], dtype=np.float32), (8, 8, 1))
+    assert np.allclose(upscale_map("normal", flat, 16, 16), flat[0, 0], atol=1e-6)
+
+
+def test_gray_maps_are_single_channel():
+    maps = {
+        "roughness": (random_map(8, 8, 3) * 255).astype(np.uint8),
+        "basecolor": random_map(8, 8, 3),
+    }
+    upscaled = upscale_maps(maps, 24, 24)
+    assert upscaled["roughness"].shape == (24, 24)
+    assert upscaled["basecolor"].shape == (24, 24, 3)
+    assert all(0 <= array.min() and array.max() <= 1 for array in upscaled.values())
+
+
+def test_downscale_goes_through_pil():
+    assert resample(random_map(32, 32), 8, 8).shape == (8, 8)
+
+
+def test_native_size_keeps_aspect():
+    assert native_size(2048, 2048, 512) == (512, 512)
+    assert native_size(1024, 2048, 512) == (256, 512)
+    assert all(side % 8 == 0 for side in native_size(1000, 1500, 512))